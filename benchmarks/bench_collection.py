@@ -0,0 +1,106 @@
+# bench_collection.py
+# ../benchmarks/bench_collection.py
+# Offline benchmark of batched collection using the deterministic fake provider
+
+import os
+import sys
+import datetime
+import tempfile
+import argparse
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data_collection')))
+import config
+from price_store import SQLitePriceStore
+from providers import FakeProvider
+from fetcher import collect
+from utils import save_to_db, prepare_for_db, plan_fetch_windows, record_empty_fetches
+from bulk_writer import BulkWriter
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched collection against the offline fake provider")
+    parser.add_argument('--tickers', type=int, default=200)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=config.COLLECTION_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=config.COLLECTION_MAX_WORKERS)
+    parser.add_argument('--rate', type=float, default=20.0, help="Requests per second")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated seconds per request")
+    parser.add_argument('--failure-rate', type=float, default=0.1, help="Share of batches failing on first attempt")
+    args = parser.parse_args()
+
+    tickers = [f"FAKE{i:04d}" for i in range(args.tickers)]
+    end_date = datetime.date.today()
+    config.START_DATE = end_date - datetime.timedelta(days=365 * args.years)
+    provider = FakeProvider(max_batch_size=args.batch_size, latency=args.latency, failure_rate=args.failure_rate)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A ticker stored up to the run date (an intraday rerun) plans no window rather than an inverted one
+        store = SQLitePriceStore(os.path.join(tmp, 'raw_current.db'), config.RAW_COLUMNS)
+        for day in [end_date - datetime.timedelta(days=offset) for offset in range(7)]:
+            row = pd.DataFrame({'Date': [day], **{column: [1.0] for column in config.RAW_COLUMNS}})
+            store.write(store.frame_for_ticker('FAKE0000', row), replace=True)
+            assert plan_fetch_windows(['FAKE0000'], store, day) == {}, f"window planned past {day}"
+        print("Tickers stored up to the run date plan no window")
+
+        # Symbols throttled one at a time while the rest of their batch is answered are retried, not counted as
+        # tickers without data; with retries exhausted they are reported as failed
+        store = SQLitePriceStore(os.path.join(tmp, 'raw_throttled.db'), config.RAW_COLUMNS)
+        windows = plan_fetch_windows(tickers, store, end_date)
+        for max_retries, expected_failures in [(0, True), (2, False)]:
+            throttled = FakeProvider(max_batch_size=args.batch_size, symbol_failure_rate=0.3)
+            failed, stats = collect(windows, throttled, lambda data, ticker: save_to_db(data, ticker, store),
+                                    max_workers=args.workers, rate=1000, burst=1000, max_retries=max_retries,
+                                    backoff_seconds=0.01)
+            assert stats.tickers_empty == 0 and bool(failed) == expected_failures, stats.summary()
+            assert stats.tickers_fetched + stats.tickers_failed == len(tickers) and len(failed) == stats.tickers_failed
+        print(f"Throttled symbols retried: {stats.retries} retries, {stats.tickers_fetched} of {len(tickers)} fetched")
+
+        # Gaps and new tickers are only recorded when answered cleanly without data, are skipped while their entry is
+        # fresh and are requested again once it is older than its TTL
+        store = SQLitePriceStore(os.path.join(tmp, 'raw_gaps.db'), config.RAW_COLUMNS)
+        stored_days = [end_date - datetime.timedelta(days=offset) for offset in [40, 39, 38, 20, 19, 18]]
+        rows = pd.DataFrame({'Date': stored_days, **{column: [1.0] * len(stored_days) for column in config.RAW_COLUMNS}})
+        store.write(store.frame_for_ticker('GAPPY', rows), replace=True)
+        gap = (str(stored_days[2] + datetime.timedelta(days=1)), str(stored_days[3]))
+        known_gaps, empty_tickers = {}, {}
+        for symbol_failure_rate, recorded in [(1.0, False), (0.0, True)]:
+            windows = plan_fetch_windows(['GAPPY', 'GONE'], store, end_date, known_gaps, empty_tickers)
+            delisted = FakeProvider(delisted=['GAPPY', 'GONE'], symbol_failure_rate=symbol_failure_rate,
+                                    failures_per_batch=10)
+            _, stats = collect(windows, delisted, lambda data, ticker: save_to_db(data, ticker, store), rate=1000,
+                               burst=1000, max_retries=0)
+            known_gaps, empty_tickers = record_empty_fetches(store, stats.empty_windows, known_gaps, empty_tickers)
+            assert (gap in known_gaps.get('GAPPY', {})) == recorded and ('GONE' in empty_tickers) == recorded, \
+                (symbol_failure_rate, known_gaps, empty_tickers)
+        planned = plan_fetch_windows(['GAPPY', 'GONE'], store, end_date, known_gaps, empty_tickers)
+        assert all('GONE' not in tickers for tickers in planned.values()), planned
+        assert 'GAPPY' not in planned.get(tuple(datetime.date.fromisoformat(day) for day in gap), []), planned
+        expired = str(end_date - datetime.timedelta(days=max(config.KNOWN_GAP_TTL_DAYS, config.EMPTY_TICKER_TTL_DAYS)))
+        planned = plan_fetch_windows(['GAPPY', 'GONE'], store, end_date, {'GAPPY': {gap: expired}}, {'GONE': expired})
+        assert 'GONE' in planned.get((config.START_DATE, end_date), []), planned
+        assert 'GAPPY' in planned.get(tuple(datetime.date.fromisoformat(day) for day in gap), []), planned
+        print("Empty gaps and tickers recorded only when confirmed, skipped until their TTL passes")
+
+        for writer_mode in ['direct writes', 'single writer']:
+            store = SQLitePriceStore(os.path.join(tmp, f"raw_{writer_mode.replace(' ', '_')}.db"), config.RAW_COLUMNS)
+            for label in ['initial backfill', 'rerun (nothing missing)']:
+                windows = plan_fetch_windows(tickers, store, end_date)
+                if writer_mode == 'single writer':
+                    writer = BulkWriter(store)
+                    save = lambda data, ticker: writer.put(prepare_for_db(data, ticker, store))
+                else:
+                    writer = None
+                    save = lambda data, ticker: save_to_db(data, ticker, store)
+                failed, stats = collect(windows, provider, save, max_workers=args.workers, rate=args.rate,
+                                        burst=args.workers, backoff_seconds=0.05)
+                if writer:
+                    writer.close()
+                print(f"{writer_mode}, {label}: ", end='')
+                stats.report()
+                if writer:
+                    writer.report()
+                if failed:
+                    print(f"{len(failed)} tickers failed: {failed[:10]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# bench_feature_cache.py
+# ../benchmarks/bench_feature_cache.py
+# Benchmark of ridge forecasting with and without the shared calendar feature cache
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'prediction')))
+import prophet_config
+import feature_cache
+from models import RidgeModel
+
+# Function to build synthetic daily histories with a handful of different start dates
+def synthetic_histories(tickers, years):
+    rng = np.random.default_rng(0)
+    histories = {}
+    for i in range(tickers):
+        dates = pd.date_range(end='2024-02-28', periods=int(years * 365) - 30 * (i % 8), freq='D')
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+        histories[f"T{i:04d}"] = pd.DataFrame({'ds': dates, 'y': close})
+    return histories
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ridge forecasts with and without the calendar feature cache")
+    parser.add_argument('--tickers', type=int, default=400)
+    parser.add_argument('--years', type=float, default=10)
+    args = parser.parse_args()
+
+    histories = synthetic_histories(args.tickers, args.years)
+    model = RidgeModel()
+    horizon = prophet_config.FORECAST_HORIZON
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prophet_config.FEATURE_CACHE = False
+        start_time = time.perf_counter()
+        uncached = model.fit_predict(histories, horizon)
+        uncached_time = time.perf_counter() - start_time
+
+        prophet_config.FEATURE_CACHE = True
+        feature_cache.calendar_cache = feature_cache.CalendarCache(tmp)
+        start_time = time.perf_counter()
+        feature_cache.prepare_calendar([h['ds'].iloc[0] for h in histories.values()],
+                                       [h['ds'].iloc[-1] for h in histories.values()], horizon)
+        prepare_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        cached = model.fit_predict(histories, horizon)
+        cached_time = time.perf_counter() - start_time
+
+    for ticker in histories:
+        np.testing.assert_allclose(cached[ticker]['forecast']['yhat'], uncached[ticker]['forecast']['yhat'], rtol=1e-9)
+    print(f"Cached and uncached forecasts match for {len(histories)} tickers")
+    print(f"{len(histories)} tickers x ~{args.years:g} years, {len({len(h) for h in histories.values()})} calendars")
+    print(f"features rebuilt per calendar: {uncached_time:.3f}s")
+    print(f"shared calendar cache:        {cached_time:.3f}s (+{prepare_time:.3f}s to build it once), "
+          f"{uncached_time / cached_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bench_fill_engine.py
+# ../benchmarks/bench_fill_engine.py
+# Golden-output check and benchmark of the vectorized fill engine against the original iterrows loop
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data_cleaning')))
+from fill_engine import fill_daily_frame, fill_panel
+
+# Function reproducing the original per-row loop from data_cleaning.process_table (reference implementation)
+def legacy_fill(df_daily):
+    df_daily = df_daily.copy()
+    for date, row in df_daily.iterrows():
+        if date.weekday() in [5, 6]:  # Saturday or Sunday
+            if pd.isna(row['Close']):
+                df_daily.at[date, 'Close'] = df_daily.at[date - pd.DateOffset(days=date.weekday() - 4), 'Close']
+            if pd.isna(row['Open']):
+                next_monday = date + pd.DateOffset(days=7 - date.weekday())
+                if next_monday in df_daily.index:
+                    df_daily.at[date, 'Open'] = df_daily.at[next_monday, 'Open']
+    df_daily['Close'] = df_daily['Close'].interpolate(method='linear')
+    return df_daily
+
+# Function to build a daily-resampled frame shaped like the one process_table feeds to the fill step
+def synthetic_daily_frame(seed, start, years):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=int(years * 252))
+    keep = rng.random(len(dates)) > 0.04  # Drop ~4% of sessions to mimic holidays and missing data
+    keep[0] = True
+    dates = dates[keep]
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+    open_ = close * (1 + rng.normal(0, 0.002, len(dates)))
+    close[rng.random(len(dates)) < 0.01] = np.nan
+    open_[rng.random(len(dates)) < 0.01] = np.nan
+    df = pd.DataFrame({'Open': open_, 'Close': close}, index=pd.DatetimeIndex(dates, name='Date'))
+    df.index = df.index.tz_localize('US/Eastern', ambiguous='infer')
+    return df.resample('D').asfreq()
+
+# Function to time a callable over a number of repeats and return the best wall time in seconds
+def best_time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized fill engine with the original iterrows loop")
+    parser.add_argument('--tickers', type=int, default=20)
+    parser.add_argument('--years', type=float, default=6)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    starts = ['2018-01-02', '2018-03-05', '2019-10-28', '2020-11-02']
+    frames = {f"T{i:04d}": synthetic_daily_frame(i, starts[i % len(starts)], args.years) for i in range(args.tickers)}
+
+    # Golden-output check: every path must reproduce the original loop exactly
+    expected = {ticker: legacy_fill(df) for ticker, df in frames.items()}
+    panel = fill_panel(frames)
+    for ticker, df in frames.items():
+        pd.testing.assert_frame_equal(fill_daily_frame(df), expected[ticker], check_exact=True)
+        pd.testing.assert_frame_equal(panel[ticker], expected[ticker], check_exact=True)
+    print(f"Golden-output check passed for {len(frames)} tickers")
+
+    rows = sum(len(df) for df in frames.values())
+    legacy_time = best_time(lambda: [legacy_fill(df) for df in frames.values()], args.repeats)
+    vector_time = best_time(lambda: [fill_daily_frame(df) for df in frames.values()], args.repeats)
+    panel_time = best_time(lambda: fill_panel(frames), args.repeats)
+
+    print(f"{len(frames)} tickers, {rows} daily rows")
+    print(f"iterrows loop:    {legacy_time:.3f}s")
+    print(f"vectorized frame: {vector_time:.3f}s ({legacy_time / vector_time:.1f}x)")
+    print(f"vectorized panel: {panel_time:.3f}s ({legacy_time / panel_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_import_time.py
+# ../benchmarks/bench_import_time.py
+# Startup cost of the entry points: fresh-interpreter wall time of the configuration imports, `cli.py --help` and a
+# forecasting worker's startup, plus guards that fail when a heavy library is imported where it should not be
+
+import os
+import sys
+import time
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+import config
+from run_benchmarks import git_commit, save_results
+
+HEAVY_MODULES = ['numpy', 'pandas', 'sqlalchemy', 'prophet', 'cmdstanpy', 'matplotlib', 'seaborn']
+PATH_SETUP = ("import sys; sys.path[:0] = ['.', 'data_collection', 'data_cleaning', 'prediction']; "
+              "sys.argv = ['cli.py']; ")
+
+# Entry points: (name, code run in a fresh interpreter from the project root, heavy modules it must not import)
+ENTRY_POINTS = [
+    ('python', 'pass', HEAVY_MODULES),
+    ('import_config', 'import config', HEAVY_MODULES),
+    ('import_prophet_config', 'import prophet_config', HEAVY_MODULES),
+    ('cli_help', "import cli\ntry:\n    cli.main(['--help'])\nexcept SystemExit:\n    pass", HEAVY_MODULES),
+    ('cli_predict_help', "import cli\ntry:\n    cli.main(['predict', '--help'])\nexcept SystemExit:\n    pass", HEAVY_MODULES),
+    ('cli_config', "import cli; cli.main(['config', 'END_DATE'])", HEAVY_MODULES),
+    ('ridge_worker', 'import prediction; prediction.init_worker(load_prophet=False)',
+     ['prophet', 'cmdstanpy', 'matplotlib', 'seaborn']),
+    # Prophet itself imports matplotlib for its plotting helpers
+    ('prophet_worker', 'import prediction; prediction.init_worker(load_prophet=True)', ['seaborn']),
+]
+
+# Function to run code in a fresh interpreter, returning its wall time and the heavy modules it left imported
+def run_fresh(code):
+    report = f"\nprint('HEAVY', ' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', PATH_SETUP + code + report], cwd=PROJECT_ROOT,
+                            capture_output=True, text=True)
+    seconds = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f"{code!r} failed: {result.stderr.strip().splitlines()[-1]}")
+    heavy = [line for line in result.stdout.splitlines() if line.startswith('HEAVY')][-1].split()[1:]
+    return seconds, heavy
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the entry points' startup and check their imports stay light")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per entry point (the best is kept)")
+    parser.add_argument('--results', default=config.BENCHMARK_RESULTS_DATABASE_PATH, help="Results database")
+    parser.add_argument('--no-save', action='store_true', help="Do not append the timings to the results database")
+    args = parser.parse_args()
+
+    rows, violations = [], []
+    print(f"{'entry point':<22} {'best':>8} {'median':>8}  heavy modules imported")
+    for name, code, forbidden in ENTRY_POINTS:
+        timings, heavy = [], []
+        for _ in range(args.repeats):
+            seconds, heavy = run_fresh(code)
+            timings.append(seconds)
+        unexpected = [module for module in heavy if module in forbidden]
+        if unexpected:
+            violations.append(f"{name} imports {', '.join(unexpected)}")
+        print(f"{name:<22} {min(timings):>7.3f}s {pd.Series(timings).median():>7.3f}s  {' '.join(heavy) or '-'}")
+        rows.append({'benchmark': name, 'seconds': round(min(timings), 4), 'items': 1, 'rows': None,
+                     'items_per_second': None})
+
+    if not args.no_save:
+        results = pd.DataFrame(rows)
+        results.insert(0, 'run_at', datetime.now().isoformat(timespec='seconds'))
+        results.insert(1, 'commit', git_commit())
+        results.insert(2, 'setup', f"import times, best of {args.repeats}")
+        results['python'] = platform.python_version()
+        results['cpus'] = os.cpu_count()
+        save_results(results, args.results)
+
+    if violations:
+        print("Import guard failed:")
+        for violation in violations:
+            print(f"  {violation}")
+        sys.exit(1)
+    print("Import guard passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_intervals.py
+# ../benchmarks/bench_intervals.py
+# Times each Prophet interval mode and compares its horizon bounds with the sampled intervals: width ratio, mean
+# bound difference and coverage of held-out prices
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import datetime
+import numpy as np
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, 'prediction'))
+import prophet_config
+from synthetic import synthetic_universe
+from models import ProphetModel
+from intervals import INTERVAL_MODES, predict_with_intervals, model_interval_params, analytic_bounds
+
+# Function to turn a synthetic download into the ds/y history the models are fitted on
+def daily_history(frame):
+    close = frame['Close'].groupby(level=0).mean().resample('D').asfreq().interpolate()
+    return pd.DataFrame({'ds': close.index, 'y': close.to_numpy()}).dropna().reset_index(drop=True)
+
+# Function to time one predict call in a mode (best of repeats), returning the forecast, seconds and the
+# tracemalloc peak (MB) of a separate traced call
+def timed_predict(model, future, history_rows, mode, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        np.random.seed(0)
+        start_time = time.perf_counter()
+        forecast = predict_with_intervals(model, future, history_rows, mode)
+        timings.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    predict_with_intervals(model, future, history_rows, mode)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return forecast, min(timings), peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Prophet interval modes with the sampled intervals")
+    parser.add_argument('--tickers', type=int, default=3)
+    parser.add_argument('--years', type=float, default=4)
+    parser.add_argument('--horizon', type=int, default=prophet_config.FORECAST_HORIZON)
+    args = parser.parse_args()
+
+    rows = {mode: [] for mode in INTERVAL_MODES}
+    universe = synthetic_universe(args.tickers, args.years, args.years, end_date=datetime.date(2023, 12, 29))
+    for ticker, frame in universe:
+        history = daily_history(frame)
+        train, holdout = history.iloc[:-args.horizon], history.iloc[-args.horizon:]
+        model = ProphetModel().build(history['ds'].iloc[0], history['ds'].iloc[-1])
+        model.fit(train)
+        future = model.make_future_dataframe(periods=args.horizon, freq='D')
+
+        reference = None
+        for mode in INTERVAL_MODES:
+            forecast, seconds, peak = timed_predict(model, future, len(train), mode)
+            horizon = forecast.iloc[len(train):].reset_index(drop=True)
+            if mode == 'lazy':
+                # Bounds are only computed when read; the read is timed on its own
+                start_time = time.perf_counter()
+                lower, upper = analytic_bounds(horizon['ds'], horizon['yhat'], model_interval_params(model))
+                horizon['yhat_lower'], horizon['yhat_upper'] = lower, upper
+                seconds_read = time.perf_counter() - start_time
+            else:
+                seconds_read = 0.0
+            reference = horizon if reference is None else reference
+            width = (horizon['yhat_upper'] - horizon['yhat_lower']).to_numpy()
+            reference_width = (reference['yhat_upper'] - reference['yhat_lower']).to_numpy()
+            actual = holdout['y'].to_numpy()
+            rows[mode].append({
+                'seconds': seconds,
+                'read_seconds': seconds_read,
+                'peak_mb': peak,
+                'width_ratio': float(np.mean(width / reference_width)),
+                'bound_error': float(np.mean((np.abs(horizon['yhat_lower'] - reference['yhat_lower']) +
+                                              np.abs(horizon['yhat_upper'] - reference['yhat_upper'])) / 2 / reference_width)),
+                'coverage': float(np.mean((actual >= horizon['yhat_lower']) & (actual <= horizon['yhat_upper']))),
+            })
+        print(f"{ticker}: {len(train)} history rows, {args.horizon} horizon rows")
+
+    print(f"Interval width {prophet_config.PROPHET_PARAMS['interval_width']:.0%}, "
+          f"{prophet_config.PROPHET_PARAMS['uncertainty_samples']} draws for the sampled modes; errors relative to 'sampled'")
+    print(f"{'mode':<14} {'predict':>9} {'read':>8} {'peak MB':>8} {'width':>7} {'bound err':>10} {'coverage':>9}")
+    for mode, results in rows.items():
+        summary = pd.DataFrame(results).mean()
+        print(f"{mode:<14} {summary['seconds']:>8.3f}s {summary['read_seconds']:>7.4f}s {summary['peak_mb']:>8.1f} "
+              f"{summary['width_ratio']:>6.2f}x {summary['bound_error']:>9.1%} {summary['coverage']:>9.0%}")
+
+if __name__ == "__main__":
+    main()
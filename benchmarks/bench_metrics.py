@@ -0,0 +1,82 @@
+# bench_metrics.py
+# ../benchmarks/bench_metrics.py
+# Golden-output check and benchmark of the vectorized panel metrics against the original per-ticker functions
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from math_formulas import calculate_sharpe_ratio, evaluate_panel, pad_panel
+
+# Function reproducing the original per-ticker evaluation from prediction.process_stock_table (reference implementation)
+def legacy_metrics(actual, predicted, path):
+    actual, predicted = pd.Series(actual), pd.Series(predicted)
+    mse = mean_squared_error(actual, predicted)
+    returns = pd.Series(path).pct_change().dropna()
+    return {
+        'MAE': mean_absolute_error(actual, predicted),
+        'MSE': mse,
+        'RMSE': np.sqrt(mse),
+        'Sharpe Ratio': calculate_sharpe_ratio(returns, prophet_config.RISK_FREE_RATE_ANNUAL, prophet_config.RISK_FREE_RATE_DAILY),
+    }
+
+# Function to build evaluation windows and forecast paths of varying lengths, like a real universe
+def synthetic_universe(tickers, days, window):
+    rng = np.random.default_rng(0)
+    universe = []
+    for _ in range(tickers):
+        length = int(rng.integers(days // 4, days))
+        path = 100 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, length)))
+        actual = path[-window:] * (1 + rng.normal(0, 0.01, window))
+        universe.append({'actual': actual, 'predicted': path[-window:], 'path': path})
+    return universe
+
+# Function to time a callable over a number of repeats and return the best wall time in seconds
+def best_time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+# Function to evaluate the universe in one vectorized pass, including the padding into panels
+def panel_metrics(universe):
+    return evaluate_panel(
+        pad_panel([entry['actual'] for entry in universe]),
+        pad_panel([entry['predicted'] for entry in universe]),
+        pad_panel([entry['path'] for entry in universe]),
+        prophet_config.RISK_FREE_RATE_ANNUAL, prophet_config.RISK_FREE_RATE_DAILY
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized panel metrics with the per-ticker functions")
+    parser.add_argument('--tickers', type=int, default=3000)
+    parser.add_argument('--days', type=int, default=1500)
+    parser.add_argument('--window', type=int, default=prophet_config.FORECAST_HORIZON)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    universe = synthetic_universe(args.tickers, args.days, args.window)
+
+    # Golden-output check: the panel pass must reproduce the per-ticker metrics
+    expected = [legacy_metrics(**entry) for entry in universe]
+    metrics = panel_metrics(universe)
+    for name in expected[0]:
+        np.testing.assert_allclose(metrics[name], [entry[name] for entry in expected], rtol=1e-9)
+    print(f"Golden-output check passed for {args.tickers} tickers")
+
+    legacy_time = best_time(lambda: [legacy_metrics(**entry) for entry in universe], args.repeats)
+    panel_time = best_time(lambda: panel_metrics(universe), args.repeats)
+    print(f"{args.tickers} tickers, up to {args.days} days")
+    print(f"per-ticker sklearn/pandas: {legacy_time:.3f}s")
+    print(f"vectorized panel:          {panel_time:.3f}s ({legacy_time / panel_time:.1f}x, "
+          f"also computes Sortino, max drawdown and hit rate)")
+
+if __name__ == "__main__":
+    main()
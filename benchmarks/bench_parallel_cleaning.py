@@ -0,0 +1,73 @@
+# bench_parallel_cleaning.py
+# ../benchmarks/bench_parallel_cleaning.py
+# Scaling of data_cleaning.main on a synthetic universe: the thread pool against worker processes with a single
+# writer at increasing worker counts, checking that every run writes the same cleaned rows and that full cleans
+# without rows delete the old ones
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+for stage_directory in ['data_collection', 'data_cleaning']:
+    sys.path.append(os.path.join(PROJECT_ROOT, stage_directory))
+import config
+from synthetic import synthetic_universe
+from run_benchmarks import use_scratch_paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare threaded and process-parallel cleaning")
+    parser.add_argument('--tickers', type=int, default=200)
+    parser.add_argument('--years', type=float, nargs=2, default=[5, 25], metavar=('MIN', 'MAX'))
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="Process counts to time (defaults to 1, 2, 4, ... up to the available cores)")
+    parser.add_argument('--engine', choices=['batch', 'streaming'], default=config.CLEANING_ENGINE, help="Cleaning engine")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    use_scratch_paths(scratch.name)
+    config.CLEANING_ENGINE = args.engine
+    import data_cleaning
+    from bulk_writer import BulkWriter
+    from utils import prepare_for_db
+    data_cleaning.start_date = pd.Timestamp('1990-01-01', tz='US/Eastern')
+
+    writer = BulkWriter(data_cleaning.source_store)
+    for ticker, frame in synthetic_universe(args.tickers, *args.years):
+        writer.put(prepare_for_db(frame, ticker, data_cleaning.source_store))
+    writer.close()
+    cores = data_cleaning.cleaning_workers()
+    workers = args.workers or sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    print(f"{args.tickers} tickers, {cores} cores available, {args.engine} engine")
+
+    runs = [('threads', 5)] + [('processes', count) for count in workers]
+    timings, expected = [], None
+    for executor, count in runs:
+        data_cleaning.cleaned_store.delete(data_cleaning.cleaned_store.tickers())
+        start_time = time.perf_counter()
+        data_cleaning.main(full_refresh=True, executor=executor, max_workers=count)
+        seconds = time.perf_counter() - start_time
+        cleaned = data_cleaning.cleaned_store.load().sort_values(['ticker', 'Date'], ignore_index=True)
+        expected = cleaned if expected is None else expected
+        pd.testing.assert_frame_equal(cleaned, expected)
+        timings.append(seconds)
+
+    print("Output identical across runs")
+
+    # Full cleans that keep no rows (every raw date before start_date) must drop the previous cleaned rows
+    data_cleaning.start_date = pd.Timestamp('2100-01-01', tz='US/Eastern')
+    for executor in ['threads', 'processes']:
+        data_cleaning.main(full_refresh=True, executor=executor, max_workers=1)
+        assert data_cleaning.cleaned_store.load().empty, f"{executor}: old cleaned rows kept by empty full cleans"
+        data_cleaning.cleaned_store.write(expected)
+    print("Empty full cleans delete the old rows")
+    for (executor, count), seconds in zip(runs, timings):
+        print(f"{executor:<10} {count:>3} workers  {seconds:>8.2f}s  {args.tickers / seconds:>8.1f} tickers/s  "
+              f"x{timings[0] / seconds:.2f} vs threads")
+    scratch.cleanup()
+
+if __name__ == "__main__":
+    main()
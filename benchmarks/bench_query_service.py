@@ -0,0 +1,146 @@
+# bench_query_service.py
+# ../benchmarks/bench_query_service.py
+# Latency of the forecast query service against the equivalent SQL queries on a synthetic forecast database,
+# checking that both give the same answers, that a newly finished run is swapped in, that older runs are cached and
+# that HTTP errors answer with a JSON status
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, 'prediction'))
+import prophet_config
+from run_benchmarks import use_scratch_paths
+
+# Function to store one finished synthetic run: horizon rows per ticker and random metrics
+def write_run(store, run_id, tickers, horizon, seed):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2024-01-02', periods=horizon, freq='D').strftime('%Y-%m-%d')
+    yhat = rng.uniform(10, 500, (len(tickers), 1)) * np.exp(np.cumsum(rng.normal(0, 0.01, (len(tickers), horizon)), axis=1))
+    forecasts = pd.DataFrame({'ticker': np.repeat(tickers, horizon), 'run_id': run_id, 'ds': np.tile(days, len(tickers)),
+                              'yhat': yhat.ravel()})
+    forecasts['yhat_lower'] = forecasts['yhat'] * 0.9
+    forecasts['yhat_upper'] = forecasts['yhat'] * 1.1
+    store.start_run(run_id, 'compact', horizon)
+    store.write(forecasts)
+    metric_names = ['MAE', 'MSE', 'RMSE', 'Sharpe Ratio', 'Sortino Ratio', 'Max Drawdown', 'Hit Rate']
+    results = [{'ticker': ticker, 'success': True, 'fit_mode': 'ridge', 'seconds': 0.1,
+                'metrics': dict(zip(metric_names, rng.normal(0, 1, len(metric_names)).tolist()))} for ticker in tickers]
+    store.finish_run(run_id, results)
+    return list(days)
+
+# Function to time calls of fn over the arguments, returning (mean, p99) in microseconds
+def latency(fn, arguments):
+    timings = []
+    for argument in arguments:
+        start_time = time.perf_counter()
+        fn(argument)
+        timings.append((time.perf_counter() - start_time) * 1e6)
+    return float(np.mean(timings)), float(np.percentile(timings, 99))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the forecast query service with direct SQL queries")
+    parser.add_argument('--tickers', type=int, default=2000)
+    parser.add_argument('--horizon', type=int, default=prophet_config.FORECAST_HORIZON)
+    parser.add_argument('--queries', type=int, default=2000, help="Queries timed per kind")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    use_scratch_paths(scratch.name)
+    from sqlalchemy import create_engine
+    from forecast_store import ForecastStore
+    from query_service import ForecastQueryService, make_handler
+    from http.server import ThreadingHTTPServer
+
+    engine = create_engine(f'sqlite:///{prophet_config.FORECAST_DATABASE_PATH}')
+    store = ForecastStore(engine)
+    tickers = [f"SYN{i:05d}" for i in range(args.tickers)]
+    days = write_run(store, 'run-1', tickers, args.horizon, seed=0)
+
+    start_time = time.perf_counter()
+    service = ForecastQueryService(engine)
+    print(f"{args.tickers} tickers x {args.horizon} days indexed in {time.perf_counter() - start_time:.3f}s")
+
+    # SQL equivalents of the three queries, one connection kept open as a client would
+    conn = engine.connect()
+    metrics_table, table = prophet_config.FORECAST_METRICS_TABLE, prophet_config.FORECAST_TABLE
+
+    def sql_top(n):
+        return conn.exec_driver_sql(f'SELECT ticker, sharpe_ratio FROM "{metrics_table}" WHERE run_id = ? AND sharpe_ratio IS NOT NULL '
+                                    f'ORDER BY sharpe_ratio DESC LIMIT ?', ('run-1', n)).fetchall()
+
+    def sql_forecast(query):
+        return conn.exec_driver_sql(f'SELECT ds, yhat, yhat_lower, yhat_upper FROM "{table}" WHERE ticker = ? AND run_id = ? AND ds = ?',
+                                    (query[0], 'run-1', query[1])).fetchone()
+
+    def sql_date(date):
+        return conn.exec_driver_sql(f'SELECT ticker, yhat, yhat_lower, yhat_upper FROM "{table}" WHERE run_id = ? AND ds = ?',
+                                    ('run-1', date)).fetchall()
+
+    rng = np.random.default_rng(1)
+    lookups = [(tickers[i], days[j]) for i, j in zip(rng.integers(0, len(tickers), args.queries), rng.integers(0, len(days), args.queries))]
+    dates = [days[j] for j in rng.integers(0, len(days), max(args.queries // 10, 10))]
+
+    # Same answers from the index and from SQL
+    assert [row['ticker'] for row in service.top(10)] == [row[0] for row in sql_top(10)]
+    for ticker, date in lookups[:200]:
+        row, expected = service.forecast(ticker, date), sql_forecast((ticker, date))
+        assert row['ds'] == expected[0] and np.allclose([row['yhat'], row['yhat_lower'], row['yhat_upper']], expected[1:])
+    on_date = service.forecasts_on(dates[0])
+    expected = {row[0]: row[1] for row in sql_date(dates[0])}
+    assert sorted(on_date['ticker']) == sorted(expected)
+    assert np.allclose(on_date['yhat'], [expected[ticker] for ticker in on_date['ticker']])
+    print("Index answers match SQL")
+
+    print(f"{'query':<22} {'index mean':>11} {'index p99':>10} {'SQL mean':>10} {'SQL p99':>10}")
+    for name, index_fn, sql_fn, arguments in [
+        ('top 10 by Sharpe', lambda n: service.top(n), sql_top, [10] * args.queries),
+        ('yhat ticker/date', lambda query: service.forecast(*query), sql_forecast, lookups),
+        ('all for a date', service.forecasts_on, sql_date, dates),
+    ]:
+        index_mean, index_p99 = latency(index_fn, arguments)
+        sql_mean, sql_p99 = latency(sql_fn, arguments)
+        print(f"{name:<22} {index_mean:>9.1f}us {index_p99:>8.1f}us {sql_mean:>8.1f}us {sql_p99:>8.1f}us")
+    conn.close()
+
+    # A newly finished run is swapped in; the previous one is answered from the LRU cache
+    write_run(store, 'run-2', tickers, args.horizon, seed=2)
+    assert service.refresh() and service.run().run_id == 'run-2'
+    mean, _ = latency(lambda query: service.forecast(*query, run_id='run-1'), lookups[:500])
+    print(f"Swapped in run-2; run-1 still served from the cache in {mean:.1f}us per lookup")
+
+    # HTTP round trip on localhost
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    assert len(json.loads(urllib.request.urlopen(f"{url}/top?n=5").read())) == 5
+    # Bad arguments answer 400, unexpected failures a JSON 500 instead of a dropped connection
+    def status(path):
+        try:
+            return urllib.request.urlopen(f"{url}{path}").status, None
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+    for path, expected in [('/top?n=0', 400), ('/top?n=-1', 400), ('/forecast?ticker=NOPE', 404)]:
+        assert status(path)[0] == expected, path
+    service.history.clear()
+    load_metrics, service.store.load_metrics = service.store.load_metrics, lambda run_id=None: 1 / 0
+    code, body = status('/top?run_id=run-1')
+    assert code == 500 and 'error' in body, code
+    service.store.load_metrics = load_metrics
+    mean, p99 = latency(lambda query: urllib.request.urlopen(f"{url}/forecast?ticker={query[0]}&date={query[1]}").read(),
+                        lookups[:500])
+    print(f"HTTP /forecast round trip: {mean:.0f}us mean, {p99:.0f}us p99")
+    server.shutdown()
+    scratch.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench_streaming_cleaner.py
+# ../benchmarks/bench_streaming_cleaner.py
+# Golden-output check of the streaming cleaner against the batch process_table (full and incremental cleans, tiny
+# chunks that split weekends and gaps, duplicate days split across chunks) and a comparison of their peak memory
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, 'data_cleaning'))
+import config
+from synthetic import synthetic_history, synthetic_universe
+from run_benchmarks import use_scratch_paths
+from stream_cleaner import StreamingCloseFill, to_day_numbers
+
+# Function to push a history through StreamingCloseFill in chunks of chunk_rows rows and return (days, closes)
+def stream_fill(frame, chunk_rows):
+    fill = StreamingCloseFill()
+    days, closes = to_day_numbers(frame.index), frame['Close'].to_numpy(dtype=np.float32)
+    blocks = [fill.push(days[i:i + chunk_rows], closes[i:i + chunk_rows]) for i in range(0, len(days), chunk_rows)]
+    blocks.append(fill.finish())
+    return np.concatenate([block[0] for block in blocks]), np.concatenate([block[1] for block in blocks])
+
+# Function to clean one ticker with the given engine and return the cleaned rows and the watermark
+def clean(data_cleaning, ticker, engine, watermark=None, raw_rows=None, recorder=None):
+    config.CLEANING_ENGINE = engine
+    new_watermark = data_cleaning.process_table(ticker, watermark, raw_rows, recorder=recorder)
+    cleaned = data_cleaning.cleaned_store.load([ticker])
+    return cleaned.reset_index(drop=True), new_watermark
+
+# Function to check that the streaming output matches the batch output (float32 prices, so compared with rtol)
+def assert_same(batch, streaming, label):
+    assert list(batch['Date']) == list(streaming['Date']), f"{label}: dates differ"
+    np.testing.assert_allclose(streaming['Close'].to_numpy(), batch['Close'].to_numpy(), rtol=1e-6, equal_nan=True,
+                               err_msg=label)
+
+# Function to return the tracemalloc peak (MB) and wall time of fn()
+def traced(fn):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return peak, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the streaming cleaner against the batch cleaner and compare "
+                                                 "their peak memory")
+    parser.add_argument('--tickers', type=int, default=12, help="Tickers in the golden-output check")
+    parser.add_argument('--chunk-rows', type=int, nargs='+', default=[3, 7, 64, 100000])
+    parser.add_argument('--years', type=float, default=100, help="History length of the memory comparison ticker")
+    parser.add_argument('--memory-chunk-rows', type=int, default=5000, help="Chunk size in the memory comparison")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    use_scratch_paths(scratch.name)
+    import data_cleaning
+    from utils import save_to_db
+    data_cleaning.start_date = pd.Timestamp('1990-01-01', tz='US/Eastern')
+    raw_store = data_cleaning.source_store
+
+    # Full cleans: irregular histories (gaps, missing closes, duplicates, DST Sundays)
+    universe = dict(synthetic_universe(args.tickers, 3, 8, nan_rate=0.02, duplicate_rate=0.02, dst_rate=0.5))
+    for ticker, frame in universe.items():
+        save_to_db(frame, ticker, raw_store)
+        batch, batch_watermark = clean(data_cleaning, ticker, 'batch')
+        for chunk_rows in args.chunk_rows:
+            config.CLEANING_CHUNK_ROWS = chunk_rows
+            streaming, streaming_watermark = clean(data_cleaning, ticker, 'streaming')
+            assert_same(batch, streaming, f"{ticker} full, {chunk_rows}-row chunks")
+            assert streaming_watermark == batch_watermark, f"{ticker}: {streaming_watermark} != {batch_watermark}"
+    print(f"Full-clean check passed for {len(universe)} tickers and chunk sizes {args.chunk_rows}")
+
+    # Incremental cleans: clean the first part of a history, append the rest and clean again from the watermark
+    for ticker, frame in list(universe.items())[:4]:
+        cut = frame.index[int(len(frame) * 0.8)]
+        for chunk_rows in args.chunk_rows:
+            config.CLEANING_CHUNK_ROWS = chunk_rows
+            raw_store.delete([ticker])
+            save_to_db(frame[frame.index <= cut], ticker, raw_store)
+            _, watermark = clean(data_cleaning, ticker, 'streaming')
+            save_to_db(frame[frame.index > cut], ticker, raw_store)
+            raw_rows = int(raw_store.stats([ticker])['rows'].iat[0])
+            streaming, streaming_watermark = clean(data_cleaning, ticker, 'streaming', watermark, raw_rows)
+            batch, batch_watermark = clean(data_cleaning, ticker, 'batch')
+            assert_same(batch, streaming, f"{ticker} incremental, {chunk_rows}-row chunks")
+            assert streaming_watermark == batch_watermark, f"{ticker}: {streaming_watermark} != {batch_watermark}"
+    print("Incremental-clean check passed")
+
+    # The SQLite store keeps one row per day, so duplicate days split across chunks are checked on the fill itself:
+    # several rows per day (as other backends or intraday sources may hold) must equal their pre-averaged days
+    frame = universe[next(iter(universe))]
+    rng = np.random.default_rng(0)
+    dense = frame.loc[frame.index.repeat(rng.integers(1, 5, len(frame)))].copy()
+    dense['Close'] = dense['Close'] * (1 + rng.normal(0, 0.001, len(dense)))
+    expected = stream_fill(dense.groupby(level=0).mean(), len(dense))
+    for chunk_rows in args.chunk_rows:
+        days, closes = stream_fill(dense, chunk_rows)
+        assert np.array_equal(days, expected[0]), f"duplicate days, {chunk_rows}-row chunks: days differ"
+        np.testing.assert_allclose(closes, expected[1], rtol=1e-6, equal_nan=True)
+    print(f"Duplicate-day check passed on {len(dense)} rows")
+
+    # Peak memory on one long history
+    ticker = 'LONG'
+    save_to_db(synthetic_history(ticker, args.years, pd.Timestamp('2024-06-28').date(), seed=1), ticker, raw_store)
+    config.CLEANING_CHUNK_ROWS = args.memory_chunk_rows
+    raw_rows = int(raw_store.stats([ticker])['rows'].iat[0])
+    print(f"Memory comparison on {raw_rows} raw rows ({args.years:g} years, {args.memory_chunk_rows}-row chunks)")
+    for engine in ['batch', 'streaming']:
+        config.CLEANING_ENGINE = engine
+        peak, seconds = traced(lambda: data_cleaning.process_table(ticker))
+        print(f"{engine:<10} peak {peak:>8.1f} MB  {seconds:>7.2f}s")
+    scratch.cleanup()
+
+if __name__ == "__main__":
+    main()
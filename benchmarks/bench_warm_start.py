@@ -0,0 +1,64 @@
+# bench_warm_start.py
+# ../benchmarks/bench_warm_start.py
+# Benchmark of warm-started versus full Prophet refits after one new day of data
+
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from prophet import Prophet
+
+logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+# Function to create an unfitted model with the project configuration and the holidays of a history
+def build_model(history):
+    model = Prophet(**prophet_config.with_holidays(None, history['ds'].iloc[0], history['ds'].iloc[-1]))
+    for seasonality in prophet_config.SEASONALITY_PARAMS:
+        model.add_seasonality(**seasonality)
+    return model
+
+# Function to build a synthetic daily close history
+def synthetic_history(seed, days):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end='2024-02-28', periods=days, freq='D')
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, days)))
+    return pd.DataFrame({'ds': dates, 'y': close})
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare warm-started and full Prophet refits")
+    parser.add_argument('--tickers', type=int, default=5)
+    parser.add_argument('--days', type=int, default=1500)
+    args = parser.parse_args()
+
+    full_times, warm_times, deviations = [], [], []
+    for seed in range(args.tickers):
+        history = synthetic_history(seed, args.days)
+        previous = build_model(history).fit(history.iloc[:-1])
+        init = {name: float(previous.params[name].mean()) for name in ['k', 'm', 'sigma_obs']}
+        init.update({name: previous.params[name].mean(axis=0) for name in ['delta', 'beta']})
+
+        start_time = time.perf_counter()
+        full = build_model(history).fit(history)
+        full_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        warm = build_model(history).fit(history, init=init)
+        warm_times.append(time.perf_counter() - start_time)
+
+        future = full.make_future_dataframe(periods=prophet_config.FORECAST_HORIZON)
+        full.uncertainty_samples = warm.uncertainty_samples = 0
+        deviation = np.abs(full.predict(future)['yhat'] - warm.predict(future)['yhat']) / history['y'].mean()
+        deviations.append(deviation.max())
+
+    print(f"{args.tickers} tickers x {args.days} days")
+    print(f"full refit:  {np.mean(full_times):.2f}s per ticker")
+    print(f"warm start:  {np.mean(warm_times):.2f}s per ticker ({np.mean(full_times) / np.mean(warm_times):.1f}x)")
+    print(f"max |yhat difference| relative to mean price: {max(deviations):.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# run_benchmarks.py
+# ../benchmarks/run_benchmarks.py
+# End-to-end benchmark of the pipeline stages on a synthetic universe, with results stored per commit
+# so regressions show up when comparing runs
+
+import os
+import sys
+import time
+import platform
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import create_engine
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+for stage_directory in ['data_collection', 'data_cleaning', 'prediction']:
+    sys.path.append(os.path.join(PROJECT_ROOT, stage_directory))
+import config
+import prophet_config
+from synthetic import synthetic_universe
+
+# Function to return the current commit hash, with a '+dirty' suffix when the tree has uncommitted changes
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Function to point every store, cache and log at a scratch directory before the stage modules are imported
+def use_scratch_paths(directory):
+    config.RAW_DATABASE_PATH = os.path.join(directory, 'raw.db')
+    config.CLEANED_DATABASE_PATH = prophet_config.CLEANED_DATABASE_PATH = os.path.join(directory, 'cleaned.db')
+    config.RAW_PARQUET_PATH = os.path.join(directory, 'raw_parquet')
+    config.CLEANED_PARQUET_PATH = os.path.join(directory, 'cleaned_parquet')
+    config.LOG_DIRECTORY = os.path.join(directory, 'logs')
+    config.CLEANING_LOG_FILE = os.path.join(directory, 'logs', 'cleaning_last_run_log.txt')
+    config.CLEANING_WATERMARK_FILE = os.path.join(directory, 'logs', 'cleaning_watermarks.json')
+    config.RUN_REPORT_DIRECTORY = os.path.join(directory, 'logs', 'run_reports')
+    config.RUN_REPORT_DATABASE_PATH = os.path.join(directory, 'run_reports.db')
+    config.UNIVERSE_DATABASE_PATH = os.path.join(directory, 'universe.db')
+    prophet_config.FORECAST_DATABASE_PATH = os.path.join(directory, 'forecast.db')
+    prophet_config.FEATURE_CACHE_DIR = os.path.join(directory, 'feature_cache')
+
+# Timer collecting one result row per benchmark
+class Timer:
+    def __init__(self):
+        self.rows = []
+
+    # Function to time fn(), recording the items (tickers) and data rows it processed; returns fn's result
+    def run(self, name, fn, items, rows=None):
+        start_time = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start_time
+        rows = rows(result) if callable(rows) else rows
+        self.rows.append({'benchmark': name, 'seconds': round(seconds, 4), 'items': items, 'rows': rows,
+                          'items_per_second': round(items / seconds, 2) if seconds else None})
+        print(f"{name:<16} {seconds:>9.3f}s  {items:>6} tickers  {rows or 0:>10} rows  "
+              f"{items / seconds if seconds else 0:>9.1f} tickers/s")
+        return result
+
+# Function to save the results of a run and print the change against the last run of another commit
+def save_results(results, path):
+    engine = create_engine(f'sqlite:///{path}')
+    previous = None
+    if os.path.exists(path):
+        history = pd.read_sql_table('benchmark_results', con=engine)
+        same_setup = history[(history['setup'] == results['setup'].iat[0]) & (history['commit'] != results['commit'].iat[0])]
+        if not same_setup.empty:
+            previous = same_setup[same_setup['run_at'] == same_setup['run_at'].max()]
+    results.to_sql('benchmark_results', con=engine, if_exists='append', index=False)
+    print(f"Results saved to {path} (commit {results['commit'].iat[0]})")
+
+    if previous is not None:
+        comparison = results.merge(previous[['benchmark', 'seconds', 'commit']], on='benchmark', suffixes=('', '_previous'))
+        print(f"Change against commit {comparison['commit_previous'].iat[0]} (ratio > 1 is slower):")
+        for row in comparison.itertuples(index=False):
+            print(f"  {row.benchmark:<16} {row.seconds_previous:>9.3f}s -> {row.seconds:>9.3f}s  "
+                  f"x{row.seconds / row.seconds_previous:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark collection writes, cleaning, forecasting and metrics "
+                                                 "on a synthetic OHLCV universe")
+    parser.add_argument('--tickers', type=int, default=100, help="Universe size (100 to 5000 is typical)")
+    parser.add_argument('--years', type=float, nargs=2, default=[5, 25], metavar=('MIN', 'MAX'),
+                        help="Range of history lengths in years")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['sqlite', 'parquet', 'tables'], default='sqlite')
+    parser.add_argument('--prophet-tickers', type=int, default=2, help="Tickers forecast with Prophet (slow)")
+    parser.add_argument('--results', default=config.BENCHMARK_RESULTS_DATABASE_PATH, help="Results database")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    use_scratch_paths(scratch.name)
+    config.STORAGE_BACKEND = args.backend
+    import data_cleaning
+    import prediction
+    from utils import save_to_db, prepare_for_db
+    from price_store import open_store
+    from bulk_writer import BulkWriter
+
+    setup = f"{args.tickers} tickers, {args.years[0]:g}-{args.years[1]:g} years, seed {args.seed}, {args.backend}"
+    print(f"Benchmarking on {setup}")
+    timer = Timer()
+
+    # Generation is timed separately so it can be told apart from the stages
+    universe = timer.run('generate', lambda: dict(synthetic_universe(args.tickers, *args.years, seed=args.seed)),
+                         args.tickers, lambda universe: sum(len(frame) for frame in universe.values()))
+    tickers = list(universe)
+    raw_rows = sum(len(frame) for frame in universe.values())
+
+    # Collection writes: one transaction per ticker (save_to_db), then the batched single writer on a fresh store
+    raw_store = data_cleaning.source_store
+
+    def save_each():
+        for ticker, frame in universe.items():
+            save_to_db(frame, ticker, raw_store)
+
+    timer.run('save_to_db', save_each, len(tickers), raw_rows)
+    bulk_store = open_store(os.path.join(scratch.name, 'raw_bulk.db'), os.path.join(scratch.name, 'raw_bulk_parquet'),
+                            config.RAW_COLUMNS)
+
+    def bulk_write():
+        writer = BulkWriter(bulk_store)
+        for ticker, frame in universe.items():
+            writer.put(prepare_for_db(frame, ticker, bulk_store))
+        writer.close()
+
+    timer.run('bulk_writer', bulk_write, len(tickers), raw_rows)
+    del universe
+
+    # Cleaning: full process_table of every ticker
+    timer.run('process_table', lambda: [data_cleaning.process_table(ticker) for ticker in tickers],
+              len(tickers), lambda watermarks: sum(watermark['rows'] for watermark in watermarks))
+
+    # Forecasting: the ridge engine over every ticker in its batched tasks, Prophet on a few tickers
+    stats = prediction.data_store.stats()
+    history_rows = dict(zip(stats['ticker'], stats['rows']))
+    date_ranges = dict(zip(stats['ticker'], zip(stats['first_date'], stats['last_date'])))
+    ridge_tasks = prediction.make_tasks({ticker: 'ridge' for ticker in tickers}, history_rows, date_ranges)
+    cleaned_rows = int(stats['rows'].sum())
+    ridge_results = timer.run('predict_ridge', lambda: [result for task in ridge_tasks for result in prediction.process_task(task)],
+                              len(tickers), cleaned_rows)
+    if args.prophet_tickers:
+        sample = tickers[:args.prophet_tickers]
+        timer.run('predict_prophet', lambda: [prediction.process_task(('prophet', [ticker])) for ticker in sample],
+                  len(sample), sum(history_rows.get(ticker, 0) for ticker in sample))
+
+    # Metrics: one vectorized evaluation of every ridge forecast
+    successes = [result for result in ridge_results if result['success']]
+    timer.run('metrics', lambda: prediction.evaluate_results(successes), len(successes),
+              sum(len(result['evaluation']['path']) for result in successes))
+    failures = [result for result in ridge_results if not result['success']]
+    if failures:
+        print(f"{len(failures)} forecasts failed, e.g. {failures[0]['ticker']}: {failures[0]['error']}")
+
+    results = pd.DataFrame(timer.rows)
+    results.insert(0, 'run_at', datetime.now().isoformat(timespec='seconds'))
+    results.insert(1, 'commit', git_commit())
+    results.insert(2, 'setup', setup)
+    results['python'] = platform.python_version()
+    results['cpus'] = os.cpu_count()
+    save_results(results, args.results)
+    scratch.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# synthetic.py
+# ../benchmarks/synthetic.py
+# Reproducible synthetic OHLCV universes for benchmarks: random-walk prices with the irregularities real downloads
+# have (multi-day gaps, missing closes, duplicated dates and rows on the days US/Eastern changes clocks)
+
+import zlib
+import functools
+import datetime
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Function to list the days on which US/Eastern switches between standard and daylight saving time
+@functools.lru_cache(maxsize=None)
+def dst_transition_days(start_date, end_date):
+    days = pd.date_range(start_date, end_date, freq='D', tz='US/Eastern')
+    offsets = days.tz_localize(None) - days.tz_convert('UTC').tz_localize(None)
+    changes = np.flatnonzero(offsets[1:] != offsets[:-1])
+    return days[changes].tz_localize(None).to_numpy(dtype='datetime64[D]')
+
+# Function to generate the history of one ticker, shaped like a provider download ('Date' index, OHLCV columns)
+# The ticker name and seed fully determine the result
+def synthetic_history(ticker, years, end_date, seed=0, gap_rate=0.002, nan_rate=0.002, duplicate_rate=0.001, dst_rate=0.2):
+    rng = np.random.default_rng([seed, zlib.crc32(ticker.encode())])
+    start_date = end_date - datetime.timedelta(days=int(years * 365.25))
+    days = np.arange(np.datetime64(start_date), np.datetime64(end_date), dtype='datetime64[D]')
+    dates = days[np.is_busday(days)]
+
+    # Outages of 2 to 15 business days (halts, failed downloads) that cleaning has to interpolate over
+    keep = np.ones(len(dates), dtype=bool)
+    for start in rng.integers(0, len(dates), rng.binomial(len(dates), gap_rate)):
+        keep[start:start + rng.integers(2, 16)] = False
+    dates = dates[keep]
+
+    # Some tickers also carry rows on the Sundays when clocks change, and a few dates arrive twice
+    if rng.random() < dst_rate:
+        dates = np.union1d(dates, dst_transition_days(start_date, end_date))
+    dates = np.sort(np.concatenate([dates, dates[rng.random(len(dates)) < duplicate_rate]]))
+
+    close = (10 + rng.random() * 300) * np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(dates))))
+    spread = np.abs(rng.normal(0, 0.01, len(dates)))
+    frame = pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, len(dates))),
+        'High': close * (1 + spread),
+        'Low': close * (1 - spread),
+        'Close': np.where(rng.random(len(dates)) < nan_rate, np.nan, close),
+        'Volume': rng.integers(10_000, 5_000_000, len(dates)),
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+    return frame
+
+# Function to list the tickers of a universe with the history length of each (years drawn between min and max)
+def universe_spec(n_tickers, min_years=5, max_years=25, seed=0):
+    rng = np.random.default_rng(seed)
+    years = rng.uniform(min_years, max_years, n_tickers)
+    return [(f"SYN{i:05d}", round(float(span), 2)) for i, span in enumerate(years)]
+
+# Function to generate a universe one ticker at a time, yielding (ticker, frame) so large universes never sit in memory
+def synthetic_universe(n_tickers, min_years=5, max_years=25, end_date=None, seed=0, **irregularities):
+    end_date = end_date or datetime.date(2024, 6, 28)
+    for ticker, years in universe_spec(n_tickers, min_years, max_years, seed):
+        yield ticker, synthetic_history(ticker, years, end_date, seed, **irregularities)
@@ -0,0 +1,108 @@
+# bulk_writer.py
+# ../bulk_writer.py
+# Single-writer ingest queue batching long-format frames into large store transactions
+
+import time
+import queue
+import threading
+import pandas as pd
+import config
+
+# Sentinel telling the writer thread to flush and exit
+_STOP = object()
+
+# Dedicated writer thread: producers put long frames on a bounded queue (blocking when it is full) and
+# one thread concatenates them into batches of about batch_rows rows, each written in a single transaction
+# on_written(tickers, success) is called from the writer thread after each batch, with the ticker of every frame in it
+# With a recorder (instrumentation.RunRecorder) each frame's ticker gets its row share of the batch write time
+class BulkWriter:
+    def __init__(self, store, batch_rows=None, queue_size=None, flush_seconds=None, replace=False, on_written=None,
+                 recorder=None):
+        self.store = store
+        self.on_written = on_written
+        self.recorder = recorder
+        self.batch_rows = batch_rows or config.WRITER_BATCH_ROWS
+        self.flush_seconds = flush_seconds or config.WRITER_FLUSH_SECONDS
+        self.replace = replace
+        self.queue = queue.Queue(maxsize=queue_size or config.WRITER_QUEUE_SIZE)
+        self.failed_tickers = []
+        self.rows_written = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.max_queue_depth = 0
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self._run, name='bulk-writer', daemon=True)
+        self.thread.start()
+
+    # Function to queue a long frame for writing; blocks while the queue is full (backpressure)
+    def put(self, frame):
+        if not frame.empty:
+            self.queue.put(frame)
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    # Function to flush everything still queued and stop the writer thread
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    # Function to write the pending frames as one batch
+    def _flush(self, pending):
+        data = pd.concat(pending, ignore_index=True)
+        start_time = time.perf_counter()
+        success = True
+        try:
+            self.store.write(data, replace=self.replace)
+            self.rows_written += len(data)
+            self.batches += 1
+        except Exception as e:
+            tickers = list(data['ticker'].unique())
+            print(f"Could not write batch of {len(data)} rows for {len(tickers)} tickers: {e}")
+            self.failed_tickers.extend(tickers)
+            success = False
+            if self.recorder is not None:
+                for ticker in tickers:
+                    self.recorder.error(ticker, e, 'write')
+        seconds = time.perf_counter() - start_time
+        self.write_seconds += seconds
+        if self.recorder is not None and success:
+            for frame in pending:
+                self.recorder.add('write', seconds * len(frame) / len(data), frame['ticker'].iat[0], len(frame))
+        if self.on_written:
+            self.on_written([frame['ticker'].iat[0] for frame in pending], success)
+
+    # Writer loop: flush when the batch is large enough, when producers go quiet, or on close
+    def _run(self):
+        pending, pending_rows = [], 0
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _STOP:
+                pending.append(item)
+                pending_rows += len(item)
+            if pending and (item is None or item is _STOP or pending_rows >= self.batch_rows):
+                self._flush(pending)
+                pending, pending_rows = [], 0
+            if item is _STOP:
+                return
+
+    # Function to return the writer metrics as a dict
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        return {
+            'rows_written': self.rows_written,
+            'batches': self.batches,
+            'write_seconds': round(self.write_seconds, 3),
+            'rows_per_second': round(self.rows_written / self.write_seconds, 1) if self.write_seconds else 0.0,
+            'elapsed_seconds': round(elapsed, 3),
+            'max_queue_depth': self.max_queue_depth,
+            'failed_tickers': len(self.failed_tickers),
+        }
+
+    # Function to print the writer metrics
+    def report(self):
+        summary = self.summary()
+        print(f"Wrote {summary['rows_written']} rows in {summary['batches']} batches: {summary['rows_per_second']} rows/s "
+              f"({summary['write_seconds']}s writing), max queue depth {summary['max_queue_depth']}, "
+              f"{summary['failed_tickers']} tickers failed to write")
@@ -0,0 +1,195 @@
+# cli.py
+# ../cli.py
+# Single entry point for every stage: `python cli.py <command> [options]`. Only argparse is imported up front; a
+# stage module (and pandas, SQLAlchemy, Prophet) is imported once its command runs, so --help answers at once and
+# worker processes spawned from a command re-import nothing but this file
+
+import os
+import sys
+import argparse
+import importlib
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+for stage_directory in ['data_collection', 'data_cleaning', 'prediction']:
+    sys.path.append(os.path.join(PROJECT_ROOT, stage_directory))
+
+FORECAST_MODELS = ['prophet', 'ridge', 'auto']
+BACKTEST_ENGINES = ['ridge', 'prophet']
+
+# Function to add the --profile option shared by the stage commands
+def add_profile_argument(parser):
+    parser.add_argument('--profile', action='store_true', default=None, help="Profile the run with cProfile (parent process)")
+
+# Function to add the options of the collect command
+def collect_arguments(parser):
+    parser.add_argument('--provider', choices=['yahoo', 'fake'], default=None, help="Defaults to config.DATA_PROVIDER")
+    parser.add_argument('--tickers', nargs='+', default=None, help="Collect only these tickers")
+    parser.add_argument('--offline', action='store_true', default=None, help="Use the stored universe snapshots only")
+    parser.add_argument('--refresh-universe', action='store_true', help="Fetch the ticker universe regardless of its TTL")
+    add_profile_argument(parser)
+
+# Function to run the collect command
+def collect(module, args):
+    from instrumentation import profiled
+    with profiled('collection', args.profile):
+        module.main(module.get_provider(args.provider), args.tickers, args.offline, args.refresh_universe)
+
+# Function to add the options of the clean command
+def clean_arguments(parser):
+    parser.add_argument('--full', action='store_true', help="Re-clean the full history of every ticker")
+    parser.add_argument('--executor', choices=['processes', 'threads'], default=None,
+                        help="Clean on worker processes with a single writer or on threads (default config.CLEANING_EXECUTOR)")
+    parser.add_argument('--workers', type=int, default=None, help="Workers (defaults to the available cores for processes)")
+    add_profile_argument(parser)
+
+# Function to run the clean command
+def clean(module, args):
+    from instrumentation import profiled
+    with profiled('cleaning', args.profile):
+        module.main(full_refresh=args.full, executor=args.executor, max_workers=args.workers)
+
+# Function to add the options of the predict command
+def predict_arguments(parser):
+    parser.add_argument('--resume', action='store_true', help="Skip tickers finished by the last, interrupted run")
+    parser.add_argument('--tickers', nargs='+', default=None, help="Forecast only these tickers")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to all cores)")
+    parser.add_argument('--plots', action='store_true', default=None, help="Render forecast plots after the run")
+    parser.add_argument('--model', choices=FORECAST_MODELS, default=None,
+                        help="Forecasting model ('auto' uses Prophet only where the backtests show it helps)")
+    add_profile_argument(parser)
+
+# Function to run the predict command
+def predict(module, args):
+    from instrumentation import profiled
+    with profiled('prediction', args.profile):
+        module.main(resume=args.resume, tickers=args.tickers, max_workers=args.workers, render_plots=args.plots,
+                    model=args.model)
+
+# Function to add the options of the backtest command
+def backtest_arguments(parser):
+    parser.add_argument('--tickers', nargs='+', default=None, help="Backtest only these tickers")
+    parser.add_argument('--engine', choices=BACKTEST_ENGINES, default=None, help="Forecasting engine")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to all cores)")
+    parser.add_argument('--as-of', default=None, help="Keep only the universe members on this date (YYYY-MM-DD)")
+
+# Function to run the backtest command
+def backtest(module, args):
+    module.main(tickers=args.tickers, engine=args.engine, max_workers=args.workers, as_of=args.as_of)
+
+# Function to add the options of the tune command
+def tune_arguments(parser):
+    parser.add_argument('--tickers', nargs='+', default=None, help="Tune only these tickers")
+    parser.add_argument('--per', choices=['ticker', 'cluster'], default='ticker', help="Tune each ticker or each volatility cluster")
+    parser.add_argument('--strategy', choices=['grid', 'halving'], default=None, help="Search strategy")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to all cores)")
+    add_profile_argument(parser)
+
+# Function to run the tune command
+def tune(module, args):
+    from instrumentation import profiled
+    with profiled('tuning', args.profile):
+        module.main(tickers=args.tickers, per=args.per, strategy=args.strategy, max_workers=args.workers)
+
+# Function to add the options of the render command
+def render_arguments(parser):
+    parser.add_argument('--tickers', nargs='+', default=None, help="Render only these tickers")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to all cores)")
+    parser.add_argument('--no-summary', action='store_true', help="Skip the aggregate metric charts")
+    add_profile_argument(parser)
+
+# Function to run the render command
+def render(module, args):
+    from instrumentation import profiled
+    with profiled('render', args.profile):
+        module.main(tickers=args.tickers, max_workers=args.workers, summary=not args.no_summary)
+
+# Function to add the options of the pipeline command
+def pipeline_arguments(parser):
+    parser.add_argument('--only-stage', nargs='+', choices=['collect', 'clean', 'predict'], default=None, dest='stages',
+                        help="Run only these stages (default: all)")
+    parser.add_argument('--tickers', nargs='+', default=None, help="Run only these tickers")
+    parser.add_argument('--provider', choices=['yahoo', 'fake'], default=None, help="Defaults to config.DATA_PROVIDER")
+    parser.add_argument('--model', choices=FORECAST_MODELS, default=None,
+                        help="Forecasting model (defaults to prophet_config.FORECAST_MODEL)")
+    parser.add_argument('--workers', type=int, default=None, help="Prediction worker processes (defaults to all cores)")
+    parser.add_argument('--full', action='store_true', help="Re-clean the full history of every ticker")
+    parser.add_argument('--offline', action='store_true', default=None, help="Use the stored universe snapshots only")
+    add_profile_argument(parser)
+
+# Function to run the pipeline command, exiting nonzero when any ticker failed
+def pipeline(module, args):
+    from instrumentation import profiled
+    with profiled('pipeline', args.profile):
+        failures = module.main(args.stages, args.tickers, module.get_provider(args.provider) if args.provider else None,
+                               args.model, args.workers, args.full, args.offline)
+    sys.exit(1 if failures else 0)
+
+# Function to add the options of the universe command
+def universe_arguments(parser):
+    parser.add_argument('--sources', nargs='+', choices=['sp500', 'russell_3000', 'etfs'], default=None,
+                        help="Sources (default: config flags)")
+    parser.add_argument('--refresh', action='store_true', help="Fetch now regardless of the TTL")
+    parser.add_argument('--offline', action='store_true', default=None, help="Only use stored snapshots")
+    parser.add_argument('--as-of', default=None, help="Show the membership as of this date (YYYY-MM-DD)")
+
+# Function to run the universe command
+def universe(module, args):
+    module.main(args.sources, args.refresh, args.offline, args.as_of)
+
+# Function to add the options of the serve command
+def serve_arguments(parser):
+    parser.add_argument('--host', default=None, help="Defaults to prophet_config.QUERY_HOST (localhost)")
+    parser.add_argument('--port', type=int, default=None, help="Defaults to prophet_config.QUERY_PORT")
+    parser.add_argument('--reload-seconds', type=float, default=None, help="How often to check for a newer finished run")
+
+# Function to run the serve command
+def serve(module, args):
+    module.main(args.host, args.port, args.reload_seconds)
+
+# Function to add the options of the config command
+def config_arguments(parser):
+    parser.add_argument('names', nargs='*', help="Settings to show (default: all)")
+
+# Function to print the effective settings of config.py and prophet_config.py without importing any stage
+def show_config(module, args):
+    import config
+    import prophet_config
+    for source in [config, prophet_config]:
+        names = [name for name in vars(source) if name.isupper()] + (['END_DATE'] if source is config else [])
+        for name in names:
+            if not args.names or name in args.names:
+                print(f"{source.__name__}.{name} = {getattr(source, name)!r}")
+
+# Commands: (module imported when the command runs, description, options, runner called with the module and arguments)
+COMMANDS = {
+    'collect': ('data_collection', "Collect daily OHLCV data into the raw price store", collect_arguments, collect),
+    'clean': ('data_cleaning', "Clean raw stock data into the cleaned price store", clean_arguments, clean),
+    'predict': ('prediction', "Forecast cleaned stock prices", predict_arguments, predict),
+    'backtest': ('backtest', "Walk-forward backtest of the forecasts", backtest_arguments, backtest),
+    'tune': ('tuning', "Tune Prophet hyperparameters per ticker or per cluster", tune_arguments, tune),
+    'render': ('render', "Render forecast plots from the stored forecasts", render_arguments, render),
+    'pipeline': ('run_pipeline', "Run collection, cleaning and prediction as one streaming pipeline", pipeline_arguments, pipeline),
+    'universe': ('universe', "Show, refresh or diff the ticker universe snapshots", universe_arguments, universe),
+    'serve': ('query_service', "Serve forecast queries over HTTP on localhost", serve_arguments, serve),
+    'config': (None, "Print the effective configuration", config_arguments, show_config),
+}
+
+# Function to run a command from a stage script's __main__ block with the script's own arguments; the script
+# passes its module so the stage is not imported a second time under its module name
+def run_script(name, module):
+    _, description, add_arguments, run = COMMANDS[name]
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    return run(module, parser.parse_args())
+
+# Main function to parse `<command> [options]` and run the command
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cli.py', description="Algorithmic trading pipeline")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for name, (_, description, add_arguments, _) in COMMANDS.items():
+        add_arguments(subparsers.add_parser(name, help=description, description=description))
+    args = parser.parse_args(argv)
+    module_name, _, _, run = COMMANDS[args.command]
+    return run(importlib.import_module(module_name) if module_name else None, args)
+
+if __name__ == "__main__":
+    main()
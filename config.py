@@ -5,30 +5,115 @@
 import os
 import datetime
 
+# Project root, so paths resolve the same from any working directory
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
 # Database configuration
-RAW_DATABASE_PATH = os.path.expanduser("../data/raw_stock_data.db")
-CLEANED_DATABASE_PATH = os.path.expanduser("../data/cleaned_stock_data.db")
-FORECAST_DATABASE_PATH = os.path.expanduser("../data/forecast_stock_data.db")
+RAW_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "raw_stock_data.db")
+CLEANED_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "cleaned_stock_data.db")
+FORECAST_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "forecast_stock_data.db")
+
+# Price storage backend: 'sqlite' (single long table keyed by ticker and Date),
+# 'parquet' (one partition per ticker) or 'tables' (legacy one table per ticker)
+STORAGE_BACKEND = 'sqlite'
+PRICE_TABLE = 'prices'
+RAW_PARQUET_PATH = os.path.join(PROJECT_ROOT, "data", "raw_stock_data_parquet")
+CLEANED_PARQUET_PATH = os.path.join(PROJECT_ROOT, "data", "cleaned_stock_data_parquet")
+
+# SQLite write settings: WAL journaling lets readers proceed while the single writer commits
+SQLITE_WAL_MODE = True
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+# Bulk writer: rows per transaction, frames buffered before producers block, idle seconds before a partial flush
+WRITER_BATCH_ROWS = 50000
+WRITER_QUEUE_SIZE = 64
+WRITER_FLUSH_SECONDS = 2.0
+
+# Columns held by the raw and cleaned price stores
+RAW_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+CLEANED_COLUMNS = ['Close']
 
 # Log directory
-LOG_DIRECTORY = os.path.expanduser("../logs")
+LOG_DIRECTORY = os.path.join(PROJECT_ROOT, "logs")
 
 # Log file paths
 DATA_COLLECTION_LOG_FILE = os.path.join(LOG_DIRECTORY, "1_data_collection_last_run_log.txt")
+DATA_COLLECTION_GAPS_FILE = os.path.join(LOG_DIRECTORY, "1_data_collection_known_gaps.json")
+DATA_COLLECTION_EMPTY_TICKERS_FILE = os.path.join(LOG_DIRECTORY, "1_data_collection_empty_tickers.json")
 CLEANING_LOG_FILE = os.path.join(LOG_DIRECTORY, "2_clean_and_predict_last_run_log.txt")
+CLEANING_WATERMARK_FILE = os.path.join(LOG_DIRECTORY, "2_cleaning_watermarks.json")
+
+# Run reports: per-ticker phase timings, memory high-water mark and errors of every stage run,
+# written as one JSON file per run and appended to the run_reports, run_phase_timings and run_errors tables
+RUN_REPORT_DIRECTORY = os.path.join(LOG_DIRECTORY, "run_reports")
+RUN_REPORT_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "run_reports.db")
+RUN_REPORT_TOP_TICKERS = 10
+# Profile every stage run with cProfile (or pass --profile to a script); .prof files go to PROFILE_DIRECTORY
+PROFILE_RUNS = False
+PROFILE_DIRECTORY = os.path.join(LOG_DIRECTORY, "profiles")
+
+# Results of benchmarks/run_benchmarks.py, one row per benchmark and run, tagged with the commit
+BENCHMARK_RESULTS_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "benchmark_results.db")
+
+# Cleaning mode: 'incremental' re-cleans only raw rows added since the last run, 'full' re-cleans every ticker
+CLEANING_MODE = 'incremental'
+# Days of raw history re-read before the watermark to anchor weekend fill and interpolation
+CLEANING_LOOKBACK_DAYS = 10
+# Cleaning engine: 'batch' fills each ticker's whole history in pandas (float64), 'streaming' reads raw rows in
+# date-ordered chunks of CLEANING_CHUNK_ROWS and keeps memory bounded (float32 prices, int32 day numbers)
+CLEANING_ENGINE = 'batch'
+CLEANING_CHUNK_ROWS = 100000
+# Cleaning executor of data_cleaning.py: 'processes' shards tickers across worker processes that return cleaned
+# arrays to a single writer in the parent, 'threads' cleans and writes on 5 threads (GIL-bound)
+CLEANING_EXECUTOR = 'processes'
+CLEANING_MAX_WORKERS = None  # None uses every core available to the process
+CLEANING_TASK_CHUNKSIZE = 4  # Tickers sent to a worker at a time
+# Cleaning threads used by run_pipeline.py while collection is still running
+PIPELINE_CLEANING_WORKERS = 5
 
 # Data directories
-COMPLETE_RAW_DATA_DIR = os.path.expanduser("../data/complete_raw_daily_stock_data")
+COMPLETE_RAW_DATA_DIR = os.path.join(PROJECT_ROOT, "data", "complete_raw_daily_stock_data")
 
 # Tickers CSV files
-RUSSELL_3000_CSV = os.path.expanduser("../data/Russell_3000_stock_tickers.csv")
-ETFs_CSV = os.path.expanduser("../data/ETFs.csv")
+RUSSELL_3000_CSV = os.path.join(PROJECT_ROOT, "data", "Russell 3000 stock tickers.csv")
+ETFs_CSV = os.path.join(PROJECT_ROOT, "data", "ETFs.csv")
 
 # Boolean flags to determine which tickers to retrieve
 RETRIEVE_SP500 = True
 RETRIEVE_RUSSELL_3000 = False
 RETRIEVE_ETFs = False
 
-# Date range for data retrieval
+# Ticker universe snapshots (universe.py): membership of each source stored by date, refetched only when the
+# latest snapshot was checked more than UNIVERSE_TTL_DAYS ago; offline runs always use the latest snapshot
+UNIVERSE_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "universe.db")
+UNIVERSE_TTL_DAYS = 7
+UNIVERSE_OFFLINE = False
+# A fetch that is empty or drops more than this share of the latest snapshot's tickers (a truncated file, a page
+# layout change picking the wrong table) is treated as failed and the latest snapshot is kept
+UNIVERSE_MAX_REMOVED_SHARE = 0.2
+
+# Date range for data retrieval; END_DATE is today, read when accessed (see __getattr__) so long-running
+# processes do not keep the date they were started on. Assigning config.END_DATE pins it.
 START_DATE = datetime.date(1999, 1, 1)
-END_DATE = datetime.datetime.now().date()
+
+# Market data provider: 'yahoo', or 'fake' for the deterministic offline provider used in benchmarks
+DATA_PROVIDER = 'yahoo'
+COLLECTION_BATCH_SIZE = 50  # Tickers per download request
+COLLECTION_MAX_WORKERS = 4  # Concurrent download requests
+COLLECTION_RATE_LIMIT = 2.0  # HTTP requests started per second (token bucket refill rate); Yahoo makes one per ticker
+COLLECTION_RATE_BURST = 4  # Token bucket capacity
+COLLECTION_MAX_RETRIES = 4  # Retries per failed request (only the failed tickers of a batch are retried)
+COLLECTION_BACKOFF_SECONDS = 1.0  # First retry delay, doubled on every further attempt
+
+# Interior gaps between stored dates longer than this many calendar days are refetched
+MAX_GAP_DAYS = 5
+# Gaps the provider answered without data (market closures, pre-listing periods) are not refetched for this many days
+KNOWN_GAP_TTL_DAYS = 30
+# Tickers without stored rows that the provider answered without data (delisted, renamed) are skipped for this many days
+EMPTY_TICKER_TTL_DAYS = 7
+
+# Function to resolve the settings computed on access (module __getattr__, only called for names not set above)
+def __getattr__(name):
+    if name == 'END_DATE':
+        return datetime.date.today()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
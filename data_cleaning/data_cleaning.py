@@ -3,119 +3,303 @@
 # Script for cleaning stock data
 
 import os
+import json
+import time
 import pandas as pd
 import datetime
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from threading import Lock
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, Date, inspect
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import config
+from fill_engine import fill_daily_frame
+from stream_cleaner import clean_streaming, to_day_numbers
+from price_store import open_raw_store, open_cleaned_store
+from bulk_writer import BulkWriter
+from instrumentation import RunRecorder, TaskTimings, phase
 
 # Setup and Configuration
-source_database_path = config.RAW_DATABASE_PATH
-cleaned_database_path = config.CLEANED_DATABASE_PATH
 log_directory = config.LOG_DIRECTORY
 log_file = config.CLEANING_LOG_FILE
+watermark_file = config.CLEANING_WATERMARK_FILE
 
 # Ensure log directory exists
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
 
-# Initialize SQLite engines
-source_engine = create_engine(f'sqlite:///{source_database_path}')
-cleaned_engine = create_engine(f'sqlite:///{cleaned_database_path}')
-metadata = MetaData()
+# Open the raw and cleaned price stores
+source_store = open_raw_store()
+cleaned_store = open_cleaned_store()
 
 start_date = pd.to_datetime('2018-01-01').tz_localize('US/Eastern')
-end_date = pd.to_datetime(datetime.datetime.now(), utc=True).tz_convert('US/Eastern')
+
+# Function to return the last date kept by cleaning, config.END_DATE (today unless pinned), resolved on every call
+# so a long-running process keeps cleaning up to the current day
+def current_end_date():
+    return pd.Timestamp(config.END_DATE).tz_localize('US/Eastern')
 
 # Global counter and its lock
 global_counter = 0
 counter_lock = Lock()
 
-# Function to read the last run date from a log file
-def read_last_run(log_file):
-    if os.path.exists(log_file):
-        with open(log_file, 'r') as f:
-            last_run_str = f.readline().strip().split(": ")[1]
-            return datetime.datetime.strptime(last_run_str, '%Y-%m-%d %H:%M:%S.%f')
+# Function to read the per-ticker cleaning watermarks (raw last_date and row count at the last clean)
+def read_watermarks(watermark_file):
+    if os.path.exists(watermark_file):
+        with open(watermark_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+# Function to save the per-ticker cleaning watermarks
+def write_watermarks(watermark_file, watermarks):
+    with open(watermark_file, 'w') as f:
+        json.dump(watermarks, f, indent=1, sort_keys=True)
+
+# Function to load the raw rows to clean, returning (frame, since)
+# With a watermark only rows from the last valid Close at or before the watermark onward are re-cleaned; since is
+# None when the ticker needs a full re-clean (no watermark, rewritten history or no anchor within the lookback)
+def load_raw_rows(table_name, watermark=None, raw_rows=None):
+    if watermark is not None and raw_rows is not None:
+        df = source_store.load([table_name], start=lookback_start(watermark), columns=['Open', 'Close'])
+        since = incremental_since(df, watermark, raw_rows)
+        if since is not None:
+            return df, since
+    return source_store.load([table_name], columns=['Open', 'Close']), None
+
+# Function to return the first raw date re-read before an incremental clean
+def lookback_start(watermark):
+    return pd.Timestamp(watermark['last_date']) - pd.Timedelta(days=config.CLEANING_LOOKBACK_DAYS)
+
+# Function to return the incremental anchor (last valid Close at or before the watermark) from the lookback rows,
+# or None when the raw history was rewritten since the watermark or has no anchor in the lookback
+def incremental_since(df, watermark, raw_rows):
+    last_date = pd.Timestamp(watermark['last_date'])
+    new_rows = int((df['Date'] > last_date).sum())
+    anchors = df.loc[(df['Date'] <= last_date) & df['Close'].notna(), 'Date']
+    if watermark['rows'] + new_rows == raw_rows and not anchors.empty:
+        return anchors.max()
+    return None
+
+# Function to clean a single table (stock data) into daily (days, closes) arrays without writing them
+# Returns the int32 day numbers and float64 closes, the incremental anchor (None for a full clean) and the new watermark
+def clean_batch(table_name, watermark=None, raw_rows=None, recorder=None):
+    with phase(recorder, 'read', table_name) as timing:
+        df, since = load_raw_rows(table_name, watermark, raw_rows)
+        timing['rows'] = len(df)
+    if since is None:
+        new_watermark = {'last_date': df['Date'].max().strftime('%Y-%m-%d'), 'rows': len(df)}
     else:
-        return None
+        new_rows = int((df['Date'] > pd.Timestamp(watermark['last_date'])).sum())
+        new_watermark = {'last_date': df['Date'].max().strftime('%Y-%m-%d'), 'rows': watermark['rows'] + new_rows}
 
-# Function to process a single table (stock data)
-def process_table(table_name):
-    global global_counter
-    df = pd.read_sql_table(table_name, con=source_engine, parse_dates=['Date'], index_col='Date')
-    df.index = df.index.tz_localize('US/Eastern', ambiguous='infer')
-    df = df[['Open', 'Close']]
+    with phase(recorder, 'fill', table_name) as timing:
+        df = df.drop(columns=['ticker']).set_index('Date')
+        df.index = df.index.tz_localize('US/Eastern', ambiguous='infer')
+        df = df[['Open', 'Close']]
+
+        # Handle duplicate dates by averaging
+        if df.index.duplicated().any():
+            df = df.groupby(df.index).mean()
 
-    # Handle duplicate dates by averaging
-    if df.index.duplicated().any():
-        df = df.groupby(df.index).mean()
+        # Filter for dates within the specified range
+        df = df[(df.index >= start_date) & (df.index <= current_end_date())]
 
-    # Filter for dates within the specified range
-    df = df[(df.index >= start_date) & (df.index <= end_date)]
+        # Resample to daily frequency, filling missing dates, then fill weekend values and interpolate other
+        # missing 'Close' prices (a range without rows gives an empty clean)
+        df_daily = fill_daily_frame(df.resample('D').asfreq()) if not df.empty else df
 
-    # Resample to daily frequency, filling missing dates
-    df_daily = df.resample('D').asfreq()
+        # In incremental mode keep only the rows after the anchor; earlier rows are unchanged
+        if since is not None:
+            df_daily = df_daily[df_daily.index > since.tz_localize('US/Eastern')]
+        timing['rows'] = len(df_daily)
+    return to_day_numbers(df_daily.index), df_daily['Close'].to_numpy(), since, new_watermark
 
-    # Interpolate weekend values
-    for date, row in df_daily.iterrows():
-        if date.weekday() in [5, 6]:  # Saturday or Sunday
-            if pd.isna(row['Close']):
-                df_daily.at[date, 'Close'] = df_daily.at[date - pd.DateOffset(days=date.weekday() - 4), 'Close']
-            if pd.isna(row['Open']):
-                next_monday = date + pd.DateOffset(days=7 - date.weekday())
-                if next_monday in df_daily.index:
-                    df_daily.at[date, 'Open'] = df_daily.at[next_monday, 'Open']
+# Function to clean a single table with the streaming engine (bounded memory), writing each block as it is produced;
+# returns the rows written, the incremental anchor and the new watermark
+def clean_stream(table_name, watermark=None, raw_rows=None, recorder=None):
+    read_start, since = None, None
+    if watermark is not None and raw_rows is not None:
+        with phase(recorder, 'read', table_name):
+            since = incremental_since(source_store.load([table_name], start=lookback_start(watermark), columns=['Close']),
+                                      watermark, raw_rows)
+        if since is not None:
+            read_start = lookback_start(watermark)
 
-    # Interpolate other missing values linearly for 'Close' prices
-    df_daily['Close'] = df_daily['Close'].interpolate(method='linear')
+    rows_read, last_raw_date, rows_written, new_rows = clean_streaming(
+        table_name, source_store, cleaned_store, start_date, current_end_date(), read_start, since,
+        watermark['last_date'] if since is not None else None, recorder=recorder)
+    if last_raw_date is None:
+        raise ValueError(f"No raw rows for {table_name}")
+    rows = rows_read if since is None else watermark['rows'] + new_rows
+    return rows_written, since, {'last_date': last_raw_date.strftime('%Y-%m-%d'), 'rows': rows}
 
-    # Drop the 'Open' column
-    df_daily = df_daily.drop(columns=['Open'])
+# Function to build the long frame of cleaned rows written to the cleaned store
+def cleaned_frame(table_name, days, closes):
+    return cleaned_store.frame_for_ticker(table_name, pd.DataFrame({'Date': days.astype('datetime64[D]'), 'Close': closes}))
 
-    # Update the global counter within a thread-safe block
+# Function to count and print a cleaned ticker (thread-safe)
+def log_cleaned(table_name, since, rows):
+    global global_counter
     with counter_lock:
         global_counter += 1
         local_counter = global_counter
+    mode = 'full' if since is None else 'incremental'
+    print(f"{local_counter}) Processed data saved for {table_name} ({mode}, {config.CLEANING_ENGINE}, {rows} rows)")
+
+# Function to process a single table (stock data) and return its new watermark
+# Read, fill and write times are recorded on the recorder (instrumentation.RunRecorder) when one is given
+def process_table(table_name, watermark=None, raw_rows=None, recorder=None):
+    if config.CLEANING_ENGINE == 'streaming':
+        rows, since, new_watermark = clean_stream(table_name, watermark, raw_rows, recorder)
+    else:
+        days, closes, since, new_watermark = clean_batch(table_name, watermark, raw_rows, recorder)
+
+        # Save the cleaned data to the new database (upsert when incremental, replace otherwise)
+        with phase(recorder, 'write', table_name) as timing:
+            if since is None and len(days) == 0:
+                cleaned_store.delete([table_name])
+            else:
+                cleaned_store.write(cleaned_frame(table_name, days, closes), replace=since is None)
+            timing['rows'] = rows = len(days)
+    log_cleaned(table_name, since, rows)
+    return new_watermark
+
+# Function to initialize a cleaning worker process: fresh database connections for its reads
+def init_worker():
+    for store in (source_store, cleaned_store):
+        if hasattr(store, 'engine'):
+            store.engine.dispose(close=False)
+
+# Function run in a worker process: clean one ticker and return its cleaned arrays, watermark and timings
+# for the parent's single writer (task is (ticker, watermark, raw_rows)). The streaming engine writes its blocks
+# in place instead, so a worker never holds a ticker's full history; its result carries only the row count.
+def clean_task(task):
+    table_name, watermark, raw_rows = task
+    timings = TaskTimings()
+    start_time = time.perf_counter()
+    try:
+        if config.CLEANING_ENGINE == 'streaming':
+            rows, since, new_watermark = clean_stream(table_name, watermark, raw_rows, timings)
+            result = {'rows': rows}
+        else:
+            days, closes, since, new_watermark = clean_batch(table_name, watermark, raw_rows, timings)
+            result = {'days': days, 'closes': closes}
+        return dict(result, ticker=table_name, success=True, since=since, watermark=new_watermark,
+                    timings=timings.as_dict(), seconds=time.perf_counter() - start_time)
+    except Exception as e:
+        return {'ticker': table_name, 'success': False, 'error': str(e), 'timings': timings.as_dict(),
+                'seconds': time.perf_counter() - start_time}
 
-    # Save the cleaned data to the new database
-    df_daily.reset_index(inplace=True)
-    df_daily['Date'] = df_daily['Date'].dt.date
-    df_daily.to_sql(table_name, con=cleaned_engine, if_exists='replace', index=False)
-    print(f"{local_counter}) Processed data saved to table {table_name}")
+# Function to return the number of cleaning worker processes: config.CLEANING_MAX_WORKERS or the cores available
+def cleaning_workers(max_workers=None):
+    max_workers = max_workers or config.CLEANING_MAX_WORKERS
+    if max_workers:
+        return max_workers
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))  # Cores this process may run on (containers, taskset)
+    return os.cpu_count() or 1
+
+# Function to clean tickers on a process pool: workers read and fill, the parent writes every batch-engine result
+# through bulk writers (one replacing full cleans, one upserting incremental ones) so the cleaned store has one
+# writer; full cleans without rows delete the ticker's old rows once the writers are done
+def clean_in_processes(tasks, recorder, max_workers=None):
+    full_writer = BulkWriter(cleaned_store, replace=True, recorder=recorder)
+    incremental_writer = BulkWriter(cleaned_store, recorder=recorder)
+    results, emptied = [], []
+    with ProcessPoolExecutor(max_workers=cleaning_workers(max_workers), initializer=init_worker) as executor:
+        for result in executor.map(clean_task, tasks, chunksize=config.CLEANING_TASK_CHUNKSIZE):
+            recorder.add_timings(result['ticker'], result.pop('timings'))
+            if result['success'] and 'days' in result:
+                since, days = result.pop('since'), result.pop('days')
+                if since is None and len(days) == 0:
+                    emptied.append(result['ticker'])
+                writer = full_writer if since is None else incremental_writer
+                writer.put(cleaned_frame(result['ticker'], days, result.pop('closes')))
+                log_cleaned(result['ticker'], since, len(days))
+            elif result['success']:
+                log_cleaned(result['ticker'], result.pop('since'), result.pop('rows'))
+            else:
+                recorder.error(result['ticker'], result['error'])
+            results.append(result)
+    full_writer.close()
+    incremental_writer.close()
+
+    failed_writes = set(full_writer.failed_tickers) | set(incremental_writer.failed_tickers)
+    if emptied:
+        try:
+            cleaned_store.delete(emptied)
+        except Exception as e:
+            print(f"Could not delete the cleaned rows of {len(emptied)} tickers without rows: {e}")
+            failed_writes.update(emptied)
+
+    # Tickers whose rows could not be written keep their old watermark
+    for result in results:
+        if result['success'] and result['ticker'] in failed_writes:
+            result.update(success=False, error='write failed')
+    return results
+
+# Function to clean one ticker and report the outcome without raising
+def clean_ticker(table_name, watermark=None, raw_rows=None, recorder=None):
+    try:
+        return {'ticker': table_name, 'success': True, 'watermark': process_table(table_name, watermark, raw_rows, recorder)}
+    except Exception as e:
+        if recorder is not None:
+            recorder.error(table_name, e)
+        return {'ticker': table_name, 'success': False, 'error': str(e)}
+
+# Function to log the completion of data cleaning
+def log_completion():
+    with open(log_file, 'w') as f:
+        f.write(f"Last run: {datetime.datetime.now()}")
+
+# Function to tell whether a ticker's raw rows changed since its watermark (raw stats row: last_date and rows)
+def needs_cleaning(watermark, stats):
+    return not (watermark and watermark['last_date'] == stats['last_date'].strftime('%Y-%m-%d')
+                and watermark['rows'] == stats['rows'])
 
 # Main function to process tables in parallel
-def main():
-    start_time = time.time()
-    last_run = read_last_run(log_file)
-
-    inspector = inspect(source_engine)
-    table_names = inspector.get_table_names()
-    
-    # Using ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(process_table, table_name): table_name for table_name in table_names}
-        error_tables = [futures[future] for future in as_completed(futures) if future.result() is not None]
+# In incremental mode unchanged tickers are skipped and changed ones only re-clean their new rows
+# executor picks worker processes with a single writer ('processes') or threads writing in place ('threads'),
+# default config.CLEANING_EXECUTOR; max_workers defaults to the available cores (processes) or 5 threads
+def main(full_refresh=False, executor=None, max_workers=None):
+    recorder = RunRecorder('cleaning')
+    incremental = config.CLEANING_MODE == 'incremental' and not full_refresh
+    watermarks = read_watermarks(watermark_file) if incremental else {}
+
+    raw_stats = source_store.stats().set_index('ticker')
+    table_names = [table_name for table_name, stats in raw_stats.iterrows()
+                   if needs_cleaning(watermarks.get(table_name), stats)]
+    print(f"{len(table_names)} of {len(raw_stats)} tickers need cleaning")
+
+    executor = executor or config.CLEANING_EXECUTOR
+    if executor == 'processes':
+        # Longest histories first so the last tasks to finish are short ones
+        tasks = sorted(((table_name, watermarks.get(table_name), int(raw_stats.at[table_name, 'rows'])) for table_name in table_names),
+                       key=lambda task: -task[2])
+        print(f"Cleaning on {cleaning_workers(max_workers)} worker processes")
+        results = clean_in_processes(tasks, recorder, max_workers)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers or 5) as pool:
+            futures = {pool.submit(clean_ticker, table_name, watermarks.get(table_name), int(raw_stats.at[table_name, 'rows']), recorder): table_name
+                       for table_name in table_names}
+            results = [future.result() for future in as_completed(futures)]
+    error_tables = [result['ticker'] for result in results if not result['success']]
 
     print("Processing complete.")
     if error_tables:
         print(f"Total number of errors: {len(error_tables)}")
         print("Tables with errors:")
-        print('\n'.join(error_tables))
+        print('\n'.join(f"{result['ticker']}: {result['error']}" for result in results if not result['success']))
     else:
         print("No errors encountered.")
 
-    # Log the completion of data cleaning
-    with open(log_file, 'w') as f:
-        f.write(f"Last run: {datetime.datetime.now()}")
+    # Save the watermarks of the tickers cleaned successfully
+    watermarks.update({result['ticker']: result['watermark'] for result in results if result['success']})
+    write_watermarks(watermark_file, watermarks)
 
-    end_time = time.time()
-    total_time = (end_time - start_time) / 60
-    print(f"Total processing time: {int(total_time)} minutes and {int((total_time - int(total_time)) * 60)} seconds")
+    # Log the completion of data cleaning
+    log_completion()
+    recorder.finish()
 
 if __name__ == "__main__":
-    main()
+    import cli
+    cli.run_script('clean', sys.modules[__name__])
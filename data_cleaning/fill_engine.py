@@ -0,0 +1,101 @@
+# fill_engine.py
+# ../data_cleaning/fill_engine.py
+# Vectorized weekend and gap fill engine for daily stock data
+
+import numpy as np
+import pandas as pd
+
+# Weekday numbers (Monday=0) treated as non-trading weekend days
+WEEKEND_DAYS = (5, 6)
+
+# Function to locate, for each row of a contiguous daily calendar, the previous Friday and the next Monday
+# Positions falling outside the calendar are returned as -1
+def weekend_source_positions(weekdays):
+    weekdays = np.asarray(weekdays, dtype=np.int64)
+    positions = np.arange(len(weekdays))
+    is_weekend = np.isin(weekdays, WEEKEND_DAYS)
+    friday_pos = np.where(is_weekend, positions - (weekdays - 4), -1)
+    monday_pos = np.where(is_weekend, positions + (7 - weekdays), -1)
+    friday_pos[friday_pos < 0] = -1
+    monday_pos[monday_pos >= len(weekdays)] = -1
+    return is_weekend, friday_pos, monday_pos
+
+# Function to gather rows of a 1-D or 2-D (dates x tickers) array, yielding NaN for positions of -1
+def _take_rows(values, positions):
+    taken = np.full((len(positions),) + values.shape[1:], np.nan)
+    available = positions >= 0
+    taken[available] = values[positions[available]]
+    return taken
+
+# Function to fill weekend Close from the previous Friday and weekend Open from the next Monday
+# Works on 1-D arrays or 2-D (dates x tickers) panels sharing the same daily calendar
+def fill_weekend_values(close, open_, weekdays):
+    close = np.array(close, dtype=float)
+    open_ = np.array(open_, dtype=float)
+    is_weekend, friday_pos, monday_pos = weekend_source_positions(weekdays)
+    rows = np.flatnonzero(is_weekend)
+    if len(rows) == 0:
+        return close, open_
+
+    # Sources are always weekdays, so reading them from the unfilled arrays matches a sequential fill
+    weekend_close = close[rows]
+    close[rows] = np.where(np.isnan(weekend_close), _take_rows(close, friday_pos[rows]), weekend_close)
+    weekend_open = open_[rows]
+    open_[rows] = np.where(np.isnan(weekend_open), _take_rows(open_, monday_pos[rows]), weekend_open)
+    return close, open_
+
+# Function to linearly interpolate missing values along the date axis, matching Series.interpolate(method='linear')
+# Leading NaNs are kept and trailing NaNs take the last valid value
+def interpolate_linear(values):
+    values = np.array(values, dtype=float)
+    columns = values.reshape(len(values), -1)
+    positions = np.arange(len(values))
+    for col in range(columns.shape[1]):
+        column = columns[:, col]
+        valid = ~np.isnan(column)
+        if valid.all() or not valid.any():
+            continue
+        missing = ~valid & (positions > np.argmax(valid))
+        column[missing] = np.interp(positions[missing], positions[valid], column[valid])
+    return values
+
+# Function to apply the weekend fill and Close interpolation to a single daily-resampled frame
+def fill_daily_frame(df_daily):
+    weekdays = df_daily.index.weekday.to_numpy()
+    close, open_ = fill_weekend_values(df_daily['Close'].to_numpy(), df_daily['Open'].to_numpy(), weekdays)
+    df_filled = df_daily.copy()
+    df_filled['Open'] = open_
+    df_filled['Close'] = interpolate_linear(close)
+    return df_filled
+
+# Function to fill a panel of daily-resampled frames (ticker -> frame) in one vectorized pass
+# Each ticker keeps its own date range, so the result matches calling fill_daily_frame per ticker
+def fill_panel(frames):
+    frames = {ticker: df for ticker, df in frames.items() if not df.empty}
+    if not frames:
+        return {}
+
+    first = min(df.index[0] for df in frames.values())
+    last = max(df.index[-1] for df in frames.values())
+    calendar = pd.date_range(first, last, freq='D')
+    tickers = list(frames)
+    close = np.full((len(calendar), len(tickers)), np.nan)
+    open_ = np.full((len(calendar), len(tickers)), np.nan)
+    offsets = {}
+    for col, ticker in enumerate(tickers):
+        df = frames[ticker]
+        start = calendar.get_loc(df.index[0])
+        offsets[ticker] = (start, start + len(df))
+        close[start:start + len(df), col] = df['Close'].to_numpy()
+        open_[start:start + len(df), col] = df['Open'].to_numpy()
+
+    close, open_ = fill_weekend_values(close, open_, calendar.weekday.to_numpy())
+
+    filled = {}
+    for col, ticker in enumerate(tickers):
+        start, stop = offsets[ticker]
+        df_filled = frames[ticker].copy()
+        df_filled['Open'] = open_[start:stop, col]
+        df_filled['Close'] = interpolate_linear(close[start:stop, col])
+        filled[ticker] = df_filled
+    return filled
@@ -0,0 +1,189 @@
+# stream_cleaner.py
+# ../data_cleaning/stream_cleaner.py
+# Memory-bounded cleaning: raw rows are read in date-ordered chunks and filled with only a few values of state
+# carried across chunk boundaries; prices are held as float32 and dates as int32 day numbers
+
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config
+from instrumentation import phase
+
+# Function to convert dates to int32 day numbers (days since 1970-01-01)
+def to_day_numbers(dates):
+    return pd.DatetimeIndex(dates).tz_localize(None).to_numpy(dtype='datetime64[D]').astype(np.int32)
+
+# Function to return the weekday (Monday=0) of day numbers; 1970-01-01 was a Thursday
+def day_weekdays(days):
+    return (days.astype(np.int64) + 3) % 7
+
+# Streaming version of the daily fill in process_table: duplicate days averaged, resampled to every calendar day,
+# weekend Close taken from the previous Friday, then linear interpolation with trailing days taking the last
+# valid Close. push() takes raw rows in date order and returns the days that can already be finalized.
+# State carried between chunks: the last (possibly incomplete) day, the latest Friday, the last valid Close
+# and the start of the run of days still waiting for the next valid Close.
+class StreamingCloseFill:
+    def __init__(self, first_day=None, last_day=None):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.carry = None
+        self.next_day = None
+        self.friday = (None, np.nan)
+        self.last_valid = None
+        self.pending_start = None
+
+    # Function to add a chunk of raw rows (int32 days, float32 closes), returning the finalized (days, closes)
+    def push(self, days, closes):
+        keep = np.ones(len(days), dtype=bool)
+        if self.first_day is not None:
+            keep &= days >= self.first_day
+        if self.last_day is not None:
+            keep &= days <= self.last_day
+        unique_days, sums, counts = self._aggregate(days[keep], closes[keep])
+        if len(unique_days) == 0:
+            return self._empty()
+        # The last day may continue in the next chunk, so it is held back
+        self.carry = (unique_days[-1], sums[-1], counts[-1])
+        return self._place(unique_days[:-1], self._means(sums[:-1], counts[:-1]))
+
+    # Function to finalize the stream: place the held-back day and give the trailing days the last valid Close
+    def finish(self):
+        outputs = []
+        if self.carry is not None:
+            day, total, count = self.carry
+            self.carry = None
+            outputs.append(self._place(np.array([day]), self._means(np.array([total]), np.array([count]))))
+        if self.pending_start is not None and self.pending_start < self.next_day:
+            days = np.arange(self.pending_start, self.next_day, dtype=np.int32)
+            outputs.append((days, np.full(len(days), self.last_valid[1], dtype=np.float32)))
+            self.pending_start = self.next_day
+        if not outputs:
+            return self._empty()
+        return np.concatenate([days for days, _ in outputs]), np.concatenate([closes for _, closes in outputs])
+
+    # Function to sum and count the valid closes of each day, including the day carried from the previous chunk
+    def _aggregate(self, days, closes):
+        if self.carry is not None:
+            carry_day, carry_sum, carry_count = self.carry
+            self.carry = None
+            days = np.concatenate([[carry_day], days]).astype(np.int32)
+            values = np.concatenate([[carry_sum], np.where(np.isnan(closes), 0.0, closes)])
+            weights = np.concatenate([[carry_count], ~np.isnan(closes)])
+        else:
+            values = np.where(np.isnan(closes), 0.0, closes).astype(np.float64)
+            weights = ~np.isnan(closes)
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(unique_days))
+        counts = np.bincount(inverse, weights=weights.astype(np.float64), minlength=len(unique_days))
+        return unique_days, sums, counts
+
+    # Function to turn day sums and counts into mean closes (NaN for days without a valid close)
+    def _means(self, sums, counts):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    # Function to lay aggregated days out on the calendar and apply the weekend fill
+    def _place(self, agg_days, agg_closes):
+        if len(agg_days) == 0:
+            return self._empty()
+        if self.next_day is None:
+            self.next_day = int(agg_days[0])
+        block_days = np.arange(self.next_day, int(agg_days[-1]) + 1, dtype=np.int32)
+        raw = np.full(len(block_days), np.nan)
+        raw[agg_days - self.next_day] = agg_closes
+
+        # Weekend days without a close take the previous Friday's (raw) close, possibly from an earlier chunk
+        weekdays = day_weekdays(block_days)
+        friday_days = block_days - (weekdays - 4)
+        sources = friday_days - self.next_day
+        filled = raw.copy()
+        needed = (weekdays >= 5) & np.isnan(raw)
+        in_block = needed & (sources >= 0)
+        filled[in_block] = raw[sources[in_block]]
+        filled[needed & (sources < 0) & (friday_days == self.friday[0])] = self.friday[1]
+        fridays = np.flatnonzero(weekdays == 4)
+        if len(fridays):
+            self.friday = (int(block_days[fridays[-1]]), raw[fridays[-1]])
+        self.next_day = int(block_days[-1]) + 1
+        return self._interpolate(block_days, filled)
+
+    # Function to interpolate the block against the last valid close, returning the days resolved so far
+    def _interpolate(self, block_days, values):
+        valid = ~np.isnan(values)
+        if not valid.any():
+            if self.last_valid is None:
+                return block_days, values.astype(np.float32)  # Leading days without any close stay NaN
+            if self.pending_start is None:
+                self.pending_start = int(block_days[0])
+            return self._empty()
+
+        start = self.pending_start if self.pending_start is not None else int(block_days[0])
+        valid_days, valid_values = block_days[valid], values[valid]
+        resolved = np.arange(start, int(valid_days[-1]) + 1, dtype=np.int32)
+        if self.last_valid is not None:
+            valid_days = np.concatenate([[self.last_valid[0]], valid_days])
+            valid_values = np.concatenate([[self.last_valid[1]], valid_values])
+        closes = np.interp(resolved, valid_days, valid_values)
+        closes[resolved < valid_days[0]] = np.nan
+        self.last_valid = (int(resolved[-1]), float(valid_values[-1]))
+        self.pending_start = int(resolved[-1]) + 1
+        return resolved, closes.astype(np.float32)
+
+    # Function to return an empty (days, closes) pair
+    def _empty(self):
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+# Function to clean one ticker chunk by chunk, writing each finalized block as it comes
+# With since (a date) only days after it are written, upserted over the existing rows; otherwise the ticker's rows
+# are replaced (deleted when a full clean yields no rows). Returns (raw rows read, last raw date, rows written,
+# new raw rows after watermark_date).
+def clean_streaming(table_name, source_store, cleaned_store, first_date, last_date, read_start=None, since=None,
+                    watermark_date=None, chunk_rows=None, recorder=None):
+    chunk_rows = chunk_rows or config.CLEANING_CHUNK_ROWS
+    fill = StreamingCloseFill(int(to_day_numbers([first_date])[0]), int(to_day_numbers([last_date])[0]))
+    since_day = None if since is None else int(to_day_numbers([since])[0])
+    watermark_day = None if watermark_date is None else int(to_day_numbers([watermark_date])[0])
+    raw_rows, written, new_rows, last_raw_day = 0, 0, 0, None
+    replace = since is None
+
+    # Function to write one finalized block
+    def write(days, closes):
+        nonlocal written, replace
+        if since_day is not None:
+            keep = days > since_day
+            days, closes = days[keep], closes[keep]
+        if len(days):
+            with phase(recorder, 'write', table_name) as timing:
+                frame = pd.DataFrame({'Date': days.astype('datetime64[D]'), 'Close': closes})
+                cleaned_store.write(cleaned_store.frame_for_ticker(table_name, frame), replace=replace)
+                timing['rows'] = len(days)
+            replace = False
+        written += len(days)
+
+    chunks = source_store.iter_chunks(table_name, start=read_start, columns=['Close'], chunk_rows=chunk_rows)
+    while True:
+        with phase(recorder, 'read', table_name) as timing:
+            chunk = next(chunks, None)
+            timing['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        with phase(recorder, 'fill', table_name) as timing:
+            days = to_day_numbers(chunk['Date'])
+            raw_rows += len(days)
+            last_raw_day = int(days[-1])
+            if watermark_day is not None:
+                new_rows += int((days > watermark_day).sum())
+            block = fill.push(days, chunk['Close'].to_numpy(dtype=np.float32))
+            del chunk
+            timing['rows'] = len(block[0])
+        write(*block)
+    with phase(recorder, 'fill', table_name):
+        block = fill.finish()
+    write(*block)
+    if replace:
+        # A full clean without any row still drops the ticker's previous cleaned rows
+        cleaned_store.delete([table_name])
+    last_raw_date = None if last_raw_day is None else pd.Timestamp(np.datetime64(last_raw_day, 'D'))
+    return raw_rows, last_raw_date, written, new_rows
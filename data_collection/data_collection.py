@@ -2,72 +2,79 @@
 # ../data_collection/data_collection.py
 # Script for collecting stock data
 
-import yfinance as yf
-import pandas as pd
-import requests
 import os
 import datetime
-import time
-import concurrent.futures
-from sqlalchemy import create_engine, MetaData
-from utils import get_sp500_tickers, get_russell_3000_tickers, get_ETFs_tickers, get_stock_data, read_last_run, log_last_run, process_ticker_data_parallel
+from utils import (log_last_run, prepare_for_db, plan_fetch_windows, read_known_gaps, write_known_gaps,
+                   read_empty_tickers, write_empty_tickers, record_empty_fetches)
+from providers import get_provider
+from fetcher import collect
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import config
+from price_store import open_raw_store
+from bulk_writer import BulkWriter
+from instrumentation import RunRecorder
+import universe
 
 # Setup and Configuration
-database_path = config.RAW_DATABASE_PATH
 log_directory = config.LOG_DIRECTORY
 log_file = config.DATA_COLLECTION_LOG_FILE
+gaps_file = config.DATA_COLLECTION_GAPS_FILE
+empty_tickers_file = config.DATA_COLLECTION_EMPTY_TICKERS_FILE
 
 # Ensure log directory exists
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
 
-# Initialize SQLite engine
-engine = create_engine(f'sqlite:///{database_path}')
-metadata = MetaData()
+# Open the raw price store
+store = open_raw_store()
 
-# Determine the start date for data collection
-last_run_date = read_last_run(log_file)
-start_date = (last_run_date + datetime.timedelta(days=1)).date() if last_run_date else config.START_DATE
-current_date = datetime.datetime.now().date()
+# Function to fetch tickers based on configuration, from the stored universe snapshots while they are fresh
+# New members have no stored rows, so plan_fetch_windows backfills them from START_DATE; removed members are no
+# longer collected but keep their stored history
+def get_combined_tickers(offline=None, refresh=False):
+    return universe.current_tickers(offline=offline, refresh=refresh)
 
-# Ensure start_date is before current_date
-if start_date >= current_date:
-    start_date = current_date - datetime.timedelta(days=1)
+# Main function to fetch only the missing date windows of every ticker
+def main(provider=None, tickers=None, offline=None, refresh_universe=False):
+    recorder = RunRecorder('collection')
+    current_date = datetime.datetime.now().date()
+    provider = provider or get_provider()
+    combined_tickers = tickers or get_combined_tickers(offline, refresh_universe)
 
-# Fetch Tickers based on configuration
-combined_tickers = []
+    # Determine the missing window of each ticker from the dates already stored
+    known_gaps = read_known_gaps(gaps_file)
+    empty_tickers = read_empty_tickers(empty_tickers_file)
+    windows = plan_fetch_windows(combined_tickers, store, current_date, known_gaps, empty_tickers)
+    print(f"{sum(len(tickers) for tickers in windows.values())} fetches across {len(windows)} date windows "
+          f"for {len(combined_tickers)} tickers using the {provider.name} provider")
 
-if config.RETRIEVE_SP500:
-    sp500_tickers = [ticker.replace('.', '-') for ticker in get_sp500_tickers()]
-    combined_tickers.extend(sp500_tickers)
+    # Batched, rate-limited fetching with bounded concurrency; fetch workers hand frames to a single writer
+    writer = BulkWriter(store, recorder=recorder)
+    tickers_without_data, stats = collect(windows, provider, lambda data, ticker: writer.put(prepare_for_db(data, ticker, store)),
+                                          recorder=recorder)
+    writer.close()
+    tickers_without_data = sorted(set(tickers_without_data) | set(writer.failed_tickers))
 
-if config.RETRIEVE_RUSSELL_3000:
-    russell_3000_tickers = [ticker.replace('.', '-') for ticker in get_russell_3000_tickers()]
-    combined_tickers.extend(russell_3000_tickers)
+    print('Tickers without data:', len(tickers_without_data))
+    print(tickers_without_data)
+    stats.report()
+    writer.report()
 
-if config.RETRIEVE_ETFs:
-    ETFs_tickers = [ticker.replace('.', '-') for ticker in get_ETFs_tickers()]
-    combined_tickers.extend(ETFs_tickers)
+    finish_collection(stats.empty_windows, known_gaps, empty_tickers)
+    recorder.finish()
 
-combined_tickers = list(set(combined_tickers))  # Remove duplicates
+# Function to remember the gaps and new tickers the provider answered without data, so plan_fetch_windows skips
+# them until their TTL passes, and log the completion of data collection
+def finish_collection(empty_windows, known_gaps, empty_tickers):
+    known_gaps, empty_tickers = record_empty_fetches(store, empty_windows, known_gaps, empty_tickers)
+    write_known_gaps(gaps_file, known_gaps)
+    write_empty_tickers(empty_tickers_file, empty_tickers)
 
-# Parallel Processing of Tickers
-start_time = time.time()
-tickers_without_data = []
+    # Log the completion of data collection
+    log_last_run(log_file)
+    print("Data collection complete.")
 
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    futures = {executor.submit(process_ticker_data_parallel, ticker, start_date, current_date, engine): ticker for ticker in combined_tickers}
-    for future in concurrent.futures.as_completed(futures):
-        result = future.result()
-        if result:
-            tickers_without_data.append(result)
-
-print('Tickers without data:', len(tickers_without_data))
-print(tickers_without_data)
-
-# Log the completion of data collection
-log_last_run(log_file)
-print("Data collection complete.")
+if __name__ == "__main__":
+    import cli
+    cli.run_script('collect', sys.modules[__name__])
@@ -0,0 +1,179 @@
+# fetcher.py
+# ../data_collection/fetcher.py
+# Rate-limited, retrying batch fetcher with bounded concurrency and throughput reporting
+
+import time
+import threading
+import concurrent.futures
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config
+from providers import PartialFetchError
+
+# Token bucket limiting how many provider requests start per second
+# Taking more tokens than the capacity waits for a full bucket and leaves it in debt, so the long-run rate holds
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function to block until `tokens` tokens are available (at most the capacity) and take them
+    def acquire(self, tokens=1):
+        needed = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Thread-safe counters describing a collection run
+class FetchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests = 0
+        self.retries = 0
+        self.tickers_fetched = 0
+        self.tickers_empty = 0
+        self.tickers_failed = 0
+        self.rows = 0
+        self.empty_windows = []
+
+    # Function to add to one or more counters atomically
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    # Function to remember a (ticker, start_date, end_date) window the provider answered cleanly without data
+    def add_empty(self, ticker, start_date, end_date):
+        with self.lock:
+            self.tickers_empty += 1
+            self.empty_windows.append((ticker, start_date, end_date))
+
+    # Function to return the counters and derived throughput as a dict
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        tickers = self.tickers_fetched + self.tickers_empty + self.tickers_failed
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': self.requests,
+            'retries': self.retries,
+            'tickers_fetched': self.tickers_fetched,
+            'tickers_empty': self.tickers_empty,
+            'tickers_failed': self.tickers_failed,
+            'rows': self.rows,
+            'tickers_per_second': round(tickers / elapsed, 2) if elapsed else 0.0,
+        }
+
+    # Function to print the throughput report
+    def report(self):
+        summary = self.summary()
+        print(f"Fetched {summary['tickers_fetched']} tickers ({summary['rows']} rows) in {summary['elapsed_seconds']}s: "
+              f"{summary['tickers_per_second']} tickers/s, {summary['requests']} requests, {summary['retries']} retries, "
+              f"{summary['tickers_empty']} without data, {summary['tickers_failed']} failed")
+
+# Function to fetch one batch with exponential backoff: a failed request retries its whole batch, a partial failure
+# (PartialFetchError) only the tickers that failed. Each attempt takes one token per HTTP request the provider makes.
+# Returns the frames received and the error of every ticker still failing after all retries
+def fetch_with_retries(provider, tickers, start_date, end_date, limiter, stats, max_retries, backoff_seconds):
+    results, pending = {}, list(tickers)
+    for attempt in range(max_retries + 1):
+        requests = len(pending) if provider.requests_per_ticker else 1
+        limiter.acquire(requests)
+        stats.add(requests=requests)
+        try:
+            results.update(provider.fetch(pending, start_date, end_date))
+            return results, {}
+        except PartialFetchError as e:
+            results.update(e.results)
+            errors = e.errors
+        except Exception as e:
+            errors = {ticker: str(e) for ticker in pending}
+        pending = [ticker for ticker in pending if ticker in errors]
+        if attempt == max_retries:
+            return results, errors
+        delay = backoff_seconds * 2 ** attempt
+        print(f"{len(pending)} of {len(tickers)} tickers failed ({errors[pending[0]]}); retrying in {delay:.1f}s")
+        stats.add(retries=1)
+        time.sleep(delay)
+
+# Function to split the planned windows into provider-sized batches
+def make_batches(windows, batch_size):
+    return [(start_date, end_date, tickers[i:i + batch_size])
+            for (start_date, end_date), tickers in windows.items()
+            for i in range(0, len(tickers), batch_size)]
+
+# Function to fetch every planned window and hand each ticker's frame to `save`
+# on_batch_done(tickers, failed) is called as each batch finishes, so callers can stream tickers downstream
+# With a recorder (instrumentation.RunRecorder) each ticker gets its share of its batch's fetch time and its errors
+# Returns the tickers that could not be fetched after all retries or saved, plus the run statistics, whose
+# empty_windows list the windows confirmed empty (not failed) for known-gap and empty-ticker bookkeeping
+def collect(windows, provider, save, max_workers=None, rate=None, burst=None, max_retries=None, backoff_seconds=None,
+            on_batch_done=None, recorder=None):
+    max_workers = max_workers or config.COLLECTION_MAX_WORKERS
+    limiter = TokenBucket(rate or config.COLLECTION_RATE_LIMIT, burst or config.COLLECTION_RATE_BURST)
+    max_retries = config.COLLECTION_MAX_RETRIES if max_retries is None else max_retries
+    backoff_seconds = config.COLLECTION_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+    stats = FetchStats()
+    failed_tickers = []
+
+    # Function to fetch and save one batch, returning the tickers whose fetch or save failed
+    def process_batch(start_date, end_date, tickers):
+        fetch_start = time.perf_counter()
+        results, errors = fetch_with_retries(provider, tickers, start_date, end_date, limiter, stats, max_retries,
+                                             backoff_seconds)
+        fetch_seconds = (time.perf_counter() - fetch_start) / len(tickers)
+        failures = []
+        for ticker in tickers:
+            data = results.get(ticker)
+            if recorder is not None:
+                recorder.add('fetch', fetch_seconds, ticker, 0 if data is None else len(data))
+            if ticker in errors:
+                print(f"Could not retrieve data for {ticker} ({start_date} to {end_date}): {errors[ticker]}")
+                stats.add(tickers_failed=1)
+                failures.append(ticker)
+                if recorder is not None:
+                    recorder.error(ticker, errors[ticker], 'fetch')
+                continue
+            if data is None or data.empty:
+                stats.add_empty(ticker, start_date, end_date)
+                continue
+            try:
+                save(data, ticker)
+                stats.add(tickers_fetched=1, rows=len(data))
+            except Exception as e:
+                print(f"Could not save data for {ticker}: {e}")
+                stats.add(tickers_failed=1)
+                failures.append(ticker)
+                if recorder is not None:
+                    recorder.error(ticker, e, 'save')
+        return failures
+
+    batches = make_batches(windows, provider.max_batch_size)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_batch, *batch): batch for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            start_date, end_date, tickers = futures[future]
+            try:
+                batch_failures = future.result()
+            except Exception as e:
+                print(f"Could not retrieve or save data for {len(tickers)} tickers ({start_date} to {end_date}): {e}")
+                stats.add(tickers_failed=len(tickers))
+                batch_failures = tickers
+                if recorder is not None:
+                    for ticker in tickers:
+                        recorder.error(ticker, e, 'fetch')
+            failed_tickers.extend(batch_failures)
+            if on_batch_done:
+                on_batch_done(tickers, batch_failures)
+    return failed_tickers, stats
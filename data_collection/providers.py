@@ -0,0 +1,161 @@
+# providers.py
+# ../data_collection/providers.py
+# Market data providers: per-symbol Yahoo Finance downloads and a deterministic offline fake
+
+import time
+import zlib
+import functools
+import threading
+from abc import ABC, abstractmethod
+import datetime
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Raised by fetch when some tickers of a batch failed (throttled, network errors) while the others were answered;
+# results holds the frames received and errors maps each failed ticker to its error, so only those are retried
+class PartialFetchError(Exception):
+    def __init__(self, results, errors):
+        super().__init__(f"{len(errors)} tickers failed: {'; '.join(sorted(set(errors.values())))[:200]}")
+        self.results = results
+        self.errors = errors
+
+# Base class for market data providers
+# fetch returns {ticker: frame} with a 'Date' DatetimeIndex and PRICE_COLUMNS; tickers omitted from the result were
+# answered without data. Tickers that could not be fetched are reported by raising (PartialFetchError when only some
+# of the batch failed), never by leaving them out. requests_per_ticker tells the rate limiter whether each ticker
+# costs one HTTP request (True) or the whole batch is a single request (False).
+class DataProvider(ABC):
+    name = 'base'
+    max_batch_size = 1
+    requests_per_ticker = False
+
+    @abstractmethod
+    def fetch(self, tickers, start_date, end_date):
+        raise NotImplementedError
+
+# Yahoo Finance provider. yf.download fetches its symbols one HTTP request at a time and swallows each symbol's
+# error (throttling included), logging it and leaving the symbol out of the frame, so a throttled symbol looked
+# like one without data. The same per-symbol requests are made here with Ticker.history(raise_errors=True):
+# "no price data" answers mean the symbol has no data for the window, every other error fails the symbol.
+class YahooProvider(DataProvider):
+    name = 'yahoo'
+    requests_per_ticker = True
+
+    def __init__(self, max_batch_size=None):
+        self.max_batch_size = max_batch_size or config.COLLECTION_BATCH_SIZE
+
+    def fetch(self, tickers, start_date, end_date):
+        import yfinance as yf
+        from yfinance.exceptions import YFPricesMissingError, YFTzMissingError
+        if start_date >= end_date:
+            raise ValueError(f"Start date {start_date} cannot be after end date {end_date}")
+        # Surface network errors instead of yfinance turning them into a missing timezone ("possibly delisted")
+        yf.config.debug.hide_exceptions = False
+        results, errors = {}, {}
+        for ticker in tickers:
+            try:
+                frame = yf.Ticker(ticker).history(start=start_date, end=end_date, interval="1d", auto_adjust=True,
+                                                  actions=False, raise_errors=True)
+            except (YFPricesMissingError, YFTzMissingError):
+                continue
+            except Exception as e:
+                errors[ticker] = f"{type(e).__name__}: {e}"
+                continue
+            frame = frame.reindex(columns=PRICE_COLUMNS).dropna(how='all')
+            if not frame.empty:
+                frame.index.name = 'Date'
+                results[ticker] = frame
+        if errors:
+            raise PartialFetchError(results, errors)
+        return results
+
+# Function to build the deterministic history of one fake ticker up to a fixed end date
+# Generated once per ticker so every request sees exactly the same prices and missing days
+@functools.lru_cache(maxsize=4096)
+def fake_history(ticker, missing_rate):
+    seed = zlib.crc32(ticker.encode())
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64(FakeProvider.base_date), np.datetime64(FakeProvider.history_end), dtype='datetime64[D]')
+    dates = days[np.is_busday(days)]
+    returns = rng.normal(0.0003, 0.015, len(dates))
+    close = (20 + seed % 200) * np.exp(np.cumsum(returns))
+    spread = np.abs(rng.normal(0, 0.01, len(dates)))
+    frame = pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, len(dates))),
+        'High': close * (1 + spread),
+        'Low': close * (1 - spread),
+        'Close': close,
+        'Volume': rng.integers(10_000, 5_000_000, len(dates)),
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+    return frame[rng.random(len(dates)) >= missing_rate]
+
+# Deterministic offline provider generating OHLCV random walks seeded by ticker
+# Prices for a given (ticker, date) never change between calls, so incremental runs stay consistent;
+# latency simulates request round trips and failure_rate makes a stable subset of batches fail transiently;
+# symbol_failure_rate throttles a stable subset of single symbols while the rest of their batch is answered (as
+# yfinance does per symbol), and the delisted tickers are answered without data
+class FakeProvider(DataProvider):
+    name = 'fake'
+    base_date = datetime.date(1990, 1, 1)
+    history_end = datetime.date(2040, 12, 31)
+
+    def __init__(self, max_batch_size=None, latency=0.0, failure_rate=0.0, failures_per_batch=1, missing_rate=0.02,
+                 symbol_failure_rate=0.0, delisted=()):
+        self.max_batch_size = max_batch_size or config.COLLECTION_BATCH_SIZE
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failures_per_batch = failures_per_batch
+        self.missing_rate = missing_rate
+        self.symbol_failure_rate = symbol_failure_rate
+        self.delisted = set(delisted)
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    # Function to count an attempt at a key and tell whether it fails (a stable share `rate` of keys fails its
+    # first failures_per_batch attempts)
+    def _fails(self, key, rate):
+        with self.lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            attempt = self.attempts[key]
+        return zlib.crc32(repr(key).encode()) % 1000 < rate * 1000 and attempt <= self.failures_per_batch
+
+    def fetch(self, tickers, start_date, end_date):
+        if start_date >= end_date:
+            raise ValueError(f"Start date {start_date} cannot be after end date {end_date}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        # Fail the first attempts of a deterministic subset of batches
+        if self._fails((tuple(tickers), start_date, end_date), self.failure_rate):
+            raise ConnectionError(f"Simulated throttling for batch of {len(tickers)} tickers")
+
+        results, errors = {}, {}
+        for ticker in tickers:
+            if self.symbol_failure_rate and self._fails((ticker, start_date, end_date), self.symbol_failure_rate):
+                errors[ticker] = "Simulated throttling of a single symbol"
+                continue
+            if ticker in self.delisted:
+                continue
+            frame = fake_history(ticker, self.missing_rate)
+            frame = frame[(frame.index >= pd.Timestamp(start_date)) & (frame.index < pd.Timestamp(end_date))].copy()
+            if not frame.empty:
+                frame.index = frame.index.tz_localize('America/New_York')
+                results[ticker] = frame
+        if errors:
+            raise PartialFetchError(results, errors)
+        return results
+
+# Function to create the configured (or named) provider
+def get_provider(name=None, **kwargs):
+    name = name or config.DATA_PROVIDER
+    if name == 'yahoo':
+        return YahooProvider(**kwargs)
+    if name == 'fake':
+        return FakeProvider(**kwargs)
+    raise ValueError(f"Unknown data provider: {name}")
@@ -2,51 +2,15 @@
 # ../data_collection/utils.py
 # Utility functions for data collection
 
-import requests
+import numpy as np
 import pandas as pd
 import os
 import datetime
-import yfinance as yf
-from sqlalchemy import Table, Column, Integer, Float, Date, MetaData
+import json
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import config
 
-# Function to retrieve S&P 500 tickers
-def get_sp500_tickers():
-    url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
-    response = requests.get(url)
-    df = pd.read_html(response.text)[0]
-    return df['Symbol'].tolist()
-
-# Function to retrieve Russell 3000 tickers
-def get_russell_3000_tickers():
-    russell_csv_path = config.RUSSELL_3000_CSV
-    if os.path.exists(russell_csv_path):
-        df = pd.read_csv(russell_csv_path)
-        return df['Company Ticker'].tolist()
-    else:
-        print("Russell 3000 tickers file not found.")
-        return []
-
-# Function to retrieve ETF tickers
-def get_ETFs_tickers():
-    ETFs_csv_path = config.ETFs_CSV
-    if os.path.exists(ETFs_csv_path):
-        df = pd.read_csv(ETFs_csv_path)
-        return df['Symbol'].tolist()
-    else:
-        print("ETFs tickers file not found.")
-        return []
-
-# Function to retrieve stock data for a given ticker
-def get_stock_data(ticker, start_date, end_date):
-    if start_date >= end_date:
-        raise ValueError(f"Start date {start_date} cannot be after end date {end_date}")
-    stock = yf.Ticker(ticker)
-    hist = stock.history(start=start_date, end=end_date, interval="1d", auto_adjust=True)
-    return hist[['Open', 'High', 'Low', 'Close', 'Volume']]
-
 # Function to read the last run date from a log file
 def read_last_run(log_file):
     if os.path.exists(log_file):
@@ -61,34 +25,99 @@ def log_last_run(log_file):
     with open(log_file, 'w') as f:
         f.write(f"Last run: {datetime.datetime.now()}\n")
 
-# Function to process ticker data in parallel
-def process_ticker_data_parallel(ticker, start_date, end_date, engine):
-    try:
-        print(f"Retrieving data for {ticker}")
-        data = get_stock_data(ticker, start_date, end_date)
-        if not data.empty:
-            save_to_db(data, ticker, engine)
-            print(f"Data for {ticker} saved successfully.")
-    except Exception as e:
-        print(f"Could not retrieve or save data for {ticker}: {e}")
-        return ticker
-    return None
-
-# Function to save stock data to the database
-def save_to_db(data, ticker, engine):
-    metadata = MetaData()
-    table = Table(
-        ticker, metadata,
-        Column('Date', Date, primary_key=True),
-        Column('Open', Float),
-        Column('High', Float),
-        Column('Low', Float),
-        Column('Close', Float),
-        Column('Volume', Integer),
-        extend_existing=True
-    )
-    metadata.create_all(engine)
-    
-    data.reset_index(inplace=True)
+# Function to read the gaps already fetched without returning data (market closures, pre-listing periods) as
+# {ticker: {(start, end): recorded_on}}; entries written before dates were recorded have recorded_on None (expired)
+def read_known_gaps(gaps_file):
+    if os.path.exists(gaps_file):
+        with open(gaps_file, 'r') as f:
+            return {ticker: {(window[0], window[1]): window[2] if len(window) > 2 else None for window in windows}
+                    for ticker, windows in json.load(f).items()}
+    return {}
+
+# Function to save the known empty gaps with the date each was recorded
+def write_known_gaps(gaps_file, known_gaps):
+    with open(gaps_file, 'w') as f:
+        json.dump({ticker: sorted([start, end, recorded_on] for (start, end), recorded_on in windows.items())
+                   for ticker, windows in known_gaps.items() if windows}, f, indent=1, sort_keys=True)
+
+# Function to read the tickers without any stored row that the provider answered without data, as {ticker: recorded_on}
+def read_empty_tickers(empty_file):
+    if os.path.exists(empty_file):
+        with open(empty_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+# Function to save the tickers answered without data
+def write_empty_tickers(empty_file, empty_tickers):
+    with open(empty_file, 'w') as f:
+        json.dump(empty_tickers, f, indent=1, sort_keys=True)
+
+# Function to tell whether an entry recorded on a date (YYYY-MM-DD, None when unknown) is younger than ttl_days
+def is_fresh(recorded_on, ttl_days):
+    return recorded_on is not None and datetime.date.today() - datetime.date.fromisoformat(recorded_on) < datetime.timedelta(days=ttl_days)
+
+# Function to record, with today's date, the interior gaps and the tickers without stored rows that the provider
+# answered cleanly without data (empty_windows from FetchStats; failed or throttled fetches are never in it).
+# Gaps since filled and tickers that now have rows are forgotten. Returns the updated (known_gaps, empty_tickers)
+def record_empty_fetches(store, empty_windows, known_gaps, empty_tickers):
+    today = str(datetime.date.today())
+    confirmed = {(ticker, str(start_date), str(end_date)) for ticker, start_date, end_date in empty_windows}
+    stored = set(store.tickers())
+
+    remaining_gaps = {}
+    for gap in store.gaps(config.MAX_GAP_DAYS).itertuples(index=False):
+        gap_window = (str(gap.gap_start.date()), str(gap.gap_end.date()))
+        if (gap.ticker, *gap_window) in confirmed:
+            remaining_gaps.setdefault(gap.ticker, {})[gap_window] = today
+        elif gap_window in known_gaps.get(gap.ticker, {}):
+            remaining_gaps.setdefault(gap.ticker, {})[gap_window] = known_gaps[gap.ticker][gap_window]
+
+    empty_tickers = {ticker: recorded_on for ticker, recorded_on in empty_tickers.items() if ticker not in stored}
+    for ticker, _, _ in confirmed:
+        if ticker not in stored:
+            empty_tickers[ticker] = today
+    return remaining_gaps, empty_tickers
+
+# Function to add a ticker to the group of a fetch window, skipping empty or inverted windows and windows without
+# business days (a ticker already stored up to end_date resumes at end_date + 1)
+def add_fetch_window(windows, ticker, start_date, end_date):
+    if start_date >= end_date or np.busday_count(start_date, end_date) <= 0:
+        return
+    windows.setdefault((start_date, end_date), []).append(ticker)
+
+# Function to plan the missing date windows of every ticker from what is already stored
+# New tickers get the full history, stored tickers resume the day after their own last date and
+# interior gaps longer than MAX_GAP_DAYS are refetched; tickers sharing a window are grouped together.
+# Known empty gaps younger than KNOWN_GAP_TTL_DAYS and tickers answered without any data in the last
+# EMPTY_TICKER_TTL_DAYS (delisted or bad symbols) are not requested again until their entry expires.
+def plan_fetch_windows(tickers, store, end_date, known_gaps=None, empty_tickers=None):
+    known_gaps = known_gaps or {}
+    empty_tickers = empty_tickers or {}
+    stats = store.stats().set_index('ticker')
+    windows = {}
+    for ticker in tickers:
+        if ticker in stats.index:
+            start_date = stats.at[ticker, 'last_date'].date() + datetime.timedelta(days=1)
+        elif is_fresh(empty_tickers.get(ticker), config.EMPTY_TICKER_TTL_DAYS):
+            continue
+        else:
+            start_date = config.START_DATE
+        add_fetch_window(windows, ticker, start_date, end_date)
+
+    requested = set(tickers)
+    for gap in store.gaps(config.MAX_GAP_DAYS).itertuples(index=False):
+        gap_window = (gap.gap_start.date(), gap.gap_end.date())
+        recorded_on = known_gaps.get(gap.ticker, {}).get((str(gap_window[0]), str(gap_window[1])))
+        if gap.ticker in requested and not is_fresh(recorded_on, config.KNOWN_GAP_TTL_DAYS):
+            add_fetch_window(windows, gap.ticker, *gap_window)
+    return windows
+
+# Function to convert downloaded stock data into the store's long format
+def prepare_for_db(data, ticker, store):
+    data = data.reset_index()
     data['Date'] = data['Date'].dt.date
-    data.to_sql(ticker, con=engine, if_exists='append', index=False)
+    return store.frame_for_ticker(ticker, data)
+
+# Function to save stock data to the price store
+def save_to_db(data, ticker, store):
+    store.write(prepare_for_db(data, ticker, store))
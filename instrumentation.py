@@ -0,0 +1,178 @@
+# instrumentation.py
+# ../instrumentation.py
+# Run instrumentation shared by every stage: per-ticker and per-phase timings, rows, memory high-water mark and
+# errors, saved as a JSON report and to SQLite, with an optional cProfile hook
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import create_engine
+import config
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Function to return the peak resident set size in MB of this process and of its finished child processes
+def peak_memory_mb():
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+# Per-task phase timings, kept in a worker process and returned with its result as a plain dict
+class TaskTimings:
+    def __init__(self):
+        self.timings = {}
+
+    # Function to add seconds and rows to a phase (ticker is accepted for the recorder interface and ignored)
+    def add(self, phase, seconds, ticker=None, rows=0):
+        seconds_total, rows_total = self.timings.get(phase, (0.0, 0))
+        self.timings[phase] = (seconds_total + seconds, rows_total + rows)
+
+    # Function to return the timings as {phase: {'seconds', 'rows'}}, optionally divided between n tickers
+    def as_dict(self, share=1):
+        return {phase: {'seconds': seconds / share, 'rows': rows // share} for phase, (seconds, rows) in self.timings.items()}
+
+# Function to time a block as one phase on a recorder (RunRecorder, TaskTimings or None)
+# Yields a dict whose 'rows' entry the block may set to the rows it processed
+@contextlib.contextmanager
+def phase(recorder, name, ticker=None):
+    timing = {'rows': 0}
+    start_time = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        if recorder is not None:
+            recorder.add(name, time.perf_counter() - start_time, ticker, timing['rows'])
+
+# Thread-safe recorder of one stage run; worker processes send their TaskTimings back with their results
+class RunRecorder:
+    def __init__(self, stage, run_id=None):
+        self.stage = stage
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d%H%M%S')
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = []
+
+    # Function to add seconds and rows to a phase of a ticker (None for work not tied to one ticker)
+    def add(self, phase, seconds, ticker=None, rows=0):
+        with self.lock:
+            calls, seconds_total, rows_total = self.timings.get((ticker, phase), (0, 0.0, 0))
+            self.timings[(ticker, phase)] = (calls + 1, seconds_total + seconds, rows_total + rows)
+
+    # Function to merge the timings a worker returned for one ticker
+    def add_timings(self, ticker, timings):
+        for phase_name, timing in (timings or {}).items():
+            self.add(phase_name, timing['seconds'], ticker, timing['rows'])
+
+    # Function to record a failed ticker
+    def error(self, ticker, message, phase_name=None):
+        with self.lock:
+            self.errors.append({'ticker': ticker, 'phase': phase_name, 'error': str(message)})
+
+    # Function to return the per-ticker, per-phase timings as a DataFrame
+    def timings_frame(self):
+        with self.lock:
+            rows = [(self.run_id, self.stage, ticker, phase_name, calls, seconds, rows)
+                    for (ticker, phase_name), (calls, seconds, rows) in self.timings.items()]
+        return pd.DataFrame(rows, columns=['run_id', 'stage', 'ticker', 'phase', 'calls', 'seconds', 'rows'])
+
+    # Function to summarize the run: wall time, memory, per-phase totals and the slowest tickers
+    def summary(self):
+        timings = self.timings_frame()
+        phases = timings.groupby('phase')[['calls', 'seconds', 'rows']].sum()
+        per_ticker = timings.dropna(subset=['ticker']).groupby('ticker')['seconds'].sum().astype(float)
+        peak_mb, peak_children_mb = peak_memory_mb()
+        return {
+            'run_id': self.run_id,
+            'stage': self.stage,
+            'started_at': self.started_at,
+            'wall_seconds': round(time.perf_counter() - self.start_time, 3),
+            'peak_rss_mb': peak_mb,
+            'peak_children_rss_mb': peak_children_mb,
+            'tickers': int(per_ticker.size),
+            'rows': int(timings['rows'].sum()),
+            'errors': len(self.errors),
+            'phases': {name: {'calls': int(row['calls']), 'seconds': round(float(row['seconds']), 3), 'rows': int(row['rows'])}
+                       for name, row in phases.sort_values('seconds', ascending=False).iterrows()},
+            'slowest_tickers': [(ticker, round(float(seconds), 3)) for ticker, seconds in
+                                per_ticker.nlargest(config.RUN_REPORT_TOP_TICKERS).items()],
+            'error_details': list(self.errors),
+        }
+
+    # Function to print the run report
+    def report(self, summary=None):
+        summary = summary or self.summary()
+        memory = f", peak memory {summary['peak_rss_mb']} MB" if summary['peak_rss_mb'] is not None else ""
+        if summary['peak_children_rss_mb']:
+            memory += f" ({summary['peak_children_rss_mb']} MB in workers)"
+        print(f"{self.stage} run {self.run_id}: {summary['wall_seconds']}s wall, {summary['tickers']} tickers, "
+              f"{summary['rows']} rows, {summary['errors']} errors{memory}")
+        for name, phase_summary in summary['phases'].items():
+            print(f"  {name:<10} {phase_summary['seconds']:>10.2f}s  {phase_summary['calls']:>7} calls  {phase_summary['rows']:>10} rows")
+        if summary['slowest_tickers']:
+            print(f"  slowest: {', '.join(f'{ticker} ({seconds}s)' for ticker, seconds in summary['slowest_tickers'])}")
+
+    # Function to save the report as JSON and append it to the run report tables
+    def save(self, summary=None):
+        summary = summary or self.summary()
+        os.makedirs(config.RUN_REPORT_DIRECTORY, exist_ok=True)
+        path = os.path.join(config.RUN_REPORT_DIRECTORY, f"{self.stage}_{self.run_id}.json")
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=1, default=str)
+
+        engine = create_engine(f'sqlite:///{config.RUN_REPORT_DATABASE_PATH}')
+        run_row = {key: summary[key] for key in ['run_id', 'stage', 'started_at', 'wall_seconds', 'peak_rss_mb',
+                                                 'peak_children_rss_mb', 'tickers', 'rows', 'errors']}
+        pd.DataFrame([run_row]).to_sql('run_reports', con=engine, if_exists='append', index=False)
+        self.timings_frame().to_sql('run_phase_timings', con=engine, if_exists='append', index=False)
+        if self.errors:
+            pd.DataFrame(self.errors).assign(run_id=self.run_id, stage=self.stage).to_sql(
+                'run_errors', con=engine, if_exists='append', index=False)
+        engine.dispose()
+        return path
+
+    # Function to end the run: print the report and save it
+    def finish(self):
+        summary = self.summary()
+        self.report(summary)
+        try:
+            path = self.save(summary)
+            print(f"Run report saved to {path}")
+        except Exception as e:
+            print(f"Could not save the run report: {e}")
+        return summary
+
+# Function to profile a block with cProfile when enabled (or config.PROFILE_RUNS), saving a .prof file for
+# snakeviz/pstats and printing the top functions. cProfile only sees the calling thread; worker threads and
+# processes are best sampled from outside with `py-spy record --subprocesses --pid <pid>`, which needs no hook
+@contextlib.contextmanager
+def profiled(stage, enabled=None):
+    enabled = config.PROFILE_RUNS if enabled is None else enabled
+    if not enabled:
+        yield
+        return
+    os.makedirs(config.PROFILE_DIRECTORY, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIRECTORY, f"{stage}_{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+    print(f"Profiling {stage} (pid {os.getpid()}) to {path}")
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(path).sort_stats('cumulative').print_stats(15)
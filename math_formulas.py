@@ -1,24 +1,121 @@
 # math_formulas.py
 # ../math_formulas.py
 # Definitions of financial and time formulas
+# The panel functions take aligned 2-D arrays (tickers x dates) where NaN marks a missing value, and return one
+# value per ticker (NaN when a ticker has too few valid points)
 
 import numpy as np
-from sklearn.metrics import mean_absolute_error, mean_squared_error
+
+TRADING_DAYS = 252
 
 # Function to calculate Mean Absolute Error (MAE)
 def calculate_mae(actual, predicted):
-    return mean_absolute_error(actual, predicted)
+    return float(mean_absolute_errors(np.asarray(actual, dtype=float)[None], np.asarray(predicted, dtype=float)[None])[0])
 
 # Function to calculate Mean Squared Error (MSE)
 def calculate_mse(actual, predicted):
-    return mean_squared_error(actual, predicted)
+    return float(mean_squared_errors(np.asarray(actual, dtype=float)[None], np.asarray(predicted, dtype=float)[None])[0])
 
 # Function to calculate Root Mean Squared Error (RMSE)
 def calculate_rmse(actual, predicted):
-    return np.sqrt(mean_squared_error(actual, predicted))
+    return np.sqrt(calculate_mse(actual, predicted))
 
 # Function to calculate Sharpe Ratio
 def calculate_sharpe_ratio(returns, risk_free_rate_annual, risk_free_rate_daily):
     expected_return = returns.mean() * 252  # Annualize the mean return
     expected_volatility = returns.std() * np.sqrt(252)  # Annualize the volatility
     return (expected_return - risk_free_rate_annual) / expected_volatility  # Calculate Sharpe Ratio
+
+# Function to stack 1-D series of different lengths into a NaN-padded panel, aligned on their last value
+def pad_panel(series, length=None):
+    length = length or max((len(values) for values in series), default=0)
+    panel = np.full((len(series), length), np.nan)
+    for row, values in enumerate(series):
+        values = np.asarray(values, dtype=float)[-length:]
+        if len(values):
+            panel[row, length - len(values):] = values
+    return panel
+
+# Function to count the valid points per ticker, and the mask of positions where all the given panels are valid
+def valid_mask(*panels):
+    mask = np.ones(panels[0].shape, dtype=bool)
+    for panel in panels:
+        mask &= ~np.isnan(panel)
+    return mask, mask.sum(axis=1)
+
+# Function to divide, returning NaN where the denominator is zero or missing
+def _safe_divide(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator / denominator
+    return np.where(np.isfinite(result), result, np.nan)
+
+# Function to calculate the MAE of every ticker
+def mean_absolute_errors(actual, predicted):
+    mask, counts = valid_mask(actual, predicted)
+    errors = np.where(mask, np.abs(actual - predicted), 0.0)
+    return _safe_divide(errors.sum(axis=1), counts)
+
+# Function to calculate the MSE of every ticker
+def mean_squared_errors(actual, predicted):
+    mask, counts = valid_mask(actual, predicted)
+    errors = np.where(mask, (actual - predicted) ** 2, 0.0)
+    return _safe_divide(errors.sum(axis=1), counts)
+
+# Function to calculate the mean absolute percentage error of every ticker (as a fraction of the actual value)
+def mean_absolute_percentage_errors(actual, predicted):
+    mask, counts = valid_mask(actual, predicted)
+    errors = np.where(mask & (actual != 0), np.abs(_safe_divide(actual - predicted, actual)), 0.0)
+    return _safe_divide(errors.sum(axis=1), counts)
+
+# Function to calculate day-over-day simple returns along the date axis (NaN where either price is missing)
+def simple_returns(prices):
+    return _safe_divide(prices[:, 1:], prices[:, :-1]) - 1.0
+
+# Function to calculate the annualized Sharpe ratio of every ticker from daily returns
+# Same definition as calculate_sharpe_ratio: sample standard deviation over the valid returns
+def sharpe_ratios(returns, risk_free_rate_annual):
+    mask, counts = valid_mask(returns)
+    values = np.where(mask, returns, 0.0)
+    mean = _safe_divide(values.sum(axis=1), counts)
+    deviations = np.where(mask, returns - mean[:, None], 0.0)
+    std = np.sqrt(_safe_divide((deviations ** 2).sum(axis=1), counts - 1))
+    return _safe_divide(mean * TRADING_DAYS - risk_free_rate_annual, std * np.sqrt(TRADING_DAYS))
+
+# Function to calculate the annualized Sortino ratio of every ticker: excess return over the downside deviation
+# below the daily risk-free rate
+def sortino_ratios(returns, risk_free_rate_annual, risk_free_rate_daily):
+    mask, counts = valid_mask(returns)
+    mean = _safe_divide(np.where(mask, returns, 0.0).sum(axis=1), counts)
+    downside = np.where(mask, np.minimum(returns - risk_free_rate_daily, 0.0), 0.0)
+    downside_deviation = np.sqrt(_safe_divide((downside ** 2).sum(axis=1), counts))
+    return _safe_divide(mean * TRADING_DAYS - risk_free_rate_annual, downside_deviation * np.sqrt(TRADING_DAYS))
+
+# Function to calculate the maximum drawdown of every ticker's price path, as a negative fraction of the running peak
+def max_drawdowns(prices):
+    mask, counts = valid_mask(prices)
+    running_peak = np.fmax.accumulate(np.where(mask, prices, -np.inf), axis=1)
+    drawdowns = np.where(mask, _safe_divide(prices, running_peak) - 1.0, np.inf)
+    return np.where(counts > 0, drawdowns.min(axis=1, initial=0.0), np.nan)
+
+# Function to calculate the share of days on which the predicted day-over-day move has the sign of the actual move
+def hit_rates(actual, predicted):
+    actual_moves = np.sign(np.diff(actual, axis=1))
+    predicted_moves = np.sign(np.diff(predicted, axis=1))
+    mask, counts = valid_mask(actual_moves, predicted_moves)
+    hits = np.where(mask, actual_moves == predicted_moves, False)
+    return _safe_divide(hits.sum(axis=1), counts)
+
+# Function to evaluate a whole universe in one pass
+# actual/predicted are the evaluation windows, path is each ticker's forecast price path used for the return metrics
+def evaluate_panel(actual, predicted, path, risk_free_rate_annual, risk_free_rate_daily):
+    mse = mean_squared_errors(actual, predicted)
+    returns = simple_returns(path)
+    return {
+        'MAE': mean_absolute_errors(actual, predicted),
+        'MSE': mse,
+        'RMSE': np.sqrt(mse),
+        'Sharpe Ratio': sharpe_ratios(returns, risk_free_rate_annual),
+        'Sortino Ratio': sortino_ratios(returns, risk_free_rate_annual, risk_free_rate_daily),
+        'Max Drawdown': max_drawdowns(path),
+        'Hit Rate': hit_rates(actual, predicted),
+    }
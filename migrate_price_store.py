@@ -0,0 +1,39 @@
+# migrate_price_store.py
+# ../migrate_price_store.py
+# Script to migrate per-ticker SQLite tables into the configured long-format price store
+
+import os
+import argparse
+import config
+from price_store import TablePerTickerStore, open_raw_store, open_cleaned_store, chunked
+
+# Function to copy every per-ticker table of a legacy database into the target store
+def migrate(database_path, target_store, columns, batch_size=50, drop_old=False):
+    legacy_store = TablePerTickerStore(database_path, columns, exclude=(config.PRICE_TABLE,))
+    tickers = legacy_store.tickers()
+    migrated_rows = 0
+    for batch_number, batch in enumerate(chunked(tickers, batch_size), start=1):
+        data = legacy_store.load(batch)
+        migrated_rows += target_store.write(data)
+        if drop_old:
+            legacy_store.delete(batch)
+        print(f"Migrated batch {batch_number}: {len(batch)} tickers, {migrated_rows} rows so far")
+    print(f"Migrated {len(tickers)} tickers ({migrated_rows} rows) from {database_path}")
+    return migrated_rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-ticker tables into the long-format price store")
+    parser.add_argument('--stage', choices=['raw', 'cleaned', 'all'], default='all')
+    parser.add_argument('--backend', choices=['sqlite', 'parquet'], default=None,
+                        help="Target backend (defaults to config.STORAGE_BACKEND)")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--drop-old', action='store_true', help="Drop each legacy table once it has been copied")
+    args = parser.parse_args()
+
+    if args.stage in ('raw', 'all') and os.path.exists(config.RAW_DATABASE_PATH):
+        migrate(config.RAW_DATABASE_PATH, open_raw_store(args.backend), config.RAW_COLUMNS, args.batch_size, args.drop_old)
+    if args.stage in ('cleaned', 'all') and os.path.exists(config.CLEANED_DATABASE_PATH):
+        migrate(config.CLEANED_DATABASE_PATH, open_cleaned_store(args.backend), config.CLEANED_COLUMNS, args.batch_size, args.drop_old)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# backtest.py
+# ../prediction/backtest.py
+# Walk-forward backtest: out-of-sample forecast errors and a simulated long/short strategy over many cutoffs
+
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from price_store import open_cleaned_store
+from scheduler import order_by_cost, run_pool, print_report
+from features import DesignMatrix, expanding_ridge
+from feature_cache import cached_calendar, prepare_calendar
+from models import ProphetModel
+import universe
+from math_formulas import (mean_absolute_errors, mean_squared_errors, mean_absolute_percentage_errors, hit_rates,
+                           sharpe_ratios, max_drawdowns, pad_panel)
+
+logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+# Setup and Configuration
+data_store = open_cleaned_store()
+forecast_engine = create_engine(f'sqlite:///{prophet_config.FORECAST_DATABASE_PATH}')
+
+# Function to pick the walk-forward cutoff dates of a history (the last training day of each window): every step_days
+# going back `years` from the last date with a full horizon after it, keeping at least initial_days of training
+def make_cutoffs(first_date, last_date, initial_days, step_days, horizon, years):
+    first_date, last_date = pd.Timestamp(first_date), pd.Timestamp(last_date)
+    earliest = max(first_date + pd.Timedelta(days=initial_days), last_date - pd.Timedelta(days=int(years * 365.25)))
+    cutoffs = []
+    cutoff = last_date - pd.Timedelta(days=horizon)
+    while cutoff >= earliest:
+        cutoffs.append(cutoff)
+        cutoff -= pd.Timedelta(days=step_days)
+    return sorted(cutoffs)
+
+# Function to forecast the horizon after each cutoff with ridge fits on the ticker's reused design matrix
+def ridge_forecasts(stock_data, train_ends, horizon):
+    design = DesignMatrix(stock_data['ds'], calendar=cached_calendar(stock_data['ds']))
+    y = stock_data['y'].to_numpy(dtype=float)
+    weights = expanding_ridge(design, y, train_ends)
+    return [design.X[end:end + horizon] @ w for end, w in zip(train_ends, weights)]
+
+# Function to forecast the horizon after each cutoff with a full Prophet fit per cutoff
+# (the configured parameters, or the given ones as returned by model_store.tuned_config)
+def prophet_forecasts(stock_data, train_ends, horizon, prophet_params=None, seasonality_params=None):
+    forecasts = []
+    for end in train_ends:
+        model = ProphetModel().build(stock_data['ds'].iloc[0], stock_data['ds'].iloc[-1], prophet_params, seasonality_params)
+        model.uncertainty_samples = 0
+        model.fit(stock_data.iloc[:end][['ds', 'y']])
+        forecasts.append(model.predict(stock_data.iloc[end:end + horizon][['ds']])['yhat'].to_numpy())
+    return forecasts
+
+BACKTEST_ENGINES = {'ridge': ridge_forecasts, 'prophet': prophet_forecasts}
+
+# Function to backtest one task: a ticker with the cutoff dates to evaluate
+# Ridge handles all of a ticker's cutoffs in one task (the fits share one pass over the rows);
+# Prophet fits are independent, so its tasks are single (ticker, cutoff) pairs
+def backtest_task(task):
+    ticker, engine, cutoffs = task
+    start_time = time.time()
+    try:
+        stock_data = data_store.load([ticker], columns=['Close']).rename(columns={'Date': 'ds', 'Close': 'y'})
+        stock_data = stock_data.dropna(subset=['y']).reset_index(drop=True)
+        horizon = prophet_config.BACKTEST_HORIZON
+        y = stock_data['y'].to_numpy(dtype=float)
+        train_ends = [int(end) for end in stock_data['ds'].searchsorted(pd.DatetimeIndex(cutoffs), side='right')
+                      if 0 < end < len(stock_data)]
+        forecasts = BACKTEST_ENGINES[engine](stock_data, train_ends, horizon)
+        windows = [{'cutoff': str(stock_data['ds'].iloc[end - 1].date()), 'last_close': y[end - 1],
+                    'actual': y[end:end + horizon], 'predicted': np.asarray(forecast, dtype=float)}
+                   for end, forecast in zip(train_ends, forecasts)]
+        return {'ticker': ticker, 'success': True, 'windows': windows, 'seconds': time.time() - start_time}
+    except Exception as e:
+        return {'ticker': ticker, 'success': False, 'error': str(e), 'seconds': time.time() - start_time}
+
+# Function to build the tasks of a run
+def make_tasks(tickers, engine):
+    stats = data_store.stats().set_index('ticker')
+    tasks = []
+    for ticker in tickers:
+        cutoffs = make_cutoffs(stats.at[ticker, 'first_date'], stats.at[ticker, 'last_date'],
+                               prophet_config.BACKTEST_INITIAL_DAYS, prophet_config.BACKTEST_STEP_DAYS,
+                               prophet_config.BACKTEST_HORIZON, prophet_config.BACKTEST_YEARS)
+        if engine == 'prophet':
+            tasks.extend((ticker, engine, [cutoff]) for cutoff in cutoffs)
+        elif cutoffs:
+            tasks.append((ticker, engine, cutoffs))
+    return tasks
+
+# Function to score every window of the run in one pass and summarize them per ticker
+# The strategy goes long (short) at each cutoff when the forecast at the next cutoff is above (below) the last close,
+# holding the position for step_days, so consecutive windows form one daily return series per ticker
+def summarize(windows_by_ticker, step_days):
+    rows = [(ticker, window) for ticker, windows in windows_by_ticker.items() for window in windows]
+    actual = pad_panel([window['actual'] for _, window in rows])
+    predicted = pad_panel([window['predicted'] for _, window in rows])
+    errors = pd.DataFrame({
+        'ticker': [ticker for ticker, _ in rows],
+        'mae': mean_absolute_errors(actual, predicted),
+        'rmse': np.sqrt(mean_squared_errors(actual, predicted)),
+        'mape': mean_absolute_percentage_errors(actual, predicted),
+        'hit_rate': hit_rates(actual, predicted),
+    })
+
+    strategy_returns, hold_returns = [], []
+    tickers = list(windows_by_ticker)
+    for ticker in tickers:
+        ticker_strategy, ticker_hold = [], []
+        for window in sorted(windows_by_ticker[ticker], key=lambda window: window['cutoff']):
+            hold = min(step_days, len(window['actual']))
+            prices = np.concatenate([[window['last_close']], window['actual'][:hold]])
+            daily = prices[1:] / prices[:-1] - 1.0
+            position = np.sign(window['predicted'][hold - 1] - window['last_close'])
+            ticker_strategy.append(position * daily)
+            ticker_hold.append(daily)
+        strategy_returns.append(np.concatenate(ticker_strategy))
+        hold_returns.append(np.concatenate(ticker_hold))
+
+    strategy = pad_panel(strategy_returns)
+    hold = pad_panel(hold_returns)
+    strategy_equity = np.cumprod(np.where(np.isnan(strategy), 0.0, strategy) + 1.0, axis=1)
+    hold_equity = np.cumprod(np.where(np.isnan(hold), 0.0, hold) + 1.0, axis=1)
+    summary = errors.groupby('ticker', sort=False).mean()
+    summary['cutoffs'] = errors.groupby('ticker', sort=False).size()
+    summary = summary.reindex(tickers)
+    summary['strategy_return'] = strategy_equity[:, -1] - 1.0
+    summary['strategy_sharpe'] = sharpe_ratios(strategy, prophet_config.RISK_FREE_RATE_ANNUAL)
+    summary['strategy_max_drawdown'] = max_drawdowns(np.where(np.isnan(strategy), np.nan, strategy_equity))
+    summary['buy_hold_return'] = hold_equity[:, -1] - 1.0
+    summary['buy_hold_sharpe'] = sharpe_ratios(hold, prophet_config.RISK_FREE_RATE_ANNUAL)
+    return summary.rename_axis('ticker').reset_index()
+
+# Main function to backtest the tickers (all cleaned tickers by default) with the chosen engine
+# With as_of, only the tickers that were in the universe on that date are kept (from the stored universe snapshots)
+def main(tickers=None, engine=None, max_workers=None, as_of=None):
+    start_time = time.time()
+    engine = engine or prophet_config.BACKTEST_ENGINE
+    stats = data_store.stats()
+    history_rows = dict(zip(stats['ticker'], stats['rows']))
+    tickers = tickers or list(history_rows)
+    if as_of:
+        members = set(universe.members_as_of(as_of))
+        tickers = [ticker for ticker in tickers if ticker in members]
+        print(f"{len(tickers)} tickers were in the universe on {as_of} ({len(members)} members)")
+    tasks = make_tasks(order_by_cost(tickers, history_rows), engine)
+    run_stats = stats[stats['ticker'].isin(tickers)]
+    prepare_calendar(run_stats['first_date'].tolist(), run_stats['last_date'].tolist())
+    print(f"Backtesting {len(tickers)} tickers with the {engine} engine: {len(tasks)} tasks")
+
+    windows_by_ticker, error_stocks = {}, []
+    task_results, report = run_pool(tasks, backtest_task, max_workers or prophet_config.BACKTEST_MAX_WORKERS)
+    for result in task_results:
+        if result['success']:
+            windows_by_ticker.setdefault(result['ticker'], []).extend(result['windows'])
+        else:
+            print(f"Error backtesting {result['ticker']}: {result['error']}")
+            error_stocks.append(result['ticker'])
+    print_report(report)
+    if not windows_by_ticker:
+        print("No backtest windows to evaluate")
+        return None
+
+    summary = summarize(windows_by_ticker, prophet_config.BACKTEST_STEP_DAYS)
+    summary.insert(1, 'engine', engine)
+    summary.insert(2, 'run_at', datetime.now().isoformat(timespec='seconds'))
+    summary.to_sql(prophet_config.BACKTEST_TABLE, con=forecast_engine, if_exists='append', index=False)
+
+    print("Backtest summary (mean over tickers):")
+    print(summary.drop(columns=['ticker', 'engine', 'run_at']).mean().to_string())
+    print(f"Backtest results saved to {prophet_config.BACKTEST_TABLE} in {time.time() - start_time:.1f}s")
+    return summary
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('backtest', sys.modules[__name__])
@@ -0,0 +1,128 @@
+# feature_cache.py
+# ../prediction/feature_cache.py
+# Content-addressed cache of calendar features (seasonalities and holidays) shared by every ticker as memory-mapped arrays
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from features import epoch_days, calendar_features
+
+# Function to fingerprint the calendar configuration (seasonalities and the holiday definitions)
+def calendar_fingerprint(seasonality_params=None, prophet_params=None):
+    seasonality_params = prophet_config.SEASONALITY_PARAMS if seasonality_params is None else seasonality_params
+    prophet_params = prophet_config.PROPHET_PARAMS if prophet_params is None else prophet_params
+    payload = {
+        'seasonality_params': seasonality_params,
+        'seasonality_prior_scale': prophet_params['seasonality_prior_scale'],
+        'holidays_prior_scale': prophet_params['holidays_prior_scale'],
+        'holidays': [prophet_config.HOLIDAY_WINDOWS, prophet_config.FIXED_HOLIDAYS],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# Calendar features depend only on the date, so one matrix over a daily date range serves every ticker whose
+# dates fall inside it: a ticker's rows are a zero-copy slice. Files are named by configuration fingerprint and
+# range, written once (atomically) and opened read-only with mmap by every worker process.
+class CalendarCache:
+    def __init__(self, directory=None):
+        self.directory = directory or prophet_config.FEATURE_CACHE_DIR
+        self.fingerprint = calendar_fingerprint()
+        self.calendars = {}
+
+    # Function to return the file path of the calendar starting at first_day (epoch days) covering n_days
+    def path(self, first_day, n_days, kind='features'):
+        return os.path.join(self.directory, f"calendar_{self.fingerprint}_{int(first_day)}_{int(n_days)}_{kind}.npy")
+
+    # Function to build and store the calendar covering [first_date, last_date] unless it already exists
+    # The range is widened to whole calendar years, so the daily runs of a year share one file; a new file
+    # replaces the stored calendars of the same configuration that it covers
+    def prepare(self, first_date, last_date):
+        first_date = pd.Timestamp(first_date).normalize().replace(month=1, day=1)
+        last_date = pd.Timestamp(last_date).normalize().replace(month=12, day=31)
+        first_day = int(epoch_days([first_date])[0])
+        n_days = (last_date - first_date).days + 1
+        if not self._covering(first_day, n_days):
+            features_path = self.path(first_day, n_days)
+            if not os.path.exists(features_path):
+                os.makedirs(self.directory, exist_ok=True)
+                features, penalty = calendar_features(first_day + np.arange(n_days, dtype=float))
+                self._save(self.path(first_day, n_days, 'penalty'), penalty)
+                self._save(features_path, features)
+            self._open(first_day, n_days)
+            self._prune(first_day, n_days)
+
+    # Function to return (features, penalty) for contiguous daily dates, or None when no cached calendar covers them
+    def get(self, dates):
+        days = epoch_days(dates)
+        if len(days) == 0 or np.any(np.diff(days) != 1.0) or days[0] != np.floor(days[0]):
+            return None
+        covering = self._covering(days[0], len(days))
+        if covering is None:
+            return None
+        first_day, features, penalty = covering
+        offset = int(days[0] - first_day)
+        return features[offset:offset + len(days)], penalty
+
+    # Function to list the (first_day, n_days) ranges stored for this configuration
+    def _stored(self):
+        pattern = re.compile(rf"calendar_{self.fingerprint}_(-?\d+)_(\d+)_features\.npy$")
+        if not os.path.isdir(self.directory):
+            return []
+        matches = [pattern.match(name) for name in os.listdir(self.directory)]
+        return [(int(match.group(1)), int(match.group(2))) for match in matches if match]
+
+    # Function to find a loaded or stored calendar covering n_days from first_day
+    def _covering(self, first_day, n_days):
+        for start, (features, penalty) in self.calendars.items():
+            if start <= first_day and first_day + n_days <= start + len(features):
+                return start, features, penalty
+        for start, length in self._stored():
+            if start <= first_day and first_day + n_days <= start + length:
+                try:
+                    self._open(start, length)
+                except FileNotFoundError:
+                    # Pruned by another process since the listing
+                    continue
+                features, penalty = self.calendars[start]
+                return start, features, penalty
+        return None
+
+    # Function to delete the stored calendars of this configuration covered by the one at first_day
+    def _prune(self, first_day, n_days):
+        for start, length in self._stored():
+            if (start, length) != (first_day, n_days) and first_day <= start and start + length <= first_day + n_days:
+                for kind in ['features', 'penalty']:
+                    if os.path.exists(self.path(start, length, kind)):
+                        os.remove(self.path(start, length, kind))
+                if start in self.calendars and len(self.calendars[start][0]) == length:
+                    del self.calendars[start]
+
+    # Function to open a stored calendar read-only with mmap
+    def _open(self, first_day, n_days):
+        features = np.load(self.path(first_day, n_days), mmap_mode='r')
+        penalty = np.load(self.path(first_day, n_days, 'penalty'))
+        self.calendars[first_day] = (features, penalty)
+
+    # Function to write an array atomically, so concurrent readers never see a partial file
+    def _save(self, path, array):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(temporary_path, path)
+
+# Shared per-process cache used by the models and the backtest
+calendar_cache = CalendarCache()
+
+# Function to return cached calendar features for the dates, or None when caching is off or no calendar covers them
+def cached_calendar(dates):
+    return calendar_cache.get(dates) if prophet_config.FEATURE_CACHE else None
+
+# Function to build the calendar covering a run's tickers (their date ranges plus the forecast horizon)
+def prepare_calendar(first_dates, last_dates, horizon=0):
+    if prophet_config.FEATURE_CACHE and len(first_dates):
+        calendar_cache.prepare(min(first_dates), pd.Timestamp(max(last_dates)) + pd.Timedelta(days=horizon))
@@ -0,0 +1,107 @@
+# features.py
+# ../prediction/features.py
+# Design matrices mirroring the Prophet model (piecewise linear trend, Fourier seasonalities, holidays)
+# and closed-form ridge fits over them, reused across walk-forward cutoffs
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+
+# Function to convert dates to float days since the epoch (the time base Prophet uses for seasonalities)
+def epoch_days(dates):
+    return pd.DatetimeIndex(dates).tz_localize(None).to_numpy(dtype='datetime64[s]').astype(np.int64) / 86400.0
+
+# Function to build the sine/cosine terms of one seasonality
+def fourier_features(days, period, fourier_order):
+    angles = 2.0 * np.pi * np.outer(days, np.arange(1, fourier_order + 1)) / period
+    return np.hstack([np.sin(angles), np.cos(angles)])
+
+# Function to build one indicator column per holiday and day offset within its window, like Prophet
+def holiday_features(days, holidays):
+    columns, names = [], []
+    day_index = np.floor(days).astype(np.int64)
+    holiday_days = np.floor(epoch_days(holidays['ds'])).astype(np.int64)
+    for name in holidays['holiday'].unique():
+        rows = holidays['holiday'].to_numpy() == name
+        lower = int(holidays.loc[rows, 'lower_window'].min())
+        upper = int(holidays.loc[rows, 'upper_window'].max())
+        for offset in range(lower, upper + 1):
+            columns.append(np.isin(day_index, holiday_days[rows] + offset).astype(float))
+            names.append(name)
+    return (np.column_stack(columns) if columns else np.empty((len(days), 0))), names
+
+# Function to build the calendar part of the design (seasonalities and holidays) with each column's ridge penalty
+# Depends only on the dates, so it can be shared by every ticker and cutoff over the same calendar
+def calendar_features(days, seasonality_params=None, prophet_params=None):
+    seasonality_params = prophet_config.SEASONALITY_PARAMS if seasonality_params is None else seasonality_params
+    prophet_params = prophet_config.PROPHET_PARAMS if prophet_params is None else prophet_params
+    blocks, penalties = [], []
+    for seasonality in seasonality_params:
+        block = fourier_features(days, seasonality['period'], seasonality['fourier_order'])
+        prior_scale = seasonality.get('prior_scale', prophet_params['seasonality_prior_scale'])
+        blocks.append(block)
+        penalties.append(np.full(block.shape[1], 1.0 / prior_scale ** 2))
+    holidays = prophet_params.get('holidays')
+    if holidays is None and len(days):
+        holidays = prophet_config.holidays(pd.to_datetime(np.min(days), unit='D'), pd.to_datetime(np.max(days), unit='D'))
+    if holidays is not None and len(holidays):
+        block, _ = holiday_features(days, holidays)
+        blocks.append(block)
+        penalties.append(np.full(block.shape[1], 1.0 / prophet_params['holidays_prior_scale'] ** 2))
+    features = np.hstack(blocks) if blocks else np.empty((len(days), 0))
+    return features, (np.concatenate(penalties) if penalties else np.empty(0))
+
+# Full design of one ticker's history: [intercept, slope, changepoint hinges, calendar terms]
+# Changepoints sit on a fixed grid over the history; a fit ending at some date only uses the hinges inside
+# changepoint_range of its own training span, so the same matrix serves every cutoff
+# Rows past history_rows (future dates to forecast) are covered by the trend but never get changepoints
+class DesignMatrix:
+    def __init__(self, dates, calendar=None, n_changepoints=None, changepoint_range=None, history_rows=None):
+        n_changepoints = prophet_config.PROPHET_PARAMS['n_changepoints'] if n_changepoints is None else n_changepoints
+        self.changepoint_range = changepoint_range or prophet_config.PROPHET_PARAMS['changepoint_range']
+        self.days = epoch_days(dates)
+        self.start = self.days[0]
+        # Time is scaled to [0, 1] over the history as in Prophet, so penalties of RIDGE_ALPHA / prior_scale**2
+        # act like its priors with RIDGE_ALPHA as the noise variance relative to the price level
+        self.t_scale = max(self.days[(history_rows or len(self.days)) - 1] - self.start, 1.0)
+        t = (self.days - self.start) / self.t_scale
+        self.changepoints = np.linspace(0.0, self.changepoint_range, n_changepoints + 1)[1:]
+        hinges = np.maximum(t[:, None] - self.changepoints[None, :], 0.0)
+        calendar_block, calendar_penalty = calendar if calendar is not None else calendar_features(self.days)
+        self.X = np.hstack([np.ones((len(t), 1)), t[:, None], hinges, calendar_block])
+        hinge_penalty = np.full(n_changepoints, 1.0 / prophet_config.PROPHET_PARAMS['changepoint_prior_scale'] ** 2)
+        self.penalty = np.concatenate([[0.0, 0.0], hinge_penalty, calendar_penalty])
+        self.hinge_columns = np.arange(2, 2 + n_changepoints)
+
+    # Function to return the mask of columns a fit on rows [0, train_rows) may use
+    def active_columns(self, train_rows):
+        active = np.ones(self.X.shape[1], dtype=bool)
+        train_span = (self.days[train_rows - 1] - self.start) / self.t_scale
+        active[self.hinge_columns] = self.changepoints < train_span * self.changepoint_range
+        return active
+
+# Function to solve a ridge system from its Gram matrix, restricted to the active columns
+# xty may hold one column per ticker, solving every ticker sharing the design at once
+def ridge_solve(gram, xty, penalty, active, alpha=None):
+    alpha = prophet_config.RIDGE_ALPHA if alpha is None else alpha
+    weights = np.zeros(xty.shape)
+    system = gram[np.ix_(active, active)] + np.diag(alpha * penalty[active])
+    weights[active] = np.linalg.solve(system, xty[active])
+    return weights
+
+# Function to fit one ridge model per expanding training window (rows [0, end) for each end in train_ends)
+# The Gram matrix is accumulated block by block, so all cutoffs together cost a single pass over the rows
+def expanding_ridge(design, y, train_ends, alpha=None):
+    gram = np.zeros((design.X.shape[1], design.X.shape[1]))
+    xty = np.zeros(design.X.shape[1])
+    weights, previous_end = [], 0
+    for end in train_ends:
+        block = design.X[previous_end:end]
+        gram += block.T @ block
+        xty += block.T @ y[previous_end:end]
+        previous_end = end
+        weights.append(ridge_solve(gram, xty, design.penalty, design.active_columns(end), alpha))
+    return weights
@@ -0,0 +1,146 @@
+# forecast_store.py
+# ../prediction/forecast_store.py
+# Compact forecast storage: horizon rows of every ticker in one shared table keyed by (ticker, run_id, ds)
+
+import os
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from price_store import chunked, SQL_TICKER_CHUNK
+
+# Function to reduce a Prophet forecast to the compact output rows: the horizon after the last observed date,
+# with float32 values to keep the payload sent back to the parent small
+def compact_forecast(forecast, last_date, columns=None):
+    columns = [column for column in (columns or prophet_config.FORECAST_COLUMNS) if column in forecast]
+    horizon = forecast[forecast['ds'] > last_date]
+    compact = pd.DataFrame({'ds': horizon['ds'].dt.strftime('%Y-%m-%d').to_numpy()})
+    for column in columns:
+        compact[column] = horizon[column].to_numpy(dtype=np.float32)
+    return compact
+
+# SQLite tables of the compact forecasts, the runs that produced them and their per-ticker metrics
+class ForecastStore:
+    def __init__(self, engine, columns=None):
+        self.engine = engine
+        self.columns = list(columns or prophet_config.FORECAST_COLUMNS)
+        self.table = prophet_config.FORECAST_TABLE
+        self.runs_table = prophet_config.FORECAST_RUNS_TABLE
+        self.metrics_table = prophet_config.FORECAST_METRICS_TABLE
+        value_columns = ', '.join(f'"{column}" REAL' for column in self.columns)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" (ticker TEXT NOT NULL, run_id TEXT NOT NULL, '
+                f'ds TEXT NOT NULL, {value_columns}, PRIMARY KEY (ticker, run_id, ds)) WITHOUT ROWID'
+            )
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.runs_table}" (run_id TEXT PRIMARY KEY, started_at TEXT, '
+                f'finished_at TEXT, output_mode TEXT, horizon INTEGER, tickers INTEGER, failed INTEGER)'
+            )
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.metrics_table}" (ticker TEXT NOT NULL, run_id TEXT NOT NULL, '
+                f'mae REAL, mse REAL, rmse REAL, sharpe_ratio REAL, sortino_ratio REAL, max_drawdown REAL, '
+                f'hit_rate REAL, fit_mode TEXT, seconds REAL, '
+                f'PRIMARY KEY (ticker, run_id)) WITHOUT ROWID'
+            )
+
+    # Function to upsert long forecast rows (ticker, run_id, ds and the value columns) in one transaction
+    # Same signature as the price stores, so a BulkWriter can batch the writes
+    def write(self, data, replace=False):
+        if data.empty:
+            return
+        columns = ['ticker', 'run_id', 'ds'] + self.columns
+        data = data.reindex(columns=columns)
+        rows = list(zip(*(data[column].tolist() for column in columns)))
+        with self.engine.begin() as conn:
+            if replace:
+                keys = list(data[['ticker', 'run_id']].drop_duplicates().itertuples(index=False, name=None))
+                conn.exec_driver_sql(f'DELETE FROM "{self.table}" WHERE ticker = ? AND run_id = ?', keys)
+            conn.exec_driver_sql(
+                f'INSERT OR REPLACE INTO "{self.table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                rows
+            )
+
+    # Function to register a run (kept when resuming an unfinished run)
+    def start_run(self, run_id, output_mode, horizon):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'INSERT OR IGNORE INTO "{self.runs_table}" (run_id, started_at, output_mode, horizon) VALUES (?, ?, ?, ?)',
+                (run_id, datetime.now().isoformat(), output_mode, horizon)
+            )
+
+    # Function to store the metrics of the run's results and mark the run finished
+    def finish_run(self, run_id, results):
+        metric_names = ['MAE', 'MSE', 'RMSE', 'Sharpe Ratio', 'Sortino Ratio', 'Max Drawdown', 'Hit Rate']
+        rows = [(r['ticker'], run_id, *(r['metrics'].get(name) for name in metric_names), r.get('fit_mode'), r.get('seconds'))
+                for r in results if r['success']]
+        with self.engine.begin() as conn:
+            if rows:
+                placeholders = ", ".join("?" * len(rows[0]))
+                conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{self.metrics_table}" VALUES ({placeholders})', rows)
+            conn.exec_driver_sql(
+                f'UPDATE "{self.runs_table}" SET finished_at = ?, tickers = ?, failed = ? WHERE run_id = ?',
+                (datetime.now().isoformat(), len(rows), len(results) - len(rows), run_id)
+            )
+
+    # Function to return the id of the latest finished run, or None
+    def latest_run_id(self):
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql(
+                f'SELECT run_id FROM "{self.runs_table}" WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT 1'
+            ).scalar()
+
+    # Function to list the finished runs (run_id, finished_at, tickers, failed), newest first
+    def runs(self):
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                f'SELECT run_id, finished_at, tickers, failed FROM "{self.runs_table}" WHERE finished_at IS NOT NULL '
+                f'ORDER BY finished_at DESC'
+            ).fetchall()
+        return pd.DataFrame(rows, columns=['run_id', 'finished_at', 'tickers', 'failed'])
+
+    # Function to list the tickers forecast in a run (the latest finished run by default)
+    def tickers(self, run_id=None):
+        run_id = run_id or self.latest_run_id()
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(f'SELECT DISTINCT ticker FROM "{self.table}" WHERE run_id = ? ORDER BY ticker', (run_id,))
+            return [row[0] for row in rows]
+
+    # Function to load the forecasts of a run (the latest finished run by default), optionally for some tickers
+    def load(self, tickers=None, run_id=None):
+        run_id = run_id or self.latest_run_id()
+        columns = ['ticker', 'ds'] + self.columns
+        query = f'SELECT {", ".join(columns)} FROM "{self.table}" WHERE run_id = ?'
+        frames = []
+        with self.engine.connect() as conn:
+            for chunk in (chunked(list(tickers), SQL_TICKER_CHUNK) if tickers else [None]):
+                sql, params = query, [run_id]
+                if chunk:
+                    sql += f' AND ticker IN ({", ".join("?" * len(chunk))})'
+                    params += chunk
+                frames.append(pd.DataFrame(conn.exec_driver_sql(sql + ' ORDER BY ticker, ds', tuple(params)).fetchall(),
+                                           columns=columns))
+        forecasts = pd.concat(frames, ignore_index=True)
+        forecasts['ds'] = pd.to_datetime(forecasts['ds'])
+        return forecasts
+
+    # Function to load the per-ticker metrics of a run (the latest finished run by default)
+    def load_metrics(self, run_id=None):
+        run_id = run_id or self.latest_run_id()
+        with self.engine.connect() as conn:
+            result = conn.exec_driver_sql(f'SELECT * FROM "{self.metrics_table}" WHERE run_id = ? ORDER BY ticker', (run_id,))
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    # Function to delete all but the newest keep_runs runs
+    def prune(self, keep_runs):
+        with self.engine.begin() as conn:
+            old_runs = [row[0] for row in conn.exec_driver_sql(
+                f'SELECT run_id FROM "{self.runs_table}" ORDER BY started_at DESC LIMIT -1 OFFSET ?', (keep_runs,)
+            )]
+            for chunk in chunked(old_runs, SQL_TICKER_CHUNK):
+                placeholders = ", ".join("?" * len(chunk))
+                for table in [self.table, self.metrics_table, self.runs_table]:
+                    conn.exec_driver_sql(f'DELETE FROM "{table}" WHERE run_id IN ({placeholders})', tuple(chunk))
+        return old_runs
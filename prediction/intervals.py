@@ -0,0 +1,94 @@
+# intervals.py
+# ../prediction/intervals.py
+# Forecast interval modes for Prophet fits: simulated draws (over the whole frame or the horizon only), a closed-form
+# approximation from the fitted noise and changepoint scale, or lazy bounds computed from the stored model state
+
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+
+INTERVAL_MODES = ['sampled', 'horizon_only', 'analytic', 'lazy']
+
+# Function to return the terms the closed-form intervals need from a fitted Prophet model
+def model_interval_params(model):
+    return {
+        'sigma_obs': float(model.params['sigma_obs'].mean()),
+        'delta': model.params['delta'].mean(axis=0),
+        'y_scale': float(model.y_scale),
+        'start': model.start,
+        't_scale_seconds': model.t_scale.total_seconds(),
+        'changepoints_t': model.changepoints_t,
+    }
+
+# Function to return the same terms from a stored model state (model_store.make_state)
+def state_interval_params(state):
+    params = state['state']
+    return {
+        'sigma_obs': params['init']['sigma_obs'],
+        'delta': np.array(params['init']['delta']),
+        'y_scale': params['y_scale'],
+        'start': pd.Timestamp(params['start']),
+        't_scale_seconds': params['t_scale_seconds'],
+        'changepoints_t': params['changepoints_t'],
+    }
+
+# Function to compute interval bounds in closed form: observation noise plus the variance of the future trend
+# Prophet simulates future changepoints as a Poisson process (rate = changepoints per unit of scaled history) with
+# Laplace(0, mean |delta|) rate changes; a change at s moves the trend at t by delta * (t - s), so the trend variance
+# t units past the history is rate * 2 * lambda**2 * t**3 / 3. Bounds are yhat -/+ z standard deviations.
+def analytic_bounds(ds, yhat, params, width=None):
+    width = prophet_config.PROPHET_PARAMS['interval_width'] if width is None else width
+    z = NormalDist().inv_cdf(0.5 + width / 2)
+    t = (pd.DatetimeIndex(ds) - params['start']).total_seconds().to_numpy() / params['t_scale_seconds']
+    ahead = np.clip(t - 1.0, 0.0, None)
+    rate = len(params['changepoints_t'])
+    laplace_scale = np.mean(np.abs(params['delta'])) + 1e-8
+    trend_variance = rate * 2 * laplace_scale ** 2 * ahead ** 3 / 3
+    sd = params['y_scale'] * np.sqrt(params['sigma_obs'] ** 2 + trend_variance)
+    yhat = np.asarray(yhat, dtype=float)
+    return yhat - z * sd, yhat + z * sd
+
+# Function to predict a fitted Prophet model over future (history then horizon rows) with the given interval mode
+# (default prophet_config.INTERVAL_MODE); the frame always has yhat_lower and yhat_upper, NaN where not computed
+def predict_with_intervals(model, future, history_rows, mode=None):
+    mode = mode or prophet_config.INTERVAL_MODE
+    if mode not in INTERVAL_MODES:
+        raise ValueError(f"Unknown interval mode '{mode}', expected one of {', '.join(INTERVAL_MODES)}")
+    if mode == 'sampled':
+        return model.predict(future)
+
+    samples = model.uncertainty_samples
+    model.uncertainty_samples = 0
+    try:
+        forecast = model.predict(future)
+    finally:
+        model.uncertainty_samples = samples
+    forecast['yhat_lower'] = np.nan
+    forecast['yhat_upper'] = np.nan
+    if mode == 'horizon_only' and len(future) > history_rows:
+        horizon = model.predict(future.iloc[history_rows:])
+        forecast.loc[forecast.index[history_rows:], ['yhat_lower', 'yhat_upper']] = horizon[['yhat_lower', 'yhat_upper']].to_numpy()
+    elif mode == 'analytic':
+        forecast['yhat_lower'], forecast['yhat_upper'] = analytic_bounds(forecast['ds'], forecast['yhat'],
+                                                                         model_interval_params(model))
+    return forecast
+
+# Function to fill the missing bounds of stored forecasts (ticker, ds, yhat, ...) of lazy runs from each ticker's
+# stored model state, only for the tickers being read. A ticker whose state is not the fit behind the forecast
+# (no Prophet fit, or refitted on a longer history since) keeps its missing bounds.
+def resolve_lazy_intervals(forecasts, state_store, width=None):
+    if forecasts.empty or 'yhat_lower' not in forecasts or not forecasts['yhat_lower'].isna().any():
+        return forecasts
+    forecasts = forecasts.copy()
+    for ticker, rows in forecasts[forecasts['yhat_lower'].isna()].groupby('ticker', sort=False):
+        state = state_store.load(ticker)
+        if state is None or pd.Timestamp(state['last_date']) + pd.Timedelta(days=1) != rows['ds'].min():
+            continue
+        lower, upper = analytic_bounds(rows['ds'], rows['yhat'], state_interval_params(state), width)
+        forecasts.loc[rows.index, 'yhat_lower'] = lower
+        forecasts.loc[rows.index, 'yhat_upper'] = upper
+    return forecasts
@@ -0,0 +1,157 @@
+# model_store.py
+# ../prediction/model_store.py
+# Persisted per-ticker Prophet parameters for warm-started refits
+
+import json
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+
+# Function to fingerprint the model configuration, so stored parameters are only reused with the same setup
+# Holidays enter through their definitions: the dates follow from the data range, and the model terms do not
+def config_fingerprint(prophet_params, seasonality_params):
+    params = {key: value for key, value in prophet_params.items() if key != 'holidays'}
+    payload = {
+        'prophet_params': params,
+        'seasonality_params': seasonality_params,
+        'holidays': [prophet_config.HOLIDAY_WINDOWS, prophet_config.FIXED_HOLIDAYS],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+# Function to apply tuning overrides (prediction/tuning.py) to the base configuration, returning the Prophet
+# parameters and seasonalities to build a model with; 'fourier_scale' multiplies every seasonality's fourier_order
+def tuned_config(overrides=None, prophet_params=None, seasonality_params=None):
+    params = dict(prophet_config.PROPHET_PARAMS if prophet_params is None else prophet_params)
+    seasonalities = [dict(s) for s in (prophet_config.SEASONALITY_PARAMS if seasonality_params is None else seasonality_params)]
+    for key, value in (overrides or {}).items():
+        if key == 'fourier_scale':
+            for seasonality in seasonalities:
+                seasonality['fourier_order'] = max(1, int(round(seasonality['fourier_order'] * value)))
+        else:
+            params[key] = value
+    return params, seasonalities
+
+# Function to hash the first n_rows of a ds/y history
+def data_hash(stock_data, n_rows=None):
+    history = stock_data[['ds', 'y']].iloc[:n_rows]
+    return hashlib.sha1(pd.util.hash_pandas_object(history, index=False).to_numpy().tobytes()).hexdigest()
+
+# Function to extract Stan starting values from a fitted model (posterior mean when sampled)
+def warm_start_params(model):
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = float(model.params[name].mean())
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name].mean(axis=0).tolist()
+    return params
+
+# Function to turn stored (JSON) starting values back into the arrays Prophet's Stan backend expects
+def init_from_state(state):
+    init = dict(state['state']['init'])
+    for name in ['delta', 'beta']:
+        init[name] = np.array(init[name])
+    return init
+
+# Function to build the stored state of a freshly fitted model
+# The scaling terms are kept so intervals can later be recomputed from the stored parameters alone
+def make_state(ticker, model, stock_data, fingerprint, fit_mode, previous_state=None):
+    now = datetime.now().isoformat()
+    full_fit_at = now if fit_mode == 'full' or previous_state is None else previous_state['full_fit_at']
+    return {
+        'ticker': ticker,
+        'config_fingerprint': fingerprint,
+        'data_hash': data_hash(stock_data),
+        'n_rows': len(stock_data),
+        'last_date': pd.Timestamp(stock_data['ds'].max()).strftime('%Y-%m-%d'),
+        'full_fit_at': full_fit_at,
+        'fitted_at': now,
+        'state': {
+            'init': warm_start_params(model),
+            'y_scale': float(model.y_scale),
+            'start': model.start.isoformat(),
+            't_scale_seconds': model.t_scale.total_seconds(),
+            'changepoints_t': [float(t) for t in model.changepoints_t],
+        },
+    }
+
+# Function to decide between a warm-started and a full refit, returning (mode, reason)
+def choose_fit_mode(state, fingerprint, stock_data, now=None):
+    now = now or datetime.now()
+    if state is None:
+        return 'full', 'no stored state'
+    if state['config_fingerprint'] != fingerprint:
+        return 'full', 'configuration changed'
+    if state['n_rows'] > len(stock_data) or data_hash(stock_data, state['n_rows']) != state['data_hash']:
+        return 'full', 'history revised'
+    if now - datetime.fromisoformat(state['full_fit_at']) >= pd.Timedelta(days=prophet_config.WARM_START_FULL_REFIT_DAYS):
+        return 'full', 'periodic full refit'
+    if len(stock_data) - state['n_rows'] > prophet_config.WARM_START_MAX_NEW_ROWS_FRACTION * state['n_rows']:
+        return 'full', 'too much new data'
+    return 'warm', 'appended rows only'
+
+# SQLite table of the tuned configuration overrides of each ticker, tagged with the base configuration they were
+# tuned against so a change of prophet_config makes them stale
+class TunedParamsStore:
+    def __init__(self, engine, table=None):
+        self.engine = engine
+        self.table = table or prophet_config.TUNED_PARAMS_TABLE
+        self.fingerprint = config_fingerprint(prophet_config.PROPHET_PARAMS, prophet_config.SEASONALITY_PARAMS)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" (ticker TEXT PRIMARY KEY, config_fingerprint TEXT, '
+                f'params TEXT, unit TEXT, mape REAL, cost INTEGER, trials INTEGER, tuned_at TEXT)'
+            )
+
+    # Function to load the overrides of a ticker tuned against the current base configuration, or None
+    def load(self, ticker):
+        with self.engine.connect() as conn:
+            params = conn.exec_driver_sql(
+                f'SELECT params FROM "{self.table}" WHERE ticker = ? AND config_fingerprint = ?', (ticker, self.fingerprint)
+            ).scalar()
+        return None if params is None else json.loads(params)
+
+    # Function to upsert the winners of a tuning run: rows of (ticker, overrides, unit, mape, cost, trials)
+    def save_many(self, rows):
+        tuned_at = datetime.now().isoformat(timespec='seconds')
+        rows = [(ticker, self.fingerprint, json.dumps(overrides, sort_keys=True), unit, mape, cost, trials, tuned_at)
+                for ticker, overrides, unit, mape, cost, trials in rows]
+        if rows:
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{self.table}" VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+# SQLite table of the latest model state per ticker
+class ModelStateStore:
+    def __init__(self, engine, table=None):
+        self.engine = engine
+        self.table = table or prophet_config.MODEL_STATE_TABLE
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" (ticker TEXT PRIMARY KEY, config_fingerprint TEXT, '
+                f'data_hash TEXT, n_rows INTEGER, last_date TEXT, full_fit_at TEXT, fitted_at TEXT, state TEXT)'
+            )
+
+    # Function to load the stored state of a ticker, or None
+    def load(self, ticker):
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql(
+                f'SELECT ticker, config_fingerprint, data_hash, n_rows, last_date, full_fit_at, fitted_at, state '
+                f'FROM "{self.table}" WHERE ticker = ?', (ticker,)
+            ).mappings().first()
+        if row is None:
+            return None
+        state = dict(row)
+        state['state'] = json.loads(state['state'])
+        return state
+
+    # Function to upsert many states in one transaction
+    def save_many(self, states):
+        rows = [(s['ticker'], s['config_fingerprint'], s['data_hash'], s['n_rows'], s['last_date'],
+                 s['full_fit_at'], s['fitted_at'], json.dumps(s['state'])) for s in states]
+        if rows:
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{self.table}" VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
@@ -0,0 +1,142 @@
+# models.py
+# ../prediction/models.py
+# Pluggable forecasting models: Prophet (one Stan fit per ticker, warm-started) and a closed-form ridge engine
+# on the same trend, seasonality and holiday terms, solved in batch for tickers sharing a calendar
+
+import os
+import sys
+import logging
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from features import DesignMatrix, ridge_solve
+from feature_cache import cached_calendar
+from model_store import config_fingerprint, choose_fit_mode, make_state, init_from_state, tuned_config
+from intervals import predict_with_intervals
+from instrumentation import TaskTimings, phase
+
+logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+# Prophet: every ticker is fitted on its own with its tuned configuration when one is stored, starting from its
+# stored parameters when the refit policy allows
+class ProphetModel:
+    name = 'prophet'
+    batch_size = 1
+
+    def __init__(self, state_store=None, tuned_store=None):
+        self.state_store = state_store
+        self.tuned_store = tuned_store if prophet_config.USE_TUNED_PARAMS else None
+
+    # Function to create an unfitted Prophet model (the configured parameters and seasonalities by default) with the
+    # holidays of the dates from start to end (history and horizon)
+    def build(self, start, end, prophet_params=None, seasonality_params=None):
+        from prophet import Prophet
+        model = Prophet(**prophet_config.with_holidays(prophet_params, start, end))
+        for seasonality in (prophet_config.SEASONALITY_PARAMS if seasonality_params is None else seasonality_params):
+            model.add_seasonality(**seasonality)
+        return model
+
+    # Function to fit each history and forecast `horizon` days past it
+    # Returns {ticker: {'forecast', 'model_state', 'fit_mode', 'timings'}}, the forecast covering history and horizon
+    # with intervals from prophet_config.INTERVAL_MODE
+    def fit_predict(self, histories, horizon):
+        outputs = {}
+        for ticker, stock_data in histories.items():
+            timings = TaskTimings()
+            overrides = self.tuned_store.load(ticker) if self.tuned_store else None
+            params, seasonalities = tuned_config(overrides)
+            fingerprint = config_fingerprint(params, seasonalities)
+            state = self.state_store.load(ticker) if prophet_config.WARM_START and self.state_store else None
+            fit_mode, fit_reason = choose_fit_mode(state, fingerprint, stock_data)
+            with phase(timings, 'fit') as timing:
+                model = self.build(stock_data['ds'].iloc[0], stock_data['ds'].iloc[-1] + pd.Timedelta(days=horizon),
+                                   params, seasonalities)
+                if fit_mode == 'warm':
+                    model.fit(stock_data, init=init_from_state(state))
+                else:
+                    model.fit(stock_data)
+                timing['rows'] = len(stock_data)
+            with phase(timings, 'predict') as timing:
+                future = model.make_future_dataframe(periods=horizon, freq='D')
+                forecast = predict_with_intervals(model, future, len(stock_data))
+                timing['rows'] = len(forecast)
+            outputs[ticker] = {
+                'forecast': forecast,
+                'model_state': make_state(ticker, model, stock_data, fingerprint, fit_mode, state),
+                'fit_mode': f"{fit_mode} ({fit_reason}{', tuned' if overrides else ''})",
+                'timings': timings.as_dict(),
+            }
+        return outputs
+
+# Ridge: the Prophet-shaped design matrix is built once per calendar (same dates) and one factorized system
+# gives the coefficients of every ticker on that calendar; intervals come from the in-sample residual spread
+class RidgeModel:
+    name = 'ridge'
+
+    def __init__(self, state_store=None, tuned_store=None, alpha=None):
+        self.alpha = alpha
+        self.batch_size = prophet_config.RIDGE_BATCH_SIZE
+
+    # Function to fit each history and forecast `horizon` days past it (same output shape as ProphetModel)
+    def fit_predict(self, histories, horizon):
+        groups = {}
+        for ticker, stock_data in histories.items():
+            key = (stock_data['ds'].iloc[0], stock_data['ds'].iloc[-1], len(stock_data))
+            groups.setdefault(key, []).append(ticker)
+
+        z = NormalDist().inv_cdf(0.5 + prophet_config.PROPHET_PARAMS['interval_width'] / 2)
+        outputs = {}
+        for tickers in groups.values():
+            timings = TaskTimings()
+            with phase(timings, 'fit') as timing:
+                dates = pd.DatetimeIndex(histories[tickers[0]]['ds'])
+                n_rows = len(dates)
+                all_dates = dates.append(pd.date_range(dates[-1] + pd.Timedelta(days=1), periods=horizon, freq='D'))
+                design = DesignMatrix(all_dates, calendar=cached_calendar(all_dates), history_rows=n_rows)
+                X = design.X[:n_rows]
+                Y = np.column_stack([histories[ticker]['y'].to_numpy(dtype=float) for ticker in tickers])
+                active = design.active_columns(n_rows)
+                weights = ridge_solve(X.T @ X, X.T @ Y, design.penalty, active, self.alpha)
+                timing['rows'] = Y.size
+            with phase(timings, 'predict') as timing:
+                fitted = design.X @ weights
+                sigma = np.sqrt(((Y - fitted[:n_rows]) ** 2).sum(axis=0) / max(n_rows - active.sum(), 1))
+                forecasts = {}
+                for column, ticker in enumerate(tickers):
+                    forecast = pd.DataFrame({'ds': all_dates, 'yhat': fitted[:, column]})
+                    forecast['yhat_lower'] = forecast['yhat'] - z * sigma[column]
+                    forecast['yhat_upper'] = forecast['yhat'] + z * sigma[column]
+                    forecasts[ticker] = forecast
+                timing['rows'] = fitted.size
+            # The group's fit and predict times are shared evenly by its tickers
+            for ticker in tickers:
+                outputs[ticker] = {'forecast': forecasts[ticker], 'model_state': None, 'fit_mode': 'ridge',
+                                   'timings': timings.as_dict(len(tickers))}
+        return outputs
+
+MODELS = {'prophet': ProphetModel, 'ridge': RidgeModel}
+
+# Function to create a model by name
+def get_model(name, state_store=None, tuned_store=None):
+    if name not in MODELS:
+        raise ValueError(f"Unknown model '{name}', expected one of {', '.join(MODELS)}")
+    return MODELS[name](state_store=state_store, tuned_store=tuned_store)
+
+# Function to pick a model per ticker for an 'auto' run from the latest walk-forward backtests:
+# Prophet only where its out-of-sample MAPE beats ridge by at least min_improvement (relative), ridge elsewhere
+def choose_models(tickers, engine, min_improvement=None):
+    min_improvement = prophet_config.AUTO_MODEL_MIN_IMPROVEMENT if min_improvement is None else min_improvement
+    choices = {ticker: 'ridge' for ticker in tickers}
+    if prophet_config.BACKTEST_TABLE not in inspect(engine).get_table_names():
+        return choices
+    summary = pd.read_sql_table(prophet_config.BACKTEST_TABLE, con=engine, columns=['ticker', 'engine', 'run_at', 'mape'])
+    latest = summary.sort_values('run_at').groupby(['ticker', 'engine'])['mape'].last().unstack()
+    if {'ridge', 'prophet'} <= set(latest.columns):
+        better = latest['prophet'] < latest['ridge'] * (1 - min_improvement)
+        for ticker in better[better].index:
+            if ticker in choices:
+                choices[ticker] = 'prophet'
+    return choices
@@ -1,161 +1,305 @@
 # prediction.py
 # ../prediction/prediction.py
-# Script for predicting stock prices using Prophet
+# Script for predicting stock prices using Prophet or the batched ridge engine
 
 import os
+import functools
+import threading
 import pandas as pd
 import time
 from datetime import datetime
-from prophet import Prophet
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import prophet_config
-from math_formulas import calculate_mae, calculate_mse, calculate_rmse, calculate_sharpe_ratio
+from price_store import open_cleaned_store
+from scheduler import Checkpoint, order_by_cost, run_pool, print_report
+from forecast_store import ForecastStore, compact_forecast
+from bulk_writer import BulkWriter
+from model_store import ModelStateStore, TunedParamsStore
+from models import MODELS, get_model, choose_models
+from feature_cache import prepare_calendar
+from math_formulas import evaluate_panel, pad_panel
+from instrumentation import RunRecorder, TaskTimings, phase
 
 # Setup and Configuration
-data_database_path = prophet_config.CLEANED_DATABASE_PATH
 forecast_database_path = prophet_config.FORECAST_DATABASE_PATH
-data_engine = create_engine(f'sqlite:///{data_database_path}')
+data_store = open_cleaned_store()
 forecast_engine = create_engine(f'sqlite:///{forecast_database_path}')
+model_state_store = ModelStateStore(forecast_engine)
+tuned_params_store = TunedParamsStore(forecast_engine)
+forecast_store = ForecastStore(forecast_engine)
 
-# Prophet configuration parameters
-prophet_params = prophet_config.PROPHET_PARAMS
-seasonality_params = prophet_config.SEASONALITY_PARAMS
+# Forecast configuration parameters
 forecast_horizon = prophet_config.FORECAST_HORIZON
 risk_free_rate_annual = prophet_config.RISK_FREE_RATE_ANNUAL
 risk_free_rate_daily = prophet_config.RISK_FREE_RATE_DAILY
 
-# Ensure plot_images directory exists
-plot_images_dir = os.path.expanduser("../data/plot_images")
-if not os.path.exists(plot_images_dir):
-    os.makedirs(plot_images_dir)
-
-# Function to process each stock table
-def process_stock_table(table_name):
+# Function to forecast one task: a model name and the tickers it fits together
+# Returns one result per ticker; the task's wall time and read time are shared evenly between its tickers
+def process_task(task):
+    model_name, table_names = task
+    start_time = time.time()
+    task_error = None
+    read_timings = TaskTimings()
     try:
-        stock_data = pd.read_sql_table(table_name, con=data_engine, parse_dates=['Date'])
-        stock_data['ds'] = stock_data['Date']
-        stock_data['y'] = stock_data['Close']
-
-        # Create and fit the Prophet model
-        model = Prophet(**prophet_params)
-        for seasonality in seasonality_params:
-            model.add_seasonality(**seasonality)
-        model.fit(stock_data)
-
-        # Generate future dataframe and make predictions
-        future = model.make_future_dataframe(periods=forecast_horizon, freq='D')
-        forecast = model.predict(future)
-
-        # Save forecast data to database
-        forecast['ticker'] = table_name
-        forecast.reset_index(drop=True, inplace=True)
-        forecast.to_sql(f"{table_name}_forecast", con=forecast_engine, if_exists='replace', index=False)
-
-        # Save plot of forecast
-        fig = model.plot(forecast)
-        plot_filepath = os.path.join(plot_images_dir, f"{table_name}_forecast_plot.png")
-        fig.savefig(plot_filepath)
-        plt.close(fig)
-
-        # Evaluate forecast performance
-        forecast_period_data = stock_data[stock_data['ds'] > forecast['ds'].max() - pd.Timedelta(days=forecast_horizon)]
-        evaluation_df = forecast.set_index('ds')[['yhat']].join(forecast_period_data.set_index('ds')[['y']], how='inner')
-        mae = calculate_mae(evaluation_df['y'], evaluation_df['yhat'])
-        mse = calculate_mse(evaluation_df['y'], evaluation_df['yhat'])
-        rmse = calculate_rmse(evaluation_df['y'], evaluation_df['yhat'])
-
-        # Calculate Sharpe Ratio
-        forecast_returns = forecast['yhat'].pct_change().dropna()
-        sharpe_ratio = calculate_sharpe_ratio(forecast_returns, risk_free_rate_annual, risk_free_rate_daily)
-
-        return {
-            'ticker': table_name,
-            'success': True,
-            'metrics': {'MAE': mae, 'MSE': mse, 'RMSE': rmse, 'Sharpe Ratio': sharpe_ratio}
-        }
+        histories = {}
+        with phase(read_timings, 'read') as timing:
+            prices = data_store.load(table_names, columns=['Close'])
+            timing['rows'] = len(prices)
+        for table_name, stock_data in prices.groupby('ticker', sort=False):
+            stock_data = stock_data.dropna(subset=['Close']).reset_index(drop=True)
+            histories[table_name] = pd.DataFrame({'ds': stock_data['Date'], 'y': stock_data['Close']})
+        outputs = get_model(model_name, model_state_store, tuned_params_store).fit_predict(histories, forecast_horizon)
     except Exception as e:
-        return {'ticker': table_name, 'success': False, 'error': str(e)}
+        outputs, task_error = {}, str(e)
+    seconds = (time.time() - start_time) / len(table_names)
 
-# Function to process a batch of tables
-def process_batch(batch):
     results = []
-    with ProcessPoolExecutor() as executor:
-        future_to_stock = {executor.submit(process_stock_table, table): table for table in batch}
-        for future in as_completed(future_to_stock):
-            results.append(future.result())
+    for table_name in table_names:
+        if table_name not in outputs:
+            results.append({'ticker': table_name, 'success': False, 'error': task_error or 'no cleaned data',
+                            'seconds': seconds})
+            continue
+        try:
+            timings = TaskTimings()
+            result = finish_forecast(table_name, histories[table_name], outputs[table_name], model_name, seconds, timings)
+            result['timings'] = {**read_timings.as_dict(len(table_names)), **outputs[table_name]['timings'],
+                                 **timings.as_dict()}
+            results.append(result)
+        except Exception as e:
+            results.append({'ticker': table_name, 'success': False, 'error': str(e), 'seconds': seconds})
     return results
 
-# Main function to process tables in batches
-def main(start_from_batch=0):
-    inspector = inspect(data_engine)
-    table_names = inspector.get_table_names()
-    
-    error_stocks = []
-    batch_size = 1
-    total_batches = len(table_names) // batch_size + (1 if len(table_names) % batch_size else 0)
-    batches = [table_names[i:i + batch_size] for i in range(0, len(table_names), batch_size)]
-
-    for batch_number, batch in enumerate(batches, start=1):
-        if batch_number < start_from_batch:
-            continue
+# Function to turn one fitted forecast into its stored output and evaluation arrays
+def finish_forecast(table_name, stock_data, output, model_name, seconds, timings=None):
+    forecast = output['forecast']
+
+    # Compact output is returned to the parent for a bulk write; full output keeps one table per ticker
+    compact_rows = None
+    if prophet_config.FORECAST_OUTPUT_MODE == 'compact':
+        compact_rows = compact_forecast(forecast, stock_data['ds'].max())
+    else:
+        with phase(timings, 'write') as timing:
+            forecast['ticker'] = table_name
+            forecast.reset_index(drop=True, inplace=True)
+            forecast.to_sql(f"{table_name}_forecast", con=forecast_engine, if_exists='replace', index=False)
+            timing['rows'] = len(forecast)
+
+    # Evaluation window and forecast path, scored for a whole batch of tickers at once in the parent
+    forecast_period_data = stock_data[stock_data['ds'] > stock_data['ds'].max() - pd.Timedelta(days=forecast_horizon)]
+    evaluation_df = forecast.set_index('ds')[['yhat']].join(forecast_period_data.set_index('ds')[['y']], how='inner')
+    evaluation = {
+        'actual': evaluation_df['y'].to_numpy(dtype=float),
+        'predicted': evaluation_df['yhat'].to_numpy(dtype=float),
+        'path': forecast['yhat'].to_numpy(dtype=float),
+    }
+
+    return {
+        'ticker': table_name,
+        'success': True,
+        'model': model_name,
+        'fit_mode': output['fit_mode'],
+        'model_state': output['model_state'],
+        'forecast': compact_rows,
+        'evaluation': evaluation,
+        'seconds': seconds
+    }
+
+# Function to group the tickers into tasks for their models, Prophet's slow fits first and longest histories first
+# Ridge tasks hold up to RIDGE_BATCH_SIZE tickers sharing a calendar, so each task is one batched solve
+def make_tasks(models, history_rows, date_ranges):
+    tasks = []
+    for model_name in MODELS:
+        tickers = order_by_cost([ticker for ticker, name in models.items() if name == model_name], history_rows)
+        batch_size = get_model(model_name).batch_size
+        calendars = {}
+        for ticker in tickers:
+            calendars.setdefault(date_ranges.get(ticker), []).append(ticker)
+        for calendar_tickers in calendars.values():
+            for i in range(0, len(calendar_tickers), batch_size):
+                tasks.append((model_name, calendar_tickers[i:i + batch_size]))
+    return tasks
+
+# Function to score a batch of successful results in one vectorized pass, setting each result's metrics
+def evaluate_results(results):
+    evaluations = [result.pop('evaluation') for result in results]
+    metrics = evaluate_panel(
+        pad_panel([evaluation['actual'] for evaluation in evaluations]),
+        pad_panel([evaluation['predicted'] for evaluation in evaluations]),
+        pad_panel([evaluation['path'] for evaluation in evaluations]),
+        risk_free_rate_annual, risk_free_rate_daily
+    )
+    for row, result in enumerate(results):
+        result['metrics'] = {name: float(values[row]) for name, values in metrics.items()}
+
+# Function to initialize a pool worker once: fresh database connections, and the Prophet/Stan backend loaded up
+# front only when the run has Prophet tasks (workers of ridge-only runs never import it)
+def init_worker(load_prophet=True):
+    data_store.engine.dispose(close=False)
+    forecast_engine.dispose(close=False)
+    if load_prophet:
+        from prophet import Prophet
+        Prophet()
+
+# Function to pick the model of every ticker ('auto' chooses per ticker from the latest backtests)
+def select_models(tickers, model=None):
+    model = model or prophet_config.FORECAST_MODEL
+    return choose_models(tickers, forecast_engine) if model == 'auto' else {ticker: model for ticker in tickers}
+
+# One forecasting run in the parent process: its checkpoint, the bulk writer of compact forecasts and the
+# batched evaluation of finished tickers. main drives it with run_pool; run_pipeline.py feeds it tickers
+# as they come out of cleaning.
+class PredictionRun:
+    def __init__(self, resume=False):
+        self.checkpoint = Checkpoint(prophet_config.PREDICTION_CHECKPOINT_FILE)
+        self.completed = self.checkpoint.start(resume)
+        self.run_id = self.checkpoint.run_id
+        self.recorder = RunRecorder('prediction', self.run_id)
+        self.error_stocks = [ticker for ticker, result in self.completed.items() if not result['success']]
+        self.pending_results = []
+        # A success is checkpointed only once its forecast rows are committed: tickers with rows still queued in the
+        # writer, evaluated results waiting for their batch, and tickers whose batch failed to write
+        self.lock = threading.Lock()
+        self.unwritten = set()
+        self.awaiting_write = {}
+        self.write_failed = set()
+        forecast_store.start_run(self.run_id, prophet_config.FORECAST_OUTPUT_MODE, forecast_horizon)
+        self.forecast_writer = BulkWriter(forecast_store, on_written=self.on_written, recorder=self.recorder)
+
+    # Function to checkpoint an evaluated success, or hold it until the writer has committed its forecast rows
+    def release(self, result):
+        with self.lock:
+            if result['ticker'] in self.unwritten:
+                self.awaiting_write[result['ticker']] = result
+                return
+        self.record(result)
+
+    # Function to checkpoint a result, turning a success whose forecast rows could not be written into a failure
+    def record(self, result):
+        with self.lock:
+            if result['success'] and result['ticker'] in self.write_failed:
+                result['success'] = False
+                result['error'] = "Forecast rows could not be written"
+                self.error_stocks.append(result['ticker'])
+            self.checkpoint.record(result)
+
+    # Function called from the writer thread after each batch of forecast rows, releasing the results held for it
+    def on_written(self, tickers, success):
+        released = []
+        with self.lock:
+            for ticker in tickers:
+                self.unwritten.discard(ticker)
+                if not success:
+                    self.write_failed.add(ticker)
+                if ticker in self.awaiting_write:
+                    released.append(self.awaiting_write.pop(ticker))
+        for result in released:
+            self.record(result)
+
+    # Function to evaluate and save the buffered successful results as one batch, then release them to the checkpoint
+    def flush_results(self):
+        if self.pending_results:
+            with phase(self.recorder, 'evaluate') as timing:
+                evaluate_results(self.pending_results)
+                timing['rows'] = len(self.pending_results)
+            states = [result.pop('model_state') for result in self.pending_results]
+            model_state_store.save_many([state for state in states if state is not None])
+            for result in self.pending_results:
+                print(f"Processed {result['ticker']} successfully ({result['fit_mode']} fit, {result['seconds']:.1f}s). Metrics: {result['metrics']}")
+                self.release(result)
+            self.pending_results.clear()
+
+    # Function to handle each finished ticker
+    def on_result(self, result):
+        self.recorder.add_timings(result['ticker'], result.pop('timings', None))
+        if result['success']:
+            forecast_rows = result.pop('forecast')
+            if forecast_rows is not None and not forecast_rows.empty:
+                with self.lock:
+                    self.unwritten.add(result['ticker'])
+                self.forecast_writer.put(forecast_rows.assign(ticker=result['ticker'], run_id=self.run_id))
+            self.pending_results.append(result)
+            if len(self.pending_results) >= prophet_config.RESULT_BATCH_SIZE:
+                self.flush_results()
+        else:
+            print(f"Error processing {result['ticker']}: {result['error']}")
+            self.recorder.error(result['ticker'], result['error'])
+            self.error_stocks.append(result['ticker'])
+            self.record(result)
+
+    # Function to complete the run: flush the last results, record the run and save the aggregate metrics
+    # (closing the writer commits the last forecast rows, which checkpoints their held results)
+    # Returns every result of the run, including those recorded before a resume
+    def finish(self, results, report):
+        self.flush_results()
+        self.forecast_writer.close()
+        self.forecast_writer.report()
+        results = list(self.completed.values()) + results
+        forecast_store.finish_run(self.run_id, results)
+        forecast_store.prune(prophet_config.FORECAST_KEEP_RUNS)
+        print_report(report)
+
+        if self.error_stocks:
+            print("Errors encountered for the following stocks:")
+            for stock in self.error_stocks:
+                print(stock)
+
+        # Aggregate performance metrics
+        successes = [result for result in results if result['success']]
+        if successes:
+            metrics_table = pd.DataFrame([result['metrics'] for result in successes],
+                                         index=[result['ticker'] for result in successes])
+            aggregate_performance = metrics_table.mean()
+
+            print("Aggregate Performance Metrics:")
+            print(aggregate_performance)
+
+            # Save aggregate performance metrics to database
+            aggregate_performance = aggregate_performance.rename_axis('Metric').reset_index(name='Value')
+            aggregate_performance.to_sql("aggregate_performance_metrics", con=forecast_engine, if_exists='replace', index=False)
+            print(f"Aggregate performance metrics saved to database")
+
+            # Save Sharpe Ratios
+            sharpe_df = metrics_table[['Sharpe Ratio']].rename_axis('Ticker').reset_index()
+            sharpe_df.to_sql("sharpe_ratios", con=forecast_engine, if_exists='replace', index=False)
+            print(f"Sharpe ratios saved to database")
+
+        self.checkpoint.finish()
+        self.recorder.finish()
+        return results
+
+# Main function to process every ticker on a persistent worker pool, longest histories first
+# With resume=True the tickers recorded in the checkpoint of an unfinished run are skipped
+# Plots are rendered afterwards by render.py when render_plots is set (or prophet_config.RENDER_PLOTS)
+# model picks the forecasting model for the run ('prophet', 'ridge' or 'auto', default prophet_config.FORECAST_MODEL)
+def main(resume=False, tickers=None, max_workers=None, render_plots=None, model=None):
+    stats = data_store.stats()
+    history_rows = dict(zip(stats['ticker'], stats['rows']))
+    table_names = tickers or list(history_rows)
+
+    run = PredictionRun(resume)
+    pending = [ticker for ticker in table_names if ticker not in run.completed]
+    models = select_models(pending, model)
+    date_ranges = dict(zip(stats['ticker'], zip(stats['first_date'], stats['last_date'])))
+    tasks = make_tasks(models, history_rows, date_ranges)
+    ridge_tickers = [ticker for ticker, name in models.items() if name == 'ridge' and ticker in date_ranges]
+    prepare_calendar([date_ranges[ticker][0] for ticker in ridge_tickers],
+                     [date_ranges[ticker][1] for ticker in ridge_tickers], forecast_horizon)
+    model_counts = pd.Series(models, dtype=object).value_counts().to_dict()
+    print(f"Run {run.run_id}: {len(pending)} tickers to process {model_counts}, {len(run.completed)} already done")
+
+    results, report = run_pool(tasks, process_task, max_workers or prophet_config.PREDICTION_MAX_WORKERS,
+                               functools.partial(init_worker, 'prophet' in models.values()), run.on_result)
+    results = run.finish(results, report)
 
-        print(f"Processing batch {batch_number} of {total_batches}")
-        results = process_batch(batch)
-        for result in results:
-            if result['success']:
-                print(f"Processed {result['ticker']} successfully. Metrics: {result['metrics']}")
-            else:
-                print(f"Error processing {result['ticker']}: {result['error']}")
-                error_stocks.append(result['ticker'])
-
-    if error_stocks:
-        print("Errors encountered for the following stocks:")
-        for stock in error_stocks:
-            print(stock)
-
-    # Aggregate performance metrics
-    if 'results' in locals():
-        performance_metrics = {result['ticker']: result['metrics'] for result in results if result['success']}
-        aggregate_performance = pd.DataFrame(performance_metrics).T.mean()
-
-        print("Aggregate Performance Metrics:")
-        print(aggregate_performance)
-
-        sns.barplot(x=aggregate_performance.index, y=aggregate_performance.values)
-        plt.title("Aggregate Performance Metrics")
-        plt.ylabel('Metric Value')
-        plt.show()
-
-        # Save aggregate performance metrics to database
-        aggregate_performance.reset_index(inplace=True)
-        aggregate_performance.rename(columns={'index': 'Metric'}, inplace=True)
-        aggregate_performance.to_sql("aggregate_performance_metrics", con=forecast_engine, if_exists='replace', index=False)
-        print(f"Aggregate performance metrics saved to database")
-
-        # Plot and save Sharpe Ratios
-        sharpe_df = pd.DataFrame({ticker: metrics['Sharpe Ratio'] for ticker, metrics in performance_metrics.items()}, index=['Sharpe Ratio']).T
-        sns.barplot(x=sharpe_df.index, y=sharpe_df['Sharpe Ratio'])
-        plt.title("Sharpe Ratios of Stocks")
-        plt.xticks(rotation=45)
-        plt.show()
-
-        sharpe_df.reset_index(inplace=True)
-        sharpe_df.rename(columns={'index': 'Ticker'}, inplace=True)
-        sharpe_df.to_sql("sharpe_ratios", con=forecast_engine, if_exists='replace', index=False)
-        print(f"Sharpe ratios saved to database")
-
-        # Print total processing time
-        end_time = time.time()
-        total_time_minutes = (end_time - start_time) / 60
-        minutes = int(total_time_minutes)
-        seconds = int((total_time_minutes - minutes) * 60)
-        formatted_time = f"{minutes} minutes and {seconds} seconds"
-        print(formatted_time)
+    # Optional rendering stage, reading the forecasts just stored
+    if render_plots is None:
+        render_plots = prophet_config.RENDER_PLOTS
+    if render_plots:
+        import render
+        render.main(tickers=[result['ticker'] for result in results if result['success']])
 
 if __name__ == "__main__":
-    main()
+    import cli
+    cli.run_script('predict', sys.modules[__name__])
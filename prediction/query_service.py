@@ -0,0 +1,277 @@
+# query_service.py
+# ../prediction/query_service.py
+# Read service over the forecast database: the latest finished run's forecasts and metrics held in an in-memory
+# index (top tickers by a metric, a ticker's forecast for a date, every forecast for a date), swapped in when a
+# newer run finishes, with an LRU cache of older runs and a small JSON endpoint on localhost
+
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from sqlalchemy import create_engine
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from forecast_store import ForecastStore
+from model_store import ModelStateStore
+from intervals import resolve_lazy_intervals
+
+# Metrics that can rank tickers, and whether a higher value ranks first
+RANKING_METRICS = {
+    'sharpe_ratio': True, 'sortino_ratio': True, 'hit_rate': True, 'max_drawdown': True,
+    'mae': False, 'mse': False, 'rmse': False,
+}
+
+# Function to convert a date (YYYY-MM-DD string, date or datetime) to days since the epoch
+def epoch_day(date):
+    try:
+        return int(np.datetime64(str(date)[:10], 'D').astype(np.int64))
+    except ValueError:
+        raise ValueError(f"Invalid date '{date}', expected YYYY-MM-DD")
+
+# Function to turn a float into a JSON-safe value (None for NaN)
+def json_value(value):
+    return None if value is None or value != value else float(value)
+
+# Immutable index of one run: forecast rows sorted by (ticker, ds) as arrays, each ticker's slice of rows, the rows
+# of every date and the metrics by ticker. Queries are dict lookups and binary searches, never database reads.
+class RunIndex:
+    def __init__(self, run_id, forecasts, metrics, columns):
+        forecasts = forecasts.sort_values(['ticker', 'ds'], kind='stable', ignore_index=True)
+        self.run_id = run_id
+        self.columns = [column for column in columns if column in forecasts]
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self.ticker_of_row = forecasts['ticker'].to_numpy()
+        days = forecasts['ds'].to_numpy(dtype='datetime64[D]')
+        self.days = days.astype(np.int64)
+        self.ds = np.datetime_as_string(days, unit='D')
+        # Values as objects with None for NaN, so a fancy index and tolist() give JSON-ready rows
+        self.values = {}
+        for column in self.columns:
+            values = forecasts[column].to_numpy(dtype=float)
+            self.values[column] = np.where(np.isnan(values), None, values).astype(object)
+
+        starts = np.flatnonzero(np.r_[True, self.ticker_of_row[1:] != self.ticker_of_row[:-1]]) if len(forecasts) else []
+        stops = list(starts[1:]) + [len(forecasts)]
+        self.slices = {self.ticker_of_row[start]: (int(start), int(stop)) for start, stop in zip(starts, stops)}
+        order = np.argsort(self.days, kind='stable')
+        unique_days, firsts = np.unique(self.days[order], return_index=True)
+        self.rows_by_day = dict(zip(unique_days.tolist(), np.split(order, firsts[1:])))
+
+        metric_columns = [column for column in RANKING_METRICS if column in metrics]
+        self.metrics = {row['ticker']: {column: json_value(row[column]) for column in metric_columns}
+                        for row in metrics.to_dict('records')}
+        self.rankings = {}
+
+    # Function to return one forecast row (a position in the index) as a dict
+    def row(self, index):
+        output = {'ticker': self.ticker_of_row[index], 'ds': str(self.ds[index])}
+        for column in self.columns:
+            output[column] = self.values[column][index]
+        return output
+
+    # Function to return the forecast rows of a ticker, or only its row for one date (None when not forecast)
+    def forecast(self, ticker, date=None):
+        if ticker not in self.slices:
+            raise KeyError(f"No forecast for {ticker} in run {self.run_id}")
+        start, stop = self.slices[ticker]
+        if date is None:
+            return [self.row(index) for index in range(start, stop)]
+        day = epoch_day(date)
+        index = start + int(np.searchsorted(self.days[start:stop], day))
+        return self.row(index) if index < stop and self.days[index] == day else None
+
+    # Function to return every ticker's forecast for a date as columns: {'ds', 'ticker': [...], 'yhat': [...], ...}
+    def forecasts_on(self, date):
+        rows = self.rows_by_day.get(epoch_day(date), np.empty(0, dtype=np.int64))
+        output = {'ds': str(date)[:10], 'ticker': self.ticker_of_row[rows].tolist()}
+        for column in self.columns:
+            output[column] = self.values[column][rows].tolist()
+        return output
+
+    # Function to return the n best tickers by a metric with all their metrics (rankings are sorted once per metric)
+    def top(self, n, metric='sharpe_ratio'):
+        if metric not in RANKING_METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {', '.join(RANKING_METRICS)}")
+        if n <= 0:
+            raise ValueError(f"n must be positive, got {n}")
+        if metric not in self.rankings:
+            ranked = [ticker for ticker, values in self.metrics.items() if values.get(metric) is not None]
+            ranked.sort(key=lambda ticker: self.metrics[ticker][metric], reverse=RANKING_METRICS[metric])
+            self.rankings[metric] = [dict(self.metrics[ticker], ticker=ticker) for ticker in ranked]
+        return self.rankings[metric][:n]
+
+    # Function to describe the index
+    def summary(self):
+        return {'run_id': self.run_id, 'loaded_at': self.loaded_at, 'tickers': len(self.slices), 'rows': len(self.days)}
+
+# Query service: the latest finished run is indexed in memory and replaced (built aside, then swapped) when a newer
+# run finishes; older runs are indexed on first use and kept in an LRU cache of cache_runs entries
+class ForecastQueryService:
+    def __init__(self, engine=None, cache_runs=None):
+        engine = engine or create_engine(f'sqlite:///{prophet_config.FORECAST_DATABASE_PATH}')
+        self.store = ForecastStore(engine)
+        self.state_store = ModelStateStore(engine)
+        self.cache_runs = prophet_config.QUERY_CACHE_RUNS if cache_runs is None else cache_runs
+        self.latest = None
+        self.history = OrderedDict()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.refresh()
+
+    # Function to build the index of a run; bounds left out by a lazy-interval run are computed here once
+    def build_index(self, run_id):
+        forecasts = resolve_lazy_intervals(self.store.load(run_id=run_id), self.state_store)
+        return RunIndex(run_id, forecasts, self.store.load_metrics(run_id), self.store.columns)
+
+    # Function to index the latest finished run when it is not the one being served; returns True when swapped
+    def refresh(self):
+        run_id = self.store.latest_run_id()
+        if run_id is None or (self.latest is not None and self.latest.run_id == run_id):
+            return False
+        start_time = time.perf_counter()
+        index = self.build_index(run_id)
+        previous, self.latest = self.latest, index
+        if previous is not None:
+            self.remember(previous)
+        print(f"Serving run {run_id}: {len(index.slices)} tickers, {len(index.days)} rows "
+              f"(indexed in {time.perf_counter() - start_time:.2f}s)")
+        return True
+
+    # Function to add a run's index to the LRU cache, evicting the least recently used beyond cache_runs
+    def remember(self, index):
+        with self.lock:
+            self.history[index.run_id] = index
+            self.history.move_to_end(index.run_id)
+            while len(self.history) > self.cache_runs:
+                self.history.popitem(last=False)
+
+    # Function to return the index of a run (the latest finished run by default)
+    def run(self, run_id=None):
+        latest = self.latest
+        if run_id is None or (latest is not None and run_id == latest.run_id):
+            if latest is None:
+                raise KeyError("No finished forecast run")
+            return latest
+        with self.lock:
+            if run_id in self.history:
+                self.history.move_to_end(run_id)
+                return self.history[run_id]
+        if run_id not in set(self.store.runs()['run_id']):
+            raise KeyError(f"Unknown or unfinished run {run_id}")
+        index = self.build_index(run_id)
+        self.remember(index)
+        return index
+
+    # Function to return the n best tickers of a run by a metric (Sharpe ratio by default)
+    def top(self, n=10, metric='sharpe_ratio', run_id=None):
+        return self.run(run_id).top(n, metric)
+
+    # Function to return a ticker's forecast rows, or its row for one date
+    def forecast(self, ticker, date=None, run_id=None):
+        return self.run(run_id).forecast(ticker, date)
+
+    # Function to return every ticker's forecast for a date
+    def forecasts_on(self, date, run_id=None):
+        return self.run(run_id).forecasts_on(date)
+
+    # Function to list the finished runs, newest first, marking the ones held in memory
+    def runs(self):
+        runs = self.store.runs()
+        held = set(self.history) | ({self.latest.run_id} if self.latest else set())
+        return [dict(row, cached=row['run_id'] in held) for row in runs.to_dict('records')]
+
+    # Function to start a daemon thread that swaps in newer runs every reload_seconds
+    def start_watching(self, reload_seconds=None):
+        reload_seconds = prophet_config.QUERY_RELOAD_SECONDS if reload_seconds is None else reload_seconds
+
+        def watch():
+            while not self.stop_event.wait(reload_seconds):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error reloading forecasts: {e}")
+
+        thread = threading.Thread(target=watch, name='forecast-reload', daemon=True)
+        thread.start()
+        return thread
+
+    # Function to stop the reload thread
+    def stop(self):
+        self.stop_event.set()
+
+# Function to create the HTTP handler class answering GET /top, /forecast, /date, /runs and /health from a service
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            run_id = params.get('run_id')
+            try:
+                if url.path == '/top':
+                    body = service.top(int(params.get('n', 10)), params.get('metric', 'sharpe_ratio'), run_id)
+                elif url.path == '/forecast':
+                    if 'ticker' not in params:
+                        raise ValueError("Missing parameter 'ticker'")
+                    body = service.forecast(params['ticker'], params.get('date'), run_id)
+                    if body is None:
+                        raise KeyError(f"No forecast for {params['ticker']} on {params['date']}")
+                elif url.path == '/date':
+                    if 'date' not in params:
+                        raise ValueError("Missing parameter 'date'")
+                    body = service.forecasts_on(params['date'], run_id)
+                elif url.path == '/runs':
+                    body = service.runs()
+                elif url.path == '/health':
+                    body = service.run().summary() if service.latest else {'run_id': None}
+                else:
+                    raise LookupError(f"Unknown path {url.path}")
+                self.send_json(200, body)
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+            except LookupError as e:
+                self.send_json(404, {'error': e.args[0] if e.args else str(e)})
+            except Exception as e:
+                # Database errors while indexing a run, a run pruned meanwhile, malformed rows
+                print(f"Error answering {self.path}: {e}")
+                self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+        # Function to write a JSON response
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        # Requests are not logged line by line
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+# Main function to serve the queries over HTTP on localhost until interrupted
+def main(host=None, port=None, reload_seconds=None):
+    host = host or prophet_config.QUERY_HOST
+    port = port or prophet_config.QUERY_PORT
+    service = ForecastQueryService()
+    service.start_watching(reload_seconds)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Forecast queries on http://{host}:{port} (/top, /forecast, /date, /runs, /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('serve', sys.modules[__name__])
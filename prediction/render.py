@@ -0,0 +1,125 @@
+# render.py
+# ../prediction/render.py
+# Optional rendering stage: draws forecast plots and summary charts from the stored forecasts, off the forecasting path
+
+import os
+import sys
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from price_store import open_cleaned_store
+from forecast_store import ForecastStore
+from model_store import ModelStateStore
+from intervals import resolve_lazy_intervals
+from instrumentation import RunRecorder, TaskTimings, phase
+
+# Setup and Configuration
+forecast_engine = create_engine(f'sqlite:///{prophet_config.FORECAST_DATABASE_PATH}')
+data_store = open_cleaned_store()
+forecast_store = ForecastStore(forecast_engine)
+model_state_store = ModelStateStore(forecast_engine)
+plot_images_dir = prophet_config.PLOT_IMAGES_DIR
+
+# Function to list the tickers that have a stored forecast (in the latest run for compact output)
+def forecast_tickers():
+    if prophet_config.FORECAST_OUTPUT_MODE == 'compact':
+        return forecast_store.tickers()
+    suffix = '_forecast'
+    return sorted(name[:-len(suffix)] for name in inspect(forecast_engine).get_table_names() if name.endswith(suffix))
+
+# Function to load the stored forecast of a ticker (only the horizon rows for compact output)
+# Bounds left out by a lazy-interval run are computed here, for the tickers actually rendered
+def load_forecast(ticker):
+    if prophet_config.FORECAST_OUTPUT_MODE == 'compact':
+        return resolve_lazy_intervals(forecast_store.load([ticker]), model_state_store)
+    forecast = pd.read_sql_table(f"{ticker}_forecast", con=forecast_engine)
+    forecast['ds'] = pd.to_datetime(forecast['ds'])
+    return forecast
+
+# Function to draw a forecast the way Prophet's model.plot does: history as points, yhat and its interval
+def plot_forecast(history, forecast, ticker):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(history['Date'], history['Close'], 'k.', label='Observed data points')
+    ax.plot(forecast['ds'], forecast['yhat'], ls='-', c='#0072B2', label='Forecast')
+    if 'yhat_lower' in forecast and 'yhat_upper' in forecast:
+        ax.fill_between(forecast['ds'], forecast['yhat_lower'], forecast['yhat_upper'], color='#0072B2', alpha=0.2,
+                        label='Uncertainty interval')
+    ax.grid(True, which='major', c='gray', ls='-', lw=1, alpha=0.2)
+    ax.set_title(ticker)
+    ax.set_xlabel('ds')
+    ax.set_ylabel('y')
+    fig.tight_layout()
+    return fig
+
+# Function to render and save the forecast plot of one ticker
+def render_ticker(ticker):
+    start_time = time.time()
+    timings = TaskTimings()
+    try:
+        with phase(timings, 'read') as timing:
+            history = data_store.load([ticker], columns=['Close'])
+            forecast = load_forecast(ticker)
+            timing['rows'] = len(history) + len(forecast)
+        with phase(timings, 'plot'):
+            fig = plot_forecast(history, forecast, ticker)
+            fig.savefig(os.path.join(plot_images_dir, f"{ticker}_forecast_plot.png"))
+            plt.close(fig)
+        return {'ticker': ticker, 'success': True, 'seconds': time.time() - start_time, 'timings': timings.as_dict()}
+    except Exception as e:
+        return {'ticker': ticker, 'success': False, 'error': str(e), 'seconds': time.time() - start_time,
+                'timings': timings.as_dict()}
+
+# Function to render the aggregate metrics and Sharpe ratio charts saved by the prediction run
+def render_summary():
+    import seaborn as sns
+    tables = inspect(forecast_engine).get_table_names()
+    if 'aggregate_performance_metrics' in tables:
+        aggregate_performance = pd.read_sql_table('aggregate_performance_metrics', con=forecast_engine)
+        fig, ax = plt.subplots(figsize=(8, 5))
+        sns.barplot(x=aggregate_performance['Metric'], y=aggregate_performance['Value'], ax=ax)
+        ax.set_title("Aggregate Performance Metrics")
+        ax.set_ylabel('Metric Value')
+        fig.savefig(os.path.join(plot_images_dir, "aggregate_performance_metrics.png"))
+        plt.close(fig)
+    if 'sharpe_ratios' in tables:
+        sharpe_df = pd.read_sql_table('sharpe_ratios', con=forecast_engine)
+        fig, ax = plt.subplots(figsize=(max(8, len(sharpe_df) * 0.3), 5))
+        sns.barplot(x=sharpe_df['Ticker'], y=sharpe_df['Sharpe Ratio'], ax=ax)
+        ax.set_title("Sharpe Ratios of Stocks")
+        ax.tick_params(axis='x', rotation=45)
+        fig.tight_layout()
+        fig.savefig(os.path.join(plot_images_dir, "sharpe_ratios.png"))
+        plt.close(fig)
+
+# Main function to render the selected tickers (all stored forecasts by default) on a process pool
+def main(tickers=None, max_workers=None, summary=True):
+    start_time = time.time()
+    recorder = RunRecorder('render')
+    os.makedirs(plot_images_dir, exist_ok=True)
+    tickers = tickers or forecast_tickers()
+
+    errors = []
+    with ProcessPoolExecutor(max_workers=max_workers or prophet_config.RENDER_MAX_WORKERS) as executor:
+        for result in executor.map(render_ticker, tickers, chunksize=8):
+            recorder.add_timings(result['ticker'], result['timings'])
+            if not result['success']:
+                print(f"Error rendering {result['ticker']}: {result['error']}")
+                recorder.error(result['ticker'], result['error'])
+                errors.append(result['ticker'])
+    if summary:
+        with phase(recorder, 'summary'):
+            render_summary()
+
+    print(f"Rendered {len(tickers) - len(errors)} of {len(tickers)} forecast plots in {time.time() - start_time:.1f}s "
+          f"to {plot_images_dir}")
+    recorder.finish()
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('render', sys.modules[__name__])
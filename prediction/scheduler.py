@@ -0,0 +1,91 @@
+# scheduler.py
+# ../prediction/scheduler.py
+# Persistent process pool scheduler with cost ordering, resumable checkpoints and utilization reporting
+
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Function to order tickers by expected cost, longest history first, so the largest fits never start last
+def order_by_cost(tickers, history_rows):
+    return sorted(tickers, key=lambda ticker: history_rows.get(ticker, 0), reverse=True)
+
+# Append-only JSON-lines checkpoint: a header line with the run id, then one line per finished ticker
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+
+    # Function to start a run, returning the results already recorded when resuming an unfinished run
+    def start(self, resume=False):
+        completed = {}
+        if resume and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if lines:
+                self.run_id = lines[0]['run_id']
+                completed = {line['ticker']: line for line in lines[1:]}
+        if self.run_id is None:
+            self.run_id = datetime.now().strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:6]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as f:
+                f.write(json.dumps({'run_id': self.run_id, 'started_at': datetime.now().isoformat()}) + '\n')
+        return completed
+
+    # Function to append one finished result
+    def record(self, result):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(result, default=float) + '\n')
+
+    # Function to remove the checkpoint once the run has completed
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Function to run worker_fn over the tasks on one long-lived process pool
+# Workers run `initializer` once; at most max_in_flight tasks are queued so idle workers always pull the next
+# most expensive task. A task may return one result or a list of results (one per ticker of a batched task);
+# on_result is called in the parent for every finished result.
+def run_pool(tasks, worker_fn, max_workers=None, initializer=None, on_result=None, max_in_flight=None):
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or max_workers * 2
+    pending_tasks = list(tasks)
+    results = []
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+        in_flight = set()
+        while pending_tasks or in_flight:
+            while pending_tasks and len(in_flight) < max_in_flight:
+                in_flight.add(executor.submit(worker_fn, pending_tasks.pop(0)))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_results = future.result()
+                for result in (task_results if isinstance(task_results, list) else [task_results]):
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+
+    return results, make_report(results, max_workers, time.time() - start_time)
+
+# Function to summarize the results of a pool: throughput, worker utilization and the slowest tickers
+def make_report(results, max_workers, wall_seconds):
+    busy_seconds = sum(result.get('seconds', 0.0) for result in results)
+    return {
+        'tasks': len(results),
+        'workers': max_workers,
+        'wall_seconds': round(wall_seconds, 2),
+        'busy_seconds': round(busy_seconds, 2),
+        'utilization': round(busy_seconds / (wall_seconds * max_workers), 3) if wall_seconds else 0.0,
+        'tasks_per_minute': round(len(results) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        'slowest': sorted(((r['ticker'], round(r.get('seconds', 0.0), 2)) for r in results), key=lambda x: -x[1])[:5],
+    }
+
+# Function to print a scheduler report
+def print_report(report):
+    print(f"Processed {report['tasks']} tickers on {report['workers']} workers in {report['wall_seconds']}s "
+          f"({report['tasks_per_minute']} tickers/min), worker utilization {report['utilization']:.0%}")
+    print(f"Slowest tickers: {', '.join(f'{ticker} ({seconds}s)' for ticker, seconds in report['slowest'])}")
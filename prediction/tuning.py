@@ -0,0 +1,237 @@
+# tuning.py
+# ../prediction/tuning.py
+# Hyperparameter search for Prophet per ticker or per volatility cluster: grid or successive halving over
+# walk-forward cutoffs on the process pool, with every trial memoized by (history hash, config, cutoff) and the
+# winners saved to the tuned parameter store that the forecasting path reads
+
+import os
+import sys
+import json
+import math
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import prophet_config
+from price_store import open_cleaned_store
+from scheduler import order_by_cost, run_pool, print_report
+from backtest import make_cutoffs, prophet_forecasts
+from model_store import TunedParamsStore, config_fingerprint, data_hash, tuned_config
+from math_formulas import mean_absolute_percentage_errors, pad_panel
+from instrumentation import RunRecorder
+
+# Setup and Configuration
+data_store = open_cleaned_store()
+forecast_engine = create_engine(f'sqlite:///{prophet_config.FORECAST_DATABASE_PATH}')
+tuned_params_store = TunedParamsStore(forecast_engine)
+horizon = prophet_config.BACKTEST_HORIZON
+
+# SQLite table of finished trials: the MAPE of one config at one cutoff of one history, so reruns, later halving
+# rounds and tickers with unchanged histories never refit the same trial
+class TrialStore:
+    def __init__(self, engine, table=None):
+        self.engine = engine
+        self.table = table or prophet_config.TUNING_TRIALS_TABLE
+        self.fingerprint = config_fingerprint(prophet_config.PROPHET_PARAMS, prophet_config.SEASONALITY_PARAMS)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" (history_hash TEXT NOT NULL, config_fingerprint TEXT NOT NULL, '
+                f'params TEXT NOT NULL, cutoff TEXT NOT NULL, ticker TEXT, mape REAL, seconds REAL, '
+                f'PRIMARY KEY (history_hash, config_fingerprint, params, cutoff)) WITHOUT ROWID'
+            )
+
+    # Function to return the stored MAPE of each (history_hash, cutoff) of a config, as {(history_hash, cutoff): mape}
+    def load(self, params_key, keys):
+        found = {}
+        with self.engine.connect() as conn:
+            for history_hash, cutoff in keys:
+                mape = conn.exec_driver_sql(
+                    f'SELECT mape FROM "{self.table}" WHERE history_hash = ? AND config_fingerprint = ? AND params = ? AND cutoff = ?',
+                    (history_hash, self.fingerprint, params_key, cutoff)
+                ).scalar()
+                if mape is not None:
+                    found[(history_hash, cutoff)] = mape
+        return found
+
+    # Function to save new trials: rows of (history_hash, params_key, cutoff, ticker, mape, seconds)
+    def save_many(self, rows):
+        rows = [(history_hash, self.fingerprint, params_key, cutoff, ticker, mape, seconds)
+                for history_hash, params_key, cutoff, ticker, mape, seconds in rows]
+        if rows:
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{self.table}" VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+trial_store = TrialStore(forecast_engine)
+
+# Function to list every config of the search space as a dict of overrides
+def candidate_configs(space=None):
+    space = space or prophet_config.TUNING_SPACE
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+# Function to return the key a config is stored and memoized under
+def config_key(overrides):
+    return json.dumps(overrides, sort_keys=True)
+
+# Function to estimate the fit cost of a config as its number of model terms (changepoints and Fourier columns)
+def config_cost(overrides):
+    params, seasonalities = tuned_config(overrides)
+    return params['n_changepoints'] + sum(2 * seasonality['fourier_order'] for seasonality in seasonalities)
+
+# Function to load the ds/y history of a ticker
+def load_history(ticker):
+    stock_data = data_store.load([ticker], columns=['Close']).rename(columns={'Date': 'ds', 'Close': 'y'})
+    return stock_data.dropna(subset=['y']).reset_index(drop=True)[['ds', 'y']]
+
+# Function to initialize a pool worker once: fresh database connections
+def init_worker():
+    if hasattr(data_store, 'engine'):
+        data_store.engine.dispose(close=False)
+    forecast_engine.dispose(close=False)
+
+# Function to run one trial task: a config scored on some cutoffs of a ticker (task is (ticker, overrides, cutoffs))
+# Cutoffs already memoized are read back; the others are fitted and returned as new trials for the parent to save
+def trial_task(task):
+    ticker, overrides, cutoffs = task
+    start_time = time.time()
+    try:
+        stock_data = load_history(ticker)
+        params_key = config_key(overrides)
+        ends = stock_data['ds'].searchsorted(pd.DatetimeIndex(cutoffs), side='right')
+        keys = [(data_hash(stock_data, int(end) + horizon), str(cutoff.date())) for cutoff, end in zip(cutoffs, ends)]
+        mapes = trial_store.load(params_key, keys)
+        missing = [(key, int(end)) for key, end in zip(keys, ends) if key not in mapes and 0 < end < len(stock_data)]
+        new_trials = []
+        if missing:
+            params, seasonalities = tuned_config(overrides)
+            fit_start = time.time()
+            forecasts = prophet_forecasts(stock_data, [end for _, end in missing], horizon, params, seasonalities)
+            actual = pad_panel([stock_data['y'].to_numpy(dtype=float)[end:end + horizon] for _, end in missing])
+            errors = mean_absolute_percentage_errors(actual, pad_panel(forecasts, actual.shape[1]))
+            seconds = (time.time() - fit_start) / len(missing)
+            for ((history_hash, cutoff), _), mape in zip(missing, errors):
+                mapes[(history_hash, cutoff)] = float(mape)
+                new_trials.append((history_hash, params_key, cutoff, ticker, float(mape), seconds))
+        return {'ticker': ticker, 'key': params_key, 'success': True, 'mape': float(np.mean(list(mapes.values()))),
+                'new_trials': new_trials, 'cached': len(keys) - len(missing), 'seconds': time.time() - start_time}
+    except Exception as e:
+        return {'ticker': ticker, 'key': config_key(overrides), 'success': False, 'error': str(e),
+                'seconds': time.time() - start_time}
+
+# Function to group tickers into clusters of similar daily return volatility, sampling the members trials run on
+# Returns {cluster: (members, sample)}
+def cluster_tickers(tickers, n_clusters=None, sample_size=None):
+    n_clusters = n_clusters or prophet_config.TUNING_CLUSTERS
+    sample_size = sample_size or prophet_config.TUNING_CLUSTER_SAMPLE
+    prices = data_store.load(tickers, columns=['Close'])
+    volatility = prices.groupby('ticker')['Close'].apply(lambda close: np.log(close.dropna()).diff().std())
+    labels = pd.qcut(volatility.rank(method='first'), min(n_clusters, len(volatility)), labels=False)
+    clusters = {}
+    for label, members in volatility.groupby(labels):
+        members = list(members.sort_values().index)
+        sample = [members[i] for i in np.unique(np.linspace(0, len(members) - 1, min(sample_size, len(members))).astype(int))]
+        clusters[f"cluster_{label}"] = (members, sample)
+    return clusters
+
+# Function to pick the winner among scored configs: the cheapest config whose MAPE is within tie_tolerance of the best
+def pick_winner(scores, configs, tie_tolerance=None):
+    tie_tolerance = prophet_config.TUNING_TIE_TOLERANCE if tie_tolerance is None else tie_tolerance
+    best = min(scores.values())
+    ties = [key for key, mape in scores.items() if mape <= best * (1 + tie_tolerance)]
+    return min(ties, key=lambda key: (config_cost(configs[key]), scores[key]))
+
+# Function to search the configs for every unit ({unit: sample tickers}) with grid search or successive halving
+# Every round runs the trials of all units together on one pool. Returns {unit: (winner key, mape, trials)}
+def search(units, configs, cutoffs, strategy=None, max_workers=None, recorder=None):
+    strategy = strategy or prophet_config.TUNING_STRATEGY
+    factor = prophet_config.TUNING_HALVING_FACTOR
+    max_cutoffs = max(len(ticker_cutoffs) for ticker_cutoffs in cutoffs.values())
+    n_cutoffs = max_cutoffs if strategy == 'grid' else min(prophet_config.TUNING_MIN_CUTOFFS, max_cutoffs)
+    alive = {unit: list(configs) for unit in units}
+    trials = {unit: 0 for unit in units}
+    round_number = 0
+    while True:
+        round_number += 1
+        tasks = [(ticker, configs[key], cutoffs[ticker][-n_cutoffs:])
+                 for unit, keys in alive.items() for key in keys for ticker in units[unit] if cutoffs[ticker]]
+        print(f"Round {round_number}: {sum(len(keys) for keys in alive.values())} configs on the latest {n_cutoffs} "
+              f"cutoffs, {len(tasks)} tasks")
+        results, report = run_pool(tasks, trial_task, max_workers or prophet_config.TUNING_MAX_WORKERS, init_worker)
+        print_report(report)
+
+        # Memoize the new trials (single writer) and score each config of each unit on its sample tickers
+        trial_store.save_many([trial for result in results if result['success'] for trial in result['new_trials']])
+        ticker_scores = {}
+        for result in results:
+            if recorder is not None:
+                recorder.add('trial', result['seconds'], result['ticker'], len(result.get('new_trials', [])))
+            if result['success']:
+                ticker_scores[(result['ticker'], result['key'])] = result['mape']
+            else:
+                print(f"Trial failed for {result['ticker']}: {result['error']}")
+                if recorder is not None:
+                    recorder.error(result['ticker'], result['error'], 'trial')
+        scores = {}
+        for unit, keys in alive.items():
+            trials[unit] += len(keys) * n_cutoffs * len(units[unit])
+            unit_scores = {key: np.mean([ticker_scores[(ticker, key)] for ticker in units[unit] if (ticker, key) in ticker_scores])
+                           for key in keys if any((ticker, key) in ticker_scores for ticker in units[unit])}
+            if unit_scores:
+                scores[unit] = unit_scores
+
+        if strategy == 'grid' or n_cutoffs >= max_cutoffs or all(len(keys) <= 1 for keys in alive.values()):
+            break
+        # Keep the best 1/factor of each unit's configs (cheaper first among equal scores) on more cutoffs
+        for unit, unit_scores in scores.items():
+            ranked = sorted(unit_scores, key=lambda key: (unit_scores[key], config_cost(configs[key])))
+            alive[unit] = ranked[:max(1, math.ceil(len(ranked) / factor))]
+        alive = {unit: keys for unit, keys in alive.items() if unit in scores}
+        n_cutoffs = min(n_cutoffs * factor, max_cutoffs)
+
+    winners = {}
+    for unit, unit_scores in scores.items():
+        key = pick_winner(unit_scores, configs)
+        winners[unit] = (key, unit_scores[key], trials[unit])
+    return winners
+
+# Main function to tune the tickers (all cleaned tickers by default) per ticker or per volatility cluster
+def main(tickers=None, per='ticker', strategy=None, max_workers=None):
+    recorder = RunRecorder('tuning')
+    stats = data_store.stats()
+    history_rows = dict(zip(stats['ticker'], stats['rows']))
+    tickers = order_by_cost(tickers or list(history_rows), history_rows)
+    if per == 'cluster':
+        clusters = cluster_tickers(tickers)
+        units = {cluster: sample for cluster, (_, sample) in clusters.items()}
+        members = {cluster: members for cluster, (members, _) in clusters.items()}
+    else:
+        units = {ticker: [ticker] for ticker in tickers}
+        members = {ticker: [ticker] for ticker in tickers}
+
+    stats = stats.set_index('ticker')
+    sampled = {ticker for sample in units.values() for ticker in sample}
+    cutoffs = {ticker: make_cutoffs(stats.at[ticker, 'first_date'], stats.at[ticker, 'last_date'],
+                                    prophet_config.BACKTEST_INITIAL_DAYS, prophet_config.BACKTEST_STEP_DAYS,
+                                    horizon, prophet_config.BACKTEST_YEARS) for ticker in sampled}
+    if not any(cutoffs.values()):
+        print("No ticker has enough history for a walk-forward cutoff")
+        return {}
+    configs = {config_key(overrides): overrides for overrides in candidate_configs()}
+    print(f"Tuning {len(units)} {per}s of {len(tickers)} tickers over {len(configs)} configs with "
+          f"{strategy or prophet_config.TUNING_STRATEGY}")
+
+    winners = search(units, configs, cutoffs, strategy, max_workers, recorder)
+    rows = []
+    for unit, (key, mape, trials) in winners.items():
+        print(f"{unit}: {key} (MAPE {mape:.4f}, cost {config_cost(configs[key])}, {trials} trials)")
+        rows.extend((ticker, configs[key], unit, mape, config_cost(configs[key]), trials) for ticker in members[unit])
+    tuned_params_store.save_many(rows)
+    print(f"Saved tuned configs of {len(rows)} tickers to {prophet_config.TUNED_PARAMS_TABLE}")
+    recorder.finish()
+    return winners
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('tune', sys.modules[__name__])
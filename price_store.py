@@ -0,0 +1,374 @@
+# price_store.py
+# ../price_store.py
+# Pluggable long-format price storage shared by data collection, cleaning and prediction
+
+import os
+import glob
+from abc import ABC, abstractmethod
+import pandas as pd
+from sqlalchemy import create_engine, event, inspect, text
+import config
+
+# Maximum number of tickers bound in a single SQL IN clause
+SQL_TICKER_CHUNK = 500
+
+# Function to convert a Date column (dates, datetimes or strings) to ISO 'YYYY-MM-DD' strings
+def to_iso_dates(dates):
+    return pd.to_datetime(pd.Series(dates)).dt.strftime('%Y-%m-%d').to_numpy()
+
+# Function to split a list into chunks of at most `size` items
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# Base class defining the read/write API every storage backend implements
+# Frames are long format: one row per (ticker, Date) with the store's value columns
+class PriceStore(ABC):
+    def __init__(self, columns):
+        self.columns = list(columns)
+
+    # Function to upsert a long frame; with replace=True all existing rows of the frame's tickers are dropped first
+    @abstractmethod
+    def write(self, data, replace=False):
+        raise NotImplementedError
+
+    # Function to load rows for the given tickers (all when None) between start and end dates inclusive
+    @abstractmethod
+    def load(self, tickers=None, start=None, end=None, columns=None):
+        raise NotImplementedError
+
+    # Function to yield the rows of one ticker from start onward, ordered by Date, in frames of at most
+    # chunk_rows rows (Date and the requested columns); backends without a paged read slice one full load
+    def iter_chunks(self, ticker, start=None, columns=None, chunk_rows=None):
+        chunk_rows = chunk_rows or config.CLEANING_CHUNK_ROWS
+        data = self.load([ticker], start=start, columns=columns).drop(columns=['ticker'])
+        for i in range(0, len(data), chunk_rows):
+            yield data.iloc[i:i + chunk_rows]
+
+    # Function to list the tickers held in the store
+    @abstractmethod
+    def tickers(self):
+        raise NotImplementedError
+
+    # Function to return per-ticker first_date, last_date and rows as a DataFrame (for the given tickers, all when None)
+    @abstractmethod
+    def stats(self, tickers=None):
+        raise NotImplementedError
+
+    # Function to remove all rows of the given tickers
+    @abstractmethod
+    def delete(self, tickers):
+        raise NotImplementedError
+
+    # Function to find interior gaps longer than min_gap_days between consecutive stored dates
+    # Returns ticker, gap_start (first missing day) and gap_end (next stored day, exclusive)
+    def gaps(self, min_gap_days):
+        dates = self.load(columns=[])
+        dates['prev_date'] = dates.groupby('ticker')['Date'].shift()
+        gaps = dates[(dates['Date'] - dates['prev_date']).dt.days > min_gap_days]
+        return pd.DataFrame({
+            'ticker': gaps['ticker'].to_numpy(),
+            'gap_start': (gaps['prev_date'] + pd.Timedelta(days=1)).to_numpy(),
+            'gap_end': gaps['Date'].to_numpy(),
+        })
+
+    # Function to build the long frame for one ticker from a Date-indexed or Date-column frame
+    def frame_for_ticker(self, ticker, data):
+        data = data.reset_index() if 'Date' not in data.columns else data
+        frame = data[['Date'] + [c for c in self.columns if c in data.columns]].copy()
+        frame.insert(0, 'ticker', ticker)
+        return frame
+
+    # Function to select and order the output columns of a load call
+    def _output_columns(self, columns):
+        columns = self.columns if columns is None else [c for c in columns if c not in ('ticker', 'Date')]
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError(f"Unknown columns requested: {sorted(unknown)}")
+        return columns
+
+    # Function to return an empty long frame with the expected columns
+    def _empty(self, columns):
+        frame = pd.DataFrame({'ticker': pd.Series(dtype=object), 'Date': pd.Series(dtype='datetime64[ns]')})
+        for column in columns:
+            frame[column] = pd.Series(dtype=float)
+        return frame
+
+# SQLite backend: a single long table keyed by (ticker, Date) with a secondary Date index for cross-sections
+class SQLitePriceStore(PriceStore):
+    def __init__(self, path, columns, table='prices'):
+        super().__init__(columns)
+        self.path = path
+        self.table = table
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': config.SQLITE_BUSY_TIMEOUT_SECONDS})
+        if config.SQLITE_WAL_MODE:
+            event.listen(self.engine, 'connect', self._set_wal_mode)
+        self._create_table()
+
+    # Function to switch each new connection to WAL journaling with relaxed (but crash-safe) syncing
+    @staticmethod
+    def _set_wal_mode(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    # Function to create the long table and its indexes if they do not exist yet
+    def _create_table(self):
+        column_defs = ', '.join(f'"{c}" {"INTEGER" if c == "Volume" else "REAL"}' for c in self.columns)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" '
+                f'(ticker TEXT NOT NULL, Date TEXT NOT NULL, {column_defs}, PRIMARY KEY (ticker, Date)) WITHOUT ROWID'
+            )
+            conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "ix_{self.table}_date" ON "{self.table}" (Date)')
+
+    # Function to convert a long frame into parameter tuples for executemany (SQLite binds NaN as NULL)
+    def _rows(self, data):
+        columns = [data['ticker'].tolist(), to_iso_dates(data['Date']).tolist()]
+        columns += [data[c].tolist() for c in self.columns]
+        return list(zip(*columns))
+
+    def write(self, data, replace=False):
+        if data.empty:
+            return 0
+        rows = self._rows(data)
+        placeholders = ', '.join('?' for _ in range(len(self.columns) + 2))
+        quoted = ', '.join(f'"{c}"' for c in ['ticker', 'Date'] + self.columns)
+        with self.engine.begin() as conn:
+            if replace:
+                for chunk in chunked(data['ticker'].unique(), SQL_TICKER_CHUNK):
+                    conn.exec_driver_sql(
+                        f'DELETE FROM "{self.table}" WHERE ticker IN ({", ".join("?" for _ in chunk)})', tuple(chunk)
+                    )
+            conn.exec_driver_sql(f'INSERT OR REPLACE INTO "{self.table}" ({quoted}) VALUES ({placeholders})', rows)
+        return len(rows)
+
+    # Function to build the WHERE clause and bound parameters for a ticker list and date range
+    def _where(self, tickers, start, end):
+        clauses, params = [], {}
+        if tickers is not None:
+            names = [f't{i}' for i in range(len(tickers))]
+            clauses.append(f'ticker IN ({", ".join(":" + n for n in names)})')
+            params.update(zip(names, tickers))
+        if start is not None:
+            clauses.append('Date >= :start')
+            params['start'] = to_iso_dates([start])[0]
+        if end is not None:
+            clauses.append('Date <= :end')
+            params['end'] = to_iso_dates([end])[0]
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def load(self, tickers=None, start=None, end=None, columns=None):
+        columns = self._output_columns(columns)
+        quoted = ', '.join(f'"{c}"' for c in ['ticker', 'Date'] + columns)
+        ticker_chunks = [None] if tickers is None else chunked(tickers, SQL_TICKER_CHUNK)
+        frames = []
+        with self.engine.connect() as conn:
+            for chunk in ticker_chunks:
+                where, params = self._where(chunk, start, end)
+                query = f'SELECT {quoted} FROM "{self.table}"{where} ORDER BY ticker, Date'
+                frames.append(pd.read_sql_query(text(query), conn, params=params))
+        if not frames:
+            return self._empty(columns)
+        data = pd.concat(frames, ignore_index=True)
+        data['Date'] = pd.to_datetime(data['Date'], format='%Y-%m-%d')
+        return data
+
+    # Keyset pagination over the (ticker, Date) primary key, so each page is an index range scan
+    def iter_chunks(self, ticker, start=None, columns=None, chunk_rows=None):
+        chunk_rows = chunk_rows or config.CLEANING_CHUNK_ROWS
+        quoted = ', '.join(f'"{c}"' for c in ['Date'] + self._output_columns(columns))
+        params = {'ticker': ticker, 'limit': chunk_rows}
+        condition = ''
+        if start is not None:
+            condition, params['after'] = ' AND Date >= :after', to_iso_dates([start])[0]
+        with self.engine.connect() as conn:
+            while True:
+                query = f'SELECT {quoted} FROM "{self.table}" WHERE ticker = :ticker{condition} ORDER BY Date LIMIT :limit'
+                frame = pd.read_sql_query(text(query), conn, params=params)
+                if frame.empty:
+                    return
+                condition, params['after'] = ' AND Date > :after', frame['Date'].iat[-1]
+                frame['Date'] = pd.to_datetime(frame['Date'], format='%Y-%m-%d')
+                yield frame
+                if len(frame) < chunk_rows:
+                    return
+
+    def tickers(self):
+        with self.engine.connect() as conn:
+            return [row[0] for row in conn.exec_driver_sql(f'SELECT DISTINCT ticker FROM "{self.table}" ORDER BY ticker')]
+
+    def stats(self, tickers=None):
+        ticker_chunks = [None] if tickers is None else chunked(tickers, SQL_TICKER_CHUNK)
+        frames = []
+        with self.engine.connect() as conn:
+            for chunk in ticker_chunks:
+                where, params = self._where(chunk, None, None)
+                query = (f'SELECT ticker, MIN(Date) AS first_date, MAX(Date) AS last_date, COUNT(*) AS rows '
+                         f'FROM "{self.table}"{where} GROUP BY ticker ORDER BY ticker')
+                frames.append(pd.read_sql_query(text(query), conn, params=params))
+        stats = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ticker', 'first_date', 'last_date', 'rows'])
+        stats['first_date'] = pd.to_datetime(stats['first_date'], format='%Y-%m-%d')
+        stats['last_date'] = pd.to_datetime(stats['last_date'], format='%Y-%m-%d')
+        return stats
+
+    def gaps(self, min_gap_days):
+        query = (f'SELECT ticker, prev_date, Date FROM ('
+                 f'SELECT ticker, Date, LAG(Date) OVER (PARTITION BY ticker ORDER BY Date) AS prev_date FROM "{self.table}"'
+                 f') WHERE prev_date IS NOT NULL AND julianday(Date) - julianday(prev_date) > :min_gap_days')
+        with self.engine.connect() as conn:
+            gaps = pd.read_sql_query(text(query), conn, params={'min_gap_days': min_gap_days})
+        return pd.DataFrame({
+            'ticker': gaps['ticker'],
+            'gap_start': pd.to_datetime(gaps['prev_date'], format='%Y-%m-%d') + pd.Timedelta(days=1),
+            'gap_end': pd.to_datetime(gaps['Date'], format='%Y-%m-%d'),
+        })
+
+    def delete(self, tickers):
+        with self.engine.begin() as conn:
+            for chunk in chunked(tickers, SQL_TICKER_CHUNK):
+                conn.exec_driver_sql(
+                    f'DELETE FROM "{self.table}" WHERE ticker IN ({", ".join("?" for _ in chunk)})', tuple(chunk)
+                )
+
+# Parquet backend: one Arrow/Parquet file per ticker partition (ticker=XYZ/data.parquet) under a root directory
+class ParquetPriceStore(PriceStore):
+    def __init__(self, path, columns):
+        super().__init__(columns)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The parquet storage backend requires pyarrow (pip install pyarrow)") from e
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    # Function to return the partition file of a ticker
+    def _partition(self, ticker):
+        return os.path.join(self.path, f"ticker={ticker}", "data.parquet")
+
+    # Function to read one ticker partition with Date as datetime64
+    def _read(self, ticker, columns=None):
+        frame = pd.read_parquet(self._partition(ticker), columns=None if columns is None else ['Date'] + columns)
+        frame['Date'] = pd.to_datetime(frame['Date'])
+        return frame
+
+    def write(self, data, replace=False):
+        if data.empty:
+            return 0
+        data = data[['ticker', 'Date'] + self.columns].copy()
+        data['Date'] = pd.to_datetime(data['Date'])
+        for ticker, frame in data.groupby('ticker', sort=False):
+            partition = self._partition(ticker)
+            frame = frame.drop(columns=['ticker'])
+            if not replace and os.path.exists(partition):
+                frame = pd.concat([self._read(ticker), frame], ignore_index=True)
+            frame = frame.drop_duplicates('Date', keep='last').sort_values('Date')
+            frame['Date'] = frame['Date'].dt.date
+            os.makedirs(os.path.dirname(partition), exist_ok=True)
+            frame.to_parquet(partition, index=False)
+        return len(data)
+
+    def load(self, tickers=None, start=None, end=None, columns=None):
+        columns = self._output_columns(columns)
+        frames = []
+        for ticker in (self.tickers() if tickers is None else tickers):
+            if not os.path.exists(self._partition(ticker)):
+                continue
+            frame = self._read(ticker, columns)
+            if start is not None:
+                frame = frame[frame['Date'] >= pd.Timestamp(start)]
+            if end is not None:
+                frame = frame[frame['Date'] <= pd.Timestamp(end)]
+            frame.insert(0, 'ticker', ticker)
+            frames.append(frame)
+        if not frames:
+            return self._empty(columns)
+        return pd.concat(frames, ignore_index=True)[['ticker', 'Date'] + columns]
+
+    def tickers(self):
+        partitions = glob.glob(os.path.join(self.path, "ticker=*", "data.parquet"))
+        return sorted(os.path.basename(os.path.dirname(p))[len("ticker="):] for p in partitions)
+
+    def stats(self, tickers=None):
+        records = []
+        existing = self.tickers()
+        for ticker in (existing if tickers is None else sorted(set(tickers) & set(existing))):
+            dates = self._read(ticker, [])['Date']
+            records.append({'ticker': ticker, 'first_date': dates.min(), 'last_date': dates.max(), 'rows': len(dates)})
+        return pd.DataFrame(records, columns=['ticker', 'first_date', 'last_date', 'rows'])
+
+    def delete(self, tickers):
+        for ticker in tickers:
+            if os.path.exists(self._partition(ticker)):
+                os.remove(self._partition(ticker))
+
+# Legacy backend: one SQLite table per ticker, as written by earlier versions of the pipeline
+# Kept so existing databases can be read and migrated with migrate_price_store.py
+class TablePerTickerStore(PriceStore):
+    def __init__(self, path, columns, exclude=('prices',)):
+        super().__init__(columns)
+        self.path = path
+        self.exclude = set(exclude)
+        self.engine = create_engine(f'sqlite:///{path}')
+
+    def write(self, data, replace=False):
+        for ticker, frame in data.groupby('ticker', sort=False):
+            frame = frame.drop(columns=['ticker']).copy()
+            frame['Date'] = pd.to_datetime(frame['Date']).dt.date
+            frame.to_sql(ticker, con=self.engine, if_exists='replace' if replace else 'append', index=False)
+        return len(data)
+
+    def load(self, tickers=None, start=None, end=None, columns=None):
+        columns = self._output_columns(columns)
+        frames = []
+        existing = set(self.tickers())
+        for ticker in (sorted(existing) if tickers is None else tickers):
+            if ticker not in existing:
+                continue
+            frame = pd.read_sql_table(ticker, con=self.engine, parse_dates=['Date'], columns=['Date'] + columns)
+            if start is not None:
+                frame = frame[frame['Date'] >= pd.Timestamp(start)]
+            if end is not None:
+                frame = frame[frame['Date'] <= pd.Timestamp(end)]
+            frame.insert(0, 'ticker', ticker)
+            frames.append(frame.sort_values('Date'))
+        if not frames:
+            return self._empty(columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def tickers(self):
+        return [name for name in inspect(self.engine).get_table_names() if name not in self.exclude]
+
+    def stats(self, tickers=None):
+        records = []
+        existing = self.tickers()
+        with self.engine.connect() as conn:
+            for ticker in (existing if tickers is None else sorted(set(tickers) & set(existing))):
+                first, last, rows = conn.exec_driver_sql(f'SELECT MIN(Date), MAX(Date), COUNT(*) FROM "{ticker}"').one()
+                records.append({'ticker': ticker, 'first_date': pd.to_datetime(first), 'last_date': pd.to_datetime(last), 'rows': rows})
+        return pd.DataFrame(records, columns=['ticker', 'first_date', 'last_date', 'rows'])
+
+    def delete(self, tickers):
+        with self.engine.begin() as conn:
+            for ticker in tickers:
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{ticker}"')
+
+# Function to open a price store for the configured (or given) backend
+def open_store(database_path, parquet_path, columns, backend=None):
+    backend = backend or config.STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLitePriceStore(database_path, columns, table=config.PRICE_TABLE)
+    if backend == 'parquet':
+        return ParquetPriceStore(parquet_path, columns)
+    if backend == 'tables':
+        return TablePerTickerStore(database_path, columns, exclude=(config.PRICE_TABLE,))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+# Function to open the raw OHLCV store written by data collection
+def open_raw_store(backend=None):
+    return open_store(config.RAW_DATABASE_PATH, config.RAW_PARQUET_PATH, config.RAW_COLUMNS, backend)
+
+# Function to open the cleaned Close store written by data cleaning
+def open_cleaned_store(backend=None):
+    return open_store(config.CLEANED_DATABASE_PATH, config.CLEANED_PARQUET_PATH, config.CLEANED_COLUMNS, backend)
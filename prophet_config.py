@@ -2,13 +2,13 @@
 # ../prophet_config.py
 # Configuration file for Prophet forecasting parameters
 
-import pandas as pd
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from dateutil.easter import easter
+import os
+import functools
 
 # Paths to databases
-CLEANED_DATABASE_PATH = "../data/cleaned_stock_data.db"
-FORECAST_DATABASE_PATH = "../data/forecast_stock_data.db"
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CLEANED_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "cleaned_stock_data.db")
+FORECAST_DATABASE_PATH = os.path.join(PROJECT_ROOT, "data", "forecast_stock_data.db")
 
 # Prophet configuration parameters
 PROPHET_PARAMS = {
@@ -23,10 +23,16 @@ PROPHET_PARAMS = {
     'weekly_seasonality': False,  # Whether to include weekly seasonality
     'yearly_seasonality': False,  # Whether to include yearly seasonality
     'interval_width': 0.90,  # Width of the uncertainty intervals
-    'uncertainty_samples': 1000,  # Number of simulated draws for uncertainty intervals
+    'uncertainty_samples': 1000,  # Number of simulated draws for uncertainty intervals (see INTERVAL_MODE)
     'mcmc_samples': 0  # Number of MCMC samples to draw
 }
 
+# Intervals of Prophet forecasts: 'sampled' (uncertainty_samples draws over history and horizon), 'horizon_only'
+# (the draws over the horizon rows only; history rows get no bounds), 'analytic' (closed form from the fitted noise
+# and changepoint scale, no draws) or 'lazy' (no bounds stored; computed in closed form from the stored model state
+# when a ticker's forecast is read). Ridge forecasts always use their residual-based bounds.
+INTERVAL_MODE = 'sampled'
+
 # Seasonality configuration
 SEASONALITY_PARAMS = [
     {"name": "monthly", "period": 30.5, "fourier_order": 12},  # Monthly seasonality
@@ -35,34 +41,123 @@ SEASONALITY_PARAMS = [
     {"name": "yearly", "period": 365.25, "fourier_order": 20}  # Yearly seasonality
 ]
 
+# Warm-started refits: reuse each ticker's last fitted parameters as the optimizer's starting point
+WARM_START = True
+WARM_START_FULL_REFIT_DAYS = 30  # Force a full refit when the last one is older than this
+WARM_START_MAX_NEW_ROWS_FRACTION = 0.05  # ... or when more than this share of the history is new since the last fit
+MODEL_STATE_TABLE = 'model_state'
+
+# Hyperparameter tuning (prediction/tuning.py): overrides of PROPHET_PARAMS searched per ticker or per cluster of
+# tickers with similar volatility ('fourier_scale' multiplies every seasonality's fourier_order). 'halving' starts
+# every config on the latest TUNING_MIN_CUTOFFS walk-forward cutoffs and keeps the best 1/TUNING_HALVING_FACTOR on
+# TUNING_HALVING_FACTOR times more cutoffs each round; 'grid' scores every config on every cutoff. Configs within
+# TUNING_TIE_TOLERANCE (relative MAPE) of the best count as ties and the cheapest (fewest model terms) wins.
+TUNING_SPACE = {
+    'changepoint_prior_scale': [0.01, 0.05, 0.2, 0.5],
+    'seasonality_prior_scale': [1.0, 15.0],
+    'fourier_scale': [0.25, 0.5, 1.0],
+}
+TUNING_STRATEGY = 'halving'
+TUNING_HALVING_FACTOR = 3
+TUNING_MIN_CUTOFFS = 1
+TUNING_TIE_TOLERANCE = 0.01
+TUNING_CLUSTERS = 5  # Volatility clusters when tuning per cluster
+TUNING_CLUSTER_SAMPLE = 5  # Tickers of a cluster the trials are run on
+TUNING_MAX_WORKERS = None
+TUNED_PARAMS_TABLE = 'tuned_params'
+TUNING_TRIALS_TABLE = 'tuning_trials'
+USE_TUNED_PARAMS = True  # Prophet forecasts use each ticker's tuned config when one is stored
+
+# Prediction scheduling: worker processes (None uses every core), checkpoint for resumable runs and
+# how many finished tickers are evaluated, saved and checkpointed together in the parent
+PREDICTION_MAX_WORKERS = None
+PREDICTION_CHECKPOINT_FILE = os.path.join(PROJECT_ROOT, "logs", "3_prediction_checkpoint.jsonl")
+RESULT_BATCH_SIZE = 50
+
+# Forecast output: 'compact' stores only the horizon rows and FORECAST_COLUMNS in one shared table keyed by
+# (ticker, run_id, ds); 'full' keeps the original complete Prophet frame in one {ticker}_forecast table per ticker
+FORECAST_OUTPUT_MODE = 'compact'
+FORECAST_COLUMNS = ['yhat', 'yhat_lower', 'yhat_upper']
+FORECAST_TABLE = 'forecasts'
+FORECAST_RUNS_TABLE = 'forecast_runs'
+FORECAST_METRICS_TABLE = 'forecast_metrics'
+FORECAST_KEEP_RUNS = 10
+
+# Forecast query service (prediction/query_service.py): the latest finished run is held in memory and swapped when
+# a newer run finishes (checked every QUERY_RELOAD_SECONDS); up to QUERY_CACHE_RUNS older runs stay cached (LRU)
+QUERY_HOST = '127.0.0.1'
+QUERY_PORT = 8765
+QUERY_RELOAD_SECONDS = 5.0
+QUERY_CACHE_RUNS = 4
+
+# Plot rendering is a separate, opt-in stage (prediction/render.py or prediction.py --plots)
+RENDER_PLOTS = False
+RENDER_MAX_WORKERS = None
+PLOT_IMAGES_DIR = os.path.join(PROJECT_ROOT, "data", "plot_images")
+
 # Forecast horizon
 FORECAST_HORIZON = 60  # days
 
+# Walk-forward backtest (prediction/backtest.py): cutoffs every BACKTEST_STEP_DAYS over the last BACKTEST_YEARS,
+# each forecasting BACKTEST_HORIZON days after at least BACKTEST_INITIAL_DAYS of training
+BACKTEST_ENGINE = 'ridge'  # 'ridge' (closed form on the Prophet-like design matrix) or 'prophet'
+BACKTEST_HORIZON = FORECAST_HORIZON
+BACKTEST_STEP_DAYS = 20
+BACKTEST_INITIAL_DAYS = 730
+BACKTEST_YEARS = 3
+BACKTEST_MAX_WORKERS = None
+BACKTEST_TABLE = 'backtest_summary'
+
+# Ridge penalty multiplier: each coefficient is penalized by RIDGE_ALPHA / prior_scale**2 of its component,
+# the closed-form counterpart of Prophet's priors; RIDGE_ALPHA is the residual variance relative to the price level
+# (1e-4 is about 1% noise)
+RIDGE_ALPHA = 1e-4
+
+# Calendar feature cache: seasonality and holiday columns built once per configuration and date range and
+# shared by all tickers and worker processes as memory-mapped .npy files
+FEATURE_CACHE = True
+FEATURE_CACHE_DIR = os.path.join(PROJECT_ROOT, "data", "feature_cache")
+
+# Forecasting model of a run (prediction.py --model): 'prophet', 'ridge' (closed form, solved in batches of
+# RIDGE_BATCH_SIZE tickers sharing a calendar) or 'auto' (ridge, and Prophet for the tickers whose latest
+# backtests show an out-of-sample MAPE at least AUTO_MODEL_MIN_IMPROVEMENT lower than ridge)
+FORECAST_MODEL = 'prophet'
+RIDGE_BATCH_SIZE = 200
+AUTO_MODEL_MIN_IMPROVEMENT = 0.10
+
 # Risk-free rate
 RISK_FREE_RATE_ANNUAL = 0.0525
 RISK_FREE_RATE_DAILY = RISK_FREE_RATE_ANNUAL / 252
 
-# Generate holidays
-calendar = USFederalHolidayCalendar()
-holidays = calendar.holidays(start='2018-01-01', end='2024-02-28')
-good_fridays = pd.to_datetime([easter(y) for y in range(2017, 2024)]) - pd.Timedelta(days=2)
-holidays_df = pd.DataFrame({
-    'holiday': 'US_public_holiday',
-    'ds': pd.to_datetime(holidays),
-    'lower_window': 0,
-    'upper_window': 1,
-})
-good_friday_df = pd.DataFrame({
-    'holiday': 'Good_Friday',
-    'ds': good_fridays,
-    'lower_window': 0,
-    'upper_window': 1,
-})
-COVID = pd.DataFrame({
-    'holiday': 'COVID',
-    'ds': pd.to_datetime(['2020-03-15']),
-    'lower_window': -15,
-    'upper_window': 15,
-})
-holidays_df = pd.concat([holidays_df, good_friday_df, COVID], ignore_index=True)
-PROPHET_PARAMS['holidays'] = holidays_df
+# Holidays of the Prophet and ridge models: every US federal holiday and Good Friday (each with the day after) in the
+# years of the data being fitted, plus fixed events. The dates are only generated when a model is built, for the
+# range it covers (holidays() below), so importing this module stays cheap.
+HOLIDAY_WINDOWS = {'US_public_holiday': (0, 1), 'Good_Friday': (0, 1)}
+FIXED_HOLIDAYS = [
+    {'holiday': 'COVID', 'ds': '2020-03-15', 'lower_window': -15, 'upper_window': 15},
+]
+
+# Function to build the holiday frame of whole years (cached, one per year range)
+@functools.lru_cache(maxsize=32)
+def holiday_frame(first_year, last_year):
+    import pandas as pd
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    from dateutil.easter import easter
+    dates = {
+        'US_public_holiday': USFederalHolidayCalendar().holidays(start=f'{first_year}-01-01', end=f'{last_year}-12-31'),
+        'Good_Friday': pd.to_datetime([easter(year) for year in range(first_year, last_year + 1)]) - pd.Timedelta(days=2),
+    }
+    frames = [pd.DataFrame({'holiday': name, 'ds': pd.DatetimeIndex(dates[name]), 'lower_window': lower, 'upper_window': upper})
+              for name, (lower, upper) in HOLIDAY_WINDOWS.items()]
+    fixed = pd.DataFrame(FIXED_HOLIDAYS)
+    fixed['ds'] = pd.to_datetime(fixed['ds'])
+    return pd.concat(frames + [fixed], ignore_index=True)
+
+# Function to return the holiday frame covering the dates from start to end (Prophet's `holidays` parameter)
+def holidays(start, end):
+    import pandas as pd
+    return holiday_frame(pd.Timestamp(start).year, pd.Timestamp(end).year).copy()
+
+# Function to return Prophet parameters (PROPHET_PARAMS by default) with the holidays of the dates from start to end
+def with_holidays(prophet_params, start, end):
+    return dict(PROPHET_PARAMS if prophet_params is None else prophet_params, holidays=holidays(start, end))
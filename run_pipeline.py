@@ -1,35 +1,316 @@
 # run_pipeline.py
 # ../run_pipeline.py
-# Script to run the entire data pipeline: collection, cleaning, and prediction
+# Script to run the entire data pipeline in one process: collection, cleaning and prediction as a DAG of
+# per-ticker tasks, each ticker moving to the next stage as soon as the previous one has finished with it
 
-import subprocess
 import os
+import sys
+import time
+import queue
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+for stage_directory in ['data_collection', 'data_cleaning', 'prediction']:
+    sys.path.append(os.path.join(PROJECT_ROOT, stage_directory))
+import config
+import prophet_config
+import data_collection
+import data_cleaning
+import prediction
+from utils import plan_fetch_windows, prepare_for_db, read_known_gaps, read_empty_tickers
+from providers import get_provider
+from fetcher import collect
+from bulk_writer import BulkWriter
+from feature_cache import prepare_calendar
+from scheduler import make_report
+from instrumentation import RunRecorder
 
-# Function to run a script and handle errors
-def run_script(script_path, script_dir):
-    try:
-        subprocess.run(['python', script_path], cwd=script_dir, check=True)
-        print(f"Successfully ran {script_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running {script_path}: {e}")
-
-# Ensure plot_images directory exists
-plot_images_dir = os.path.expanduser("../data/plot_images")
-if not os.path.exists(plot_images_dir):
-    os.makedirs(plot_images_dir)
-
-# Paths to the scripts and their directories
-data_collection_script = 'data_collection.py'
-data_cleaning_script = 'data_cleaning.py'
-prediction_script = 'prediction.py'
-
-data_collection_dir = os.path.join('data_collection')
-data_cleaning_dir = os.path.join('data_cleaning')
-prediction_dir = os.path.join('prediction')
-
-# Run the scripts sequentially
-run_script(data_collection_script, data_collection_dir)
-run_script(data_cleaning_script, data_cleaning_dir)
-run_script(prediction_script, prediction_dir)
-
-print("Data pipeline execution complete.")
+STAGES = ['collect', 'clean', 'predict']
+
+# Readiness of tickers during collection: a ticker is ready for cleaning once every planned window of it has
+# been fetched and every frame it produced has been committed by the writer; a failure in either marks it failed
+class CollectionTracker:
+    def __init__(self, tickers, windows, on_ready):
+        self.lock = threading.Lock()
+        self.on_ready = on_ready
+        self.windows_left = {ticker: 0 for ticker in tickers}
+        for window_tickers in windows.values():
+            for ticker in window_tickers:
+                self.windows_left[ticker] += 1
+        self.frames_pending = {ticker: 0 for ticker in tickers}
+        self.failed = set()
+        self.released = set()
+
+    # Function to count a frame before it is handed to the writer
+    def frame_queued(self, frame):
+        if not frame.empty:
+            with self.lock:
+                self.frames_pending[frame['ticker'].iat[0]] += 1
+        return frame
+
+    # Writer callback: the frames of these tickers were committed (or lost) in one batch
+    def frames_written(self, tickers, success):
+        with self.lock:
+            for ticker in tickers:
+                self.frames_pending[ticker] -= 1
+                if not success:
+                    self.failed.add(ticker)
+            self.release(set(tickers))
+
+    # Fetcher callback: one window of these tickers was fetched (failed ones could not be fetched or saved)
+    def batch_done(self, tickers, failed):
+        with self.lock:
+            self.failed.update(failed)
+            for ticker in tickers:
+                self.windows_left[ticker] -= 1
+            self.release(tickers)
+
+    # Function to release every ticker not released yet, once collection has ended
+    def release_all(self, error=None):
+        with self.lock:
+            for ticker in self.windows_left:
+                if ticker not in self.released:
+                    self.windows_left[ticker] = self.frames_pending[ticker] = 0
+                    if error:
+                        self.failed.add(ticker)
+            self.release(list(self.windows_left), error)
+
+    # Function to pass the tickers with nothing left in flight downstream (call with the lock held,
+    # or before fetching starts to release the tickers that have no window to fetch)
+    def release(self, tickers, error=None):
+        for ticker in tickers:
+            if ticker not in self.released and self.windows_left[ticker] == 0 and self.frames_pending[ticker] == 0:
+                self.released.add(ticker)
+                ok = ticker not in self.failed
+                self.on_ready(ticker, ok, None if ok else (error or 'could not fetch or store data'))
+
+# In-process pipeline: collection threads and the raw writer feed a cleaning thread pool, which feeds one
+# persistent prediction process pool; a main loop moves each ticker along as stage results arrive on a queue
+class Pipeline:
+    def __init__(self, stages, tickers, model=None, max_workers=None, full_refresh=False):
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.tickers = tickers
+        self.events = queue.Queue()
+        self.failures = {}
+        self.counts = {stage: 0 for stage in self.stages}
+        self.skipped = 0
+        self.in_flight = 0
+        self.cleaning_in_flight = 0
+        self.source_done = False
+
+        self.recorders = {stage: RunRecorder(stage_name) for stage, stage_name in
+                          [('collect', 'collection'), ('clean', 'cleaning')] if stage in self.stages}
+        if 'clean' in self.stages:
+            incremental = config.CLEANING_MODE == 'incremental' and not full_refresh
+            self.watermarks = data_cleaning.read_watermarks(data_cleaning.watermark_file) if incremental else {}
+            self.new_watermarks = {}
+        if 'predict' in self.stages:
+            self.models = prediction.select_models(tickers, model)
+            self.ridge_batch = []
+            self.prediction_results = []
+            self.max_workers = max_workers or prophet_config.PREDICTION_MAX_WORKERS or os.cpu_count() or 1
+
+    # Function to return the selected stage after `stage` (None when the ticker is finished)
+    def next_stage(self, stage):
+        position = self.stages.index(stage) if stage in self.stages else -1
+        return self.stages[position + 1] if position + 1 < len(self.stages) else None
+
+    # Function to run the pipeline over the tickers, returning the failures as {ticker: (stage, error)}
+    def run(self, provider=None):
+        start_time = time.time()
+        print(f"Running stages {', '.join(self.stages)} for {len(self.tickers)} tickers")
+        with ThreadPoolExecutor(max_workers=config.PIPELINE_CLEANING_WORKERS) as self.cleaning_pool, \
+                self.open_prediction_pool() as self.prediction_pool:
+            if 'collect' in self.stages:
+                threading.Thread(target=self.collect, args=(provider,), name='collection', daemon=True).start()
+            else:
+                for ticker in self.tickers:
+                    self.events.put(('source', ticker, True, None))
+                self.events.put(('source_done',))
+
+            while not (self.source_done and self.in_flight == 0):
+                event = self.events.get()
+                if event[0] == 'source_done':
+                    self.source_done = True
+                elif event[0] == 'source':
+                    self.on_stage_done(self.stages[0] if 'collect' in self.stages else None, *event[1:])
+                elif event[0] == 'clean':
+                    self.in_flight -= 1
+                    self.cleaning_in_flight -= 1
+                    self.on_cleaned(event[1])
+                elif event[0] == 'predict':
+                    self.in_flight -= 1
+                    for result in event[1]:
+                        self.on_predicted(result)
+                # Once nothing more can come out of cleaning, forecast the last partial ridge batch
+                if self.source_done and self.cleaning_in_flight == 0 and 'predict' in self.stages and self.ridge_batch:
+                    self.submit_prediction('ridge', self.ridge_batch)
+                    self.ridge_batch = []
+
+        self.finish(time.time() - start_time)
+        return self.failures
+
+    # Function to open the prediction pool (spawned workers, so no thread state is forked), or nothing to enter
+    def open_prediction_pool(self):
+        if 'predict' not in self.stages:
+            return contextlib.nullcontext()
+        self.prediction_run = prediction.PredictionRun()
+        ridge_tickers = [ticker for ticker, name in self.models.items() if name == 'ridge']
+        if ridge_tickers:
+            prepare_calendar([data_cleaning.start_date.tz_localize(None)],
+                             [data_cleaning.current_end_date().tz_localize(None)], prophet_config.FORECAST_HORIZON)
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=prediction.init_worker, initargs=('prophet' in self.models.values(),))
+
+    # Collection thread: fetch the missing windows, streaming each ticker downstream once it is stored
+    def collect(self, provider):
+        tracker = CollectionTracker(self.tickers, {}, self.emit_source)
+        try:
+            provider = provider or get_provider()
+            known_gaps = read_known_gaps(data_collection.gaps_file)
+            empty_tickers = read_empty_tickers(data_collection.empty_tickers_file)
+            windows = plan_fetch_windows(self.tickers, data_collection.store, config.END_DATE, known_gaps, empty_tickers)
+            print(f"{sum(len(tickers) for tickers in windows.values())} fetches across {len(windows)} date windows "
+                  f"using the {provider.name} provider")
+            tracker = CollectionTracker(self.tickers, windows, self.emit_source)
+            tracker.release(self.tickers)
+            writer = BulkWriter(data_collection.store, on_written=tracker.frames_written, recorder=self.recorders['collect'])
+
+            # Function to hand one fetched frame to the writer, counted so the tracker knows when it is stored
+            def save(data, ticker):
+                writer.put(tracker.frame_queued(prepare_for_db(data, ticker, data_collection.store)))
+
+            _, stats = collect(windows, provider, save, on_batch_done=tracker.batch_done,
+                               recorder=self.recorders['collect'])
+            writer.close()
+            tracker.release_all()
+            stats.report()
+            writer.report()
+            data_collection.finish_collection(stats.empty_windows, known_gaps, empty_tickers)
+        except Exception as e:
+            print(f"Data collection stopped: {e}")
+            self.recorders['collect'].error(None, e)
+            tracker.release_all(error=str(e))
+        self.events.put(('source_done',))
+
+    # Function to queue a ticker coming out of collection (or the ticker list) for the main loop
+    def emit_source(self, ticker, ok, error):
+        self.events.put(('source', ticker, ok, error))
+
+    # Function to move a ticker past a finished stage: record a failure, or submit its next stage
+    def on_stage_done(self, stage, ticker, ok, error):
+        if stage:
+            self.counts[stage] += ok
+        if not ok:
+            self.failures[ticker] = (stage, error)
+            return
+        next_stage = self.next_stage(stage)
+        if next_stage == 'clean':
+            self.submit_cleaning(ticker)
+        elif next_stage == 'predict':
+            self.queue_prediction(ticker)
+
+    # Function to clean one ticker on the cleaning pool
+    def submit_cleaning(self, ticker):
+        self.in_flight += 1
+        self.cleaning_in_flight += 1
+        future = self.cleaning_pool.submit(self.clean, ticker)
+        future.add_done_callback(lambda future: self.events.put(('clean', future.result())))
+
+    # Function to clean one ticker unless its raw rows are unchanged since its watermark
+    def clean(self, ticker):
+        try:
+            stats = data_cleaning.source_store.stats([ticker])
+            if stats.empty:
+                self.recorders['clean'].error(ticker, 'no raw data')
+                return {'ticker': ticker, 'success': False, 'error': 'no raw data'}
+            stats = stats.iloc[0]
+            watermark = self.watermarks.get(ticker)
+            if not data_cleaning.needs_cleaning(watermark, stats):
+                return {'ticker': ticker, 'success': True, 'skipped': True}
+            return data_cleaning.clean_ticker(ticker, watermark, int(stats['rows']), self.recorders['clean'])
+        except Exception as e:
+            self.recorders['clean'].error(ticker, e)
+            return {'ticker': ticker, 'success': False, 'error': str(e)}
+
+    # Function to record a cleaning result and pass the ticker on
+    def on_cleaned(self, result):
+        if result.get('skipped'):
+            self.skipped += 1
+        elif result['success']:
+            self.new_watermarks[result['ticker']] = result['watermark']
+        self.on_stage_done('clean', result['ticker'], result['success'], result.get('error'))
+
+    # Function to forecast a ticker: Prophet tickers are submitted alone, ridge ones in batches of RIDGE_BATCH_SIZE
+    def queue_prediction(self, ticker):
+        model_name = self.models.get(ticker, prophet_config.FORECAST_MODEL)
+        if model_name == 'ridge':
+            self.ridge_batch.append(ticker)
+            if len(self.ridge_batch) >= prophet_config.RIDGE_BATCH_SIZE:
+                self.submit_prediction('ridge', self.ridge_batch)
+                self.ridge_batch = []
+        else:
+            self.submit_prediction(model_name, [ticker])
+
+    # Function to submit one forecasting task to the prediction pool
+    def submit_prediction(self, model_name, tickers):
+        self.in_flight += 1
+
+        # Function to hand the task's results (or its failure) back to the main loop
+        def done(future):
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{'ticker': ticker, 'success': False, 'error': str(e), 'seconds': 0.0} for ticker in tickers]
+            self.events.put(('predict', results))
+
+        self.prediction_pool.submit(prediction.process_task, (model_name, tickers)).add_done_callback(done)
+
+    # Function to hand one forecast to the prediction run
+    def on_predicted(self, result):
+        self.prediction_results.append(result)
+        self.prediction_run.on_result(result)
+        self.on_stage_done('predict', result['ticker'], result['success'], result.get('error'))
+
+    # Function to close every stage of the run and print its summary
+    def finish(self, wall_seconds):
+        if 'collect' in self.stages:
+            self.recorders['collect'].finish()
+        if 'clean' in self.stages:
+            self.watermarks.update(self.new_watermarks)
+            data_cleaning.write_watermarks(data_cleaning.watermark_file, self.watermarks)
+            data_cleaning.log_completion()
+            print(f"Cleaned {len(self.new_watermarks)} tickers, {self.skipped} unchanged")
+            self.recorders['clean'].finish()
+        if 'predict' in self.stages:
+            self.prediction_run.finish(self.prediction_results,
+                                       make_report(self.prediction_results, self.max_workers, wall_seconds))
+            if prophet_config.RENDER_PLOTS:
+                import render
+                render.main(tickers=[result['ticker'] for result in self.prediction_results if result['success']])
+
+        print(f"Pipeline finished in {wall_seconds:.1f}s: " + ', '.join(f"{stage} {count}" for stage, count in self.counts.items()))
+        if self.failures:
+            print(f"{len(self.failures)} tickers failed:")
+            for ticker, (stage, error) in sorted(self.failures.items()):
+                print(f"{ticker} ({stage}): {error}")
+
+# Function to list the tickers of a run: the configured universe when collecting, else those held by the first store read
+def default_tickers(stages, offline=None):
+    if 'collect' in stages:
+        return data_collection.get_combined_tickers(offline)
+    if 'clean' in stages:
+        return data_cleaning.source_store.tickers()
+    return prediction.data_store.tickers()
+
+# Main function to run the selected stages, returning the failed tickers
+def main(stages=None, tickers=None, provider=None, model=None, max_workers=None, full_refresh=False, offline=None):
+    stages = stages or STAGES
+    pipeline = Pipeline(stages, tickers or default_tickers(stages, offline), model, max_workers, full_refresh)
+    return pipeline.run(provider)
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('pipeline', sys.modules[__name__])
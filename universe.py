@@ -0,0 +1,182 @@
+# universe.py
+# ../universe.py
+# Ticker universe snapshots: the membership of each source (S&P 500, Russell 3000, ETFs) stored locally by date,
+# refreshed only when older than a TTL, usable offline, diffed between snapshots and queryable as of a past date
+
+import sys
+import hashlib
+import datetime
+import pandas as pd
+from sqlalchemy import create_engine
+import config
+
+# Function to fetch the current S&P 500 tickers from Wikipedia
+def fetch_sp500():
+    import requests
+    response = requests.get('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies', timeout=30)
+    response.raise_for_status()
+    df = pd.read_html(response.text)[0]
+    return df['Symbol'].tolist()
+
+# Function to read the Russell 3000 tickers from their CSV file
+def fetch_russell_3000():
+    return pd.read_csv(config.RUSSELL_3000_CSV)['Company Ticker'].tolist()
+
+# Function to read the ETF tickers from their CSV file
+def fetch_etfs():
+    return pd.read_csv(config.ETFs_CSV)['Symbol'].tolist()
+
+SOURCES = {'sp500': fetch_sp500, 'russell_3000': fetch_russell_3000, 'etfs': fetch_etfs}
+
+# Function to list the sources enabled by the RETRIEVE_* flags of config.py
+def configured_sources():
+    flags = {'sp500': config.RETRIEVE_SP500, 'russell_3000': config.RETRIEVE_RUSSELL_3000, 'etfs': config.RETRIEVE_ETFs}
+    return [source for source, enabled in flags.items() if enabled]
+
+# Function to normalize fetched symbols to the provider's form (BRK.B -> BRK-B), sorted and without duplicates
+def normalize(tickers):
+    return sorted({str(ticker).strip().replace('.', '-') for ticker in tickers if isinstance(ticker, str) and ticker.strip()})
+
+# SQLite store of dated membership snapshots. A new snapshot is only written when the membership changed;
+# otherwise the latest one is marked as checked, which is what the TTL is measured against
+class UniverseStore:
+    def __init__(self, path=None):
+        self.engine = create_engine(f"sqlite:///{path or config.UNIVERSE_DATABASE_PATH}")
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE IF NOT EXISTS universe_snapshots (source TEXT NOT NULL, snapshot_date TEXT NOT NULL, '
+                'checked_at TEXT, tickers INTEGER, content_hash TEXT, PRIMARY KEY (source, snapshot_date))'
+            )
+            conn.exec_driver_sql(
+                'CREATE TABLE IF NOT EXISTS universe_members (source TEXT NOT NULL, snapshot_date TEXT NOT NULL, '
+                'ticker TEXT NOT NULL, PRIMARY KEY (source, snapshot_date, ticker)) WITHOUT ROWID'
+            )
+
+    # Function to list the snapshot dates of a source, oldest first
+    def snapshot_dates(self, source):
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql('SELECT snapshot_date FROM universe_snapshots WHERE source = ? ORDER BY snapshot_date',
+                                        (source,))
+            return [row[0] for row in rows]
+
+    # Function to return the latest snapshot (snapshot_date, checked_at, content_hash) of a source on or before
+    # as_of (any date when None), or None
+    def latest(self, source, as_of=None):
+        as_of = str(as_of or '9999-12-31')
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql(
+                'SELECT snapshot_date, checked_at, content_hash FROM universe_snapshots WHERE source = ? AND snapshot_date <= ? '
+                'ORDER BY snapshot_date DESC LIMIT 1', (source, as_of)
+            ).first()
+        return None if row is None else tuple(row)
+
+    # Function to return the tickers of one snapshot
+    def members(self, source, snapshot_date):
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql('SELECT ticker FROM universe_members WHERE source = ? AND snapshot_date = ? ORDER BY ticker',
+                                        (source, snapshot_date))
+            return [row[0] for row in rows]
+
+    # Function to record a fetched membership as today's snapshot, or mark the latest one checked when unchanged
+    # Returns True when a new snapshot was written
+    def save(self, source, tickers, today=None):
+        today = str(today or datetime.date.today())
+        checked_at = datetime.datetime.now().isoformat(timespec='seconds')
+        content_hash = hashlib.sha1('\n'.join(tickers).encode()).hexdigest()
+        latest = self.latest(source)
+        with self.engine.begin() as conn:
+            if latest is not None and latest[2] == content_hash:
+                conn.exec_driver_sql('UPDATE universe_snapshots SET checked_at = ? WHERE source = ? AND snapshot_date = ?',
+                                     (checked_at, source, latest[0]))
+                return False
+            conn.exec_driver_sql('DELETE FROM universe_members WHERE source = ? AND snapshot_date = ?', (source, today))
+            conn.exec_driver_sql('INSERT OR REPLACE INTO universe_snapshots VALUES (?, ?, ?, ?, ?)',
+                                 (source, today, checked_at, len(tickers), content_hash))
+            conn.exec_driver_sql('INSERT INTO universe_members VALUES (?, ?, ?)', [(source, today, ticker) for ticker in tickers])
+        return True
+
+universe_store = UniverseStore()
+
+# Function to reject a fetched membership that is empty or drops too many of the previous snapshot's tickers
+def check_fetch(tickers, previous):
+    if not tickers:
+        raise ValueError("the fetch returned no tickers")
+    removed = set(previous) - set(tickers)
+    if previous and len(removed) > config.UNIVERSE_MAX_REMOVED_SHARE * len(previous):
+        raise ValueError(f"the fetch drops {len(removed)} of the {len(previous)} tickers of the previous snapshot "
+                         f"(more than UNIVERSE_MAX_REMOVED_SHARE = {config.UNIVERSE_MAX_REMOVED_SHARE})")
+
+# Function to return the current tickers of a source: the latest snapshot while it is younger than ttl_days (or when
+# offline), else a fresh fetch saved as a snapshot. A failed fetch, or one rejected by check_fetch, falls back to
+# the latest snapshot.
+def source_tickers(source, ttl_days=None, offline=None, refresh=False):
+    ttl_days = config.UNIVERSE_TTL_DAYS if ttl_days is None else ttl_days
+    offline = config.UNIVERSE_OFFLINE if offline is None else offline
+    latest = universe_store.latest(source)
+    if latest is not None and not refresh:
+        age = datetime.datetime.now() - datetime.datetime.fromisoformat(latest[1])
+        if offline or age < datetime.timedelta(days=ttl_days):
+            return universe_store.members(source, latest[0])
+    if offline:
+        print(f"No {source} snapshot stored; run once online to create one")
+        return []
+    try:
+        tickers = normalize(SOURCES[source]())
+        check_fetch(tickers, universe_store.members(source, latest[0]) if latest is not None else [])
+    except Exception as e:
+        if latest is None:
+            print(f"Could not fetch {source} tickers and no snapshot is stored: {e}")
+            return []
+        print(f"Could not fetch {source} tickers, using the snapshot of {latest[0]}: {e}")
+        return universe_store.members(source, latest[0])
+    if universe_store.save(source, tickers):
+        added, removed = diff(source)
+        print(f"Saved a new {source} snapshot: {len(tickers)} tickers, +{len(added)} -{len(removed)} since the previous one")
+    return tickers
+
+# Function to diff two snapshots of a source (the last two by default), returning (added, removed)
+def diff(source, old_date=None, new_date=None):
+    dates = universe_store.snapshot_dates(source)
+    new_date = new_date or (dates[-1] if dates else None)
+    old_date = old_date or next((date for date in reversed(dates) if date < str(new_date)), None)
+    new = set(universe_store.members(source, new_date)) if new_date else set()
+    old = set(universe_store.members(source, old_date)) if old_date else set()
+    return sorted(new - old), sorted(old - new)
+
+# Function to return the combined current tickers of the sources (the configured ones by default)
+def current_tickers(sources=None, ttl_days=None, offline=None, refresh=False):
+    tickers = set()
+    for source in sources or configured_sources():
+        tickers.update(source_tickers(source, ttl_days, offline, refresh))
+    return sorted(tickers)
+
+# Function to return the combined membership as of a past date from the stored snapshots (point in time, e.g. for
+# backtests free of survivorship bias); sources without a snapshot on or before the date contribute nothing
+def members_as_of(as_of, sources=None):
+    tickers = set()
+    for source in sources or configured_sources():
+        latest = universe_store.latest(source, as_of)
+        if latest is not None:
+            tickers.update(universe_store.members(source, latest[0]))
+    return sorted(tickers)
+
+# Main function to show the membership of the sources (current, or as of a past date) and the changes since the
+# previous snapshot of each
+def main(sources=None, refresh=False, offline=None, as_of=None):
+    sources = sources or configured_sources()
+    if as_of:
+        print(f"{len(members_as_of(as_of, sources))} tickers as of {as_of}")
+        return
+    for source in sources:
+        tickers = source_tickers(source, offline=offline, refresh=refresh)
+        added, removed = diff(source)
+        dates = universe_store.snapshot_dates(source)
+        print(f"{source}: {len(tickers)} tickers, {len(dates)} snapshots (latest {dates[-1] if dates else 'none'}), "
+              f"+{len(added)} -{len(removed)} since the previous snapshot")
+        if added or removed:
+            print(f"  added: {' '.join(added)}")
+            print(f"  removed: {' '.join(removed)}")
+
+if __name__ == "__main__":
+    import cli
+    cli.run_script('universe', sys.modules[__name__])